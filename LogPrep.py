@@ -1,11 +1,26 @@
 import os
 import argparse
+import logging
 import pandas as pd
-from src.log_preprocess import get_templates_using_drain3, get_logs_df, get_structured_logs_df
-from src.utils import common_logger
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from src.log_preprocess import get_templates_using_drain3, get_logs_df, get_structured_logs_df, \
+    write_structured_logs_in_chunks, iter_logs_df, write_chunks, PARSE_ENGINES
+from src.output_format import OUTPUT_FORMATS, DataFrameWriter, get_output_file, check_output_format
+from src.utils import common_logger, estimate_memory_usage, get_available_memory
+from src.metrics import metrics
+from src.parse_cache import ParsedLogCache, PARSE_CACHE_SIZE
+from src.log_follow import follow_logs
 from config import settings
 
 
+def positive_int(value: str):
+    # argparse type of the counts and sizes, e.g., 0 processes would never run anything
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'{value} is not a positive integer')
+    return number
+
+
 def main():
     # argument parsing
     parser = argparse.ArgumentParser()
@@ -16,9 +31,72 @@ def main():
                         action='store_true', default=False)
     parser.add_argument('-dm', '--drop_message', help="Drop messages in the structured log",
                         action='store_true', default=False)
+    parser.add_argument('-j', '--jobs', help="Number of processes for parsing logs, mining templates (-it without "
+                                             "-cs/-inc), and matching templates (default: 1)",
+                        type=positive_int, default=1)
+    parser.add_argument('-cs', '--chunk_size', help="Stream logs in chunks of the given number of lines "
+                                                    "to bound the memory usage (default: load all logs at once)",
+                        type=positive_int, default=None)
+    parser.add_argument('-pe', '--parse_engine', help="Parsing engine for unstructured logs: `line` iterates over "
+                                                      "the lines, `mmap` scans the memory-mapped file as a whole "
+                                                      "(default: line)",
+                        choices=PARSE_ENGINES, default='line')
+    parser.add_argument('-inc', '--incremental', help="With -it, mine only the log files (or the lines appended to "
+                                                      "them) that are new since the last incremental run, on top of "
+                                                      "the Drain3 state saved in output/<system> (default: false)",
+                        action='store_true', default=False)
+    parser.add_argument('-sm', '--sample_mining', help="With -it, mine templates only from a sample of about the given "
+                                                       "number of lines (stratified by log file, component, and "
+                                                       "level), match the other lines against them, and mine the "
+                                                       "ones not matching (default: mine all lines)",
+                        type=positive_int, default=None)
+    parser.add_argument('-smc', '--sample_mining_compare', help="With -sm, mine all lines as well to report the "
+                                                                "accuracy of the sampling (default: false)",
+                        action='store_true', default=False)
+    parser.add_argument('-of', '--output_format', help="Format of the output files: `parquet` and `feather` store "
+                                                       "compact, typed columns and require pyarrow (default: csv)",
+                        choices=OUTPUT_FORMATS, default='csv')
+    parser.add_argument('-vs', '--virtual_split', help="Split logs by log_split_keyword while parsing them instead of "
+                                                       "writing split log files under <log_dir>/split (default: false)",
+                        action='store_true', default=False)
+    parser.add_argument('-pr', '--profile', help="Dump cProfile data of each stage of each system into "
+                                                 "_logs/LogPrep_<run>_profile (default: false)",
+                        action='store_true', default=False)
+    parser.add_argument('-ps', '--parallel_systems', help="Run up to the given number of systems at a time, each in "
+                                                          "its own process, as many as the available memory allows; "
+                                                          "a failing system is reported without stopping the others "
+                                                          "(default: one by one)",
+                        type=positive_int, default=None)
+    parser.add_argument('-pc', '--parse_cache', help="Cache parsed log files in the given directory, so that the "
+                                                     "next runs (of any mode, but without -cs) parse only the log "
+                                                     "files that are new or modified since (default: no cache)",
+                        type=str, default=None)
+    parser.add_argument('-pcs', '--parse_cache_size', help="Maximum size (MB) of the parse cache; the least recently "
+                                                           f"used files are evicted (default: "
+                                                           f"{PARSE_CACHE_SIZE // 1024 ** 2})",
+                        type=positive_int, default=PARSE_CACHE_SIZE // 1024 ** 2)
+    parser.add_argument('-pl', '--pipeline', help="Read the next log files and write the structured log in "
+                                                  "background threads, while parsing (and matching), to hide the "
+                                                  "I/O latency, e.g., of network storage (default: false)",
+                        action='store_true', default=False)
+    parser.add_argument('-f', '--follow', help="Keep following the log files (incl. rotated and new ones) and "
+                                               "append each new line to the structured log (csv) as it comes, with "
+                                               "-it or -mlt if given, until Ctrl-C; use -ps to follow several "
+                                               "systems (default: false)",
+                        action='store_true', default=False)
+    parser.add_argument('-ft', '--follow_timeout', help="With -f, stop following once no line has been appended "
+                                                        "for the given number of seconds (default: never)",
+                        type=float, default=None)
     args = parser.parse_args()
+    check_output_format(args.output_format)
+    if args.follow and args.output_format != 'csv':
+        print('ERROR: -f appends to the structured log, which requires -of csv')
+        exit(-1)
 
     logger, timestamp = common_logger('LogPrep')
+    # per-stage metrics (and profiles) of each system, next to the run log
+    metrics.start(os.path.join('_logs', f'LogPrep_{timestamp}_metrics.jsonl'),
+                  profile_dir=os.path.join('_logs', f'LogPrep_{timestamp}_profile') if args.profile else None)
     print(f'system={args.system}, '
           f'identify_templates={args.identify_templates}, '
           f'merge_logs_and_templates={args.merge_logs_and_templates}')
@@ -31,56 +109,160 @@ def main():
     else:
         systems = [args.system]
 
-    summary = []
-    for system in systems:
-        print('-'*80)
-        print(f'{system}')
-        logger.info(f'system={system}')
+    if args.parallel_systems is None:
+        summary = []
+        for system in systems:
+            print('-'*80)
+            print(f'{system}')
+            logger.info(f'system={system}')
+            metrics.start_system(system)
+            summary.append(run_system(system, args))
+        failures = []
+    else:
+        summary, failures = run_systems_in_parallel(systems, args, log_id=timestamp)
+
+    if args.identify_templates:
+        print('\n=== Template Identification Summary ===')
+        summary_df = pd.DataFrame(summary, columns=['system', 'templates'])
+
+    elif args.merge_logs_and_templates:
+        print('\n=== Structured Log Summary ===')
+        summary_df = pd.DataFrame(summary, columns=['system', 'templates', 'log messages'])
+
+    else:
+        print('\n=== Preprocessed Log Summary (No Template) ===')
+        summary_df = pd.DataFrame(summary, columns=['system', 'log messages'])
+
+    print(summary_df)
+    metrics.finish(args=vars(args))
+    print(f'Stage metrics: {metrics.report_file}')
+
+    if len(failures) > 0:
+        print('\n=== Failed Systems ===')
+        print(pd.DataFrame(failures, columns=['system', 'error']))
+        logger.error(f'run_preprocess: ends with {len(failures)} failed systems')
+        exit(-1)
+    logger.info('run_preprocess: ends without errors')
+
 
+def run_system(system: str, args: argparse.Namespace):
+    """
+    Preprocess the logs of the given system according to the arguments, and return its row of the summary table.
+    """
+    if args.follow:
+        num_lines, num_templates = follow_logs(
+            system=system,
+            log_dir=settings[system]['log_dir'],
+            file_ext=settings[system]['file_ext'],
+            log_format=settings[system]['log_format'],
+            output_dir=os.path.join('output', system),
+            mode='mining' if args.identify_templates else 'matching' if args.merge_logs_and_templates else 'convert',
+            template_dir=settings[system].get('template_dir'),
+            drop_message=args.drop_message,
+            timeout=args.follow_timeout
+        )
         if args.identify_templates:
-            num_templates = get_templates_using_drain3(
+            return [system, num_templates]
+        elif args.merge_logs_and_templates:
+            return [system, num_templates, num_lines]
+        return [system, num_lines]
+
+    parse_cache = None
+    if args.parse_cache is not None:
+        parse_cache = ParsedLogCache(args.parse_cache, max_size=args.parse_cache_size * 1024 ** 2)
+
+    if args.identify_templates:
+        num_templates = get_templates_using_drain3(
+            system=system,
+            log_dir=settings[system]['log_dir'],
+            file_ext=settings[system]['file_ext'],
+            log_format=settings[system]['log_format'],
+            output_dir=os.path.join('output', system),
+            drop_message=args.drop_message,
+            chunk_size=args.chunk_size,
+            jobs=args.jobs,
+            engine=args.parse_engine,
+            incremental=args.incremental,
+            output_format=args.output_format,
+            parse_cache=parse_cache,
+            pipeline=args.pipeline,
+            sample_size=args.sample_mining,
+            compare_sampling=args.sample_mining_compare,
+            csv_schema=settings[system].get('csv_schema')
+        )
+        return [system, num_templates]
+
+    elif args.merge_logs_and_templates:
+        # merge logs (either unstructured or structured) and templates (just a list of templates in .csv)
+
+        if 'log_split_keyword' in settings[system].keys():
+            log_split_keyword = settings[system]['log_split_keyword']
+        else:
+            log_split_keyword = None
+
+        if args.chunk_size is None:
+            structured_logs_df, templates_df = get_structured_logs_df(
                 system=system,
                 log_dir=settings[system]['log_dir'],
                 file_ext=settings[system]['file_ext'],
                 log_format=settings[system]['log_format'],
+                template_dir=settings[system]['template_dir'],
                 output_dir=os.path.join('output', system),
-                drop_message=args.drop_message
+                log_split_keyword=log_split_keyword,
+                jobs=args.jobs,
+                engine=args.parse_engine,
+                output_format=args.output_format,
+                virtual_split=args.virtual_split,
+                parse_cache=parse_cache,
+                pipeline=args.pipeline,
+                csv_schema=settings[system].get('csv_schema')
             )
-            summary.append([system, num_templates])
-
-        elif args.merge_logs_and_templates:
-            # merge logs (either unstructured or structured) and templates (just a list of templates in .csv)
-
-            if 'log_split_keyword' in settings[system].keys():
-                log_split_keyword = settings[system]['log_split_keyword']
-            else:
-                log_split_keyword = None
-
-            structured_logs_df, templates_df = get_structured_logs_df(
+            num_log_messages = len(structured_logs_df)
+        else:
+            templates_df, num_log_messages = write_structured_logs_in_chunks(
                 system=system,
                 log_dir=settings[system]['log_dir'],
                 file_ext=settings[system]['file_ext'],
                 log_format=settings[system]['log_format'],
                 template_dir=settings[system]['template_dir'],
                 output_dir=os.path.join('output', system),
-                log_split_keyword=log_split_keyword
+                log_split_keyword=log_split_keyword,
+                jobs=args.jobs,
+                chunk_size=args.chunk_size,
+                engine=args.parse_engine,
+                output_format=args.output_format,
+                virtual_split=args.virtual_split,
+                pipeline=args.pipeline,
+                csv_schema=settings[system].get('csv_schema')
             )
-            summary.append([system, len(templates_df), len(structured_logs_df)])
+        return [system, len(templates_df), num_log_messages]
 
+    else:
+        # simply convert unstructured logs into structured one (.csv)
+
+        if 'log_split_keyword' in settings[system].keys():
+            log_split_keyword = settings[system]['log_split_keyword']
         else:
-            # simply convert unstructured logs into structured one (.csv)
+            log_split_keyword = None
 
-            if 'log_split_keyword' in settings[system].keys():
-                log_split_keyword = settings[system]['log_split_keyword']
-            else:
-                log_split_keyword = None
+        # save structured logs
+        output_dir = os.path.join('output', system)
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
 
+        if args.chunk_size is None:
             logs_df = get_logs_df(
                 system=system,
                 log_dir=settings[system]['log_dir'],
                 file_ext=settings[system]['file_ext'],
                 log_format=settings[system]['log_format'],
-                log_split_keyword=log_split_keyword
+                log_split_keyword=log_split_keyword,
+                jobs=args.jobs,
+                engine=args.parse_engine,
+                virtual_split=args.virtual_split,
+                parse_cache=parse_cache,
+                pipeline=args.pipeline,
+                csv_schema=settings[system].get('csv_schema')
             )
 
             # # (level_filtering) keep specified levels only
@@ -94,28 +276,105 @@ def main():
             #     logs_df = pd.concat(logs_dfs)
             #     assert (len(logs_df) > 0)
 
-            # save templates
-            output_dir = os.path.join('output', system)
-            if not os.path.exists(output_dir):
-                os.makedirs(output_dir)
+            with DataFrameWriter(get_output_file(output_dir, system, args.output_format),
+                                 args.output_format, background=args.pipeline) as writer:
+                writer.write(logs_df)
+            num_log_messages = len(logs_df)
+        else:
+            logs_dfs = iter_logs_df(
+                system=system,
+                log_dir=settings[system]['log_dir'],
+                file_ext=settings[system]['file_ext'],
+                log_format=settings[system]['log_format'],
+                log_split_keyword=log_split_keyword,
+                chunk_size=args.chunk_size,
+                jobs=args.jobs,
+                engine=args.parse_engine,
+                virtual_split=args.virtual_split,
+                pipeline=args.pipeline,
+                csv_schema=settings[system].get('csv_schema')
+            )
+            num_log_messages = write_chunks(logs_dfs, get_output_file(output_dir, system, args.output_format),
+                                            output_format=args.output_format, background=args.pipeline)
+        return [system, num_log_messages]
 
-            logs_df.to_csv(os.path.join('output', system, f'{system}.csv'), index=False)
-            summary.append([system, len(logs_df)])
 
-    if args.identify_templates:
-        print('\n=== Template Identification Summary ===')
-        summary_df = pd.DataFrame(summary, columns=['system', 'templates'])
+def run_systems_in_parallel(systems: list, args: argparse.Namespace, log_id: str):
+    """
+    Run run_system() for each system in its own process, up to args.parallel_systems at a time, as long as the sum
+    of their estimated memory usage (see src.utils.estimate_memory_usage()) fits in the available memory; a system
+    that does not fit even alone runs alone. The largest systems start first, not to wait for them at the end.
+    A failing system (an exception, exit(), or even a crash of its process) does not stop the others.
 
-    elif args.merge_logs_and_templates:
-        print('\n=== Structured Log Summary ===')
-        summary_df = pd.DataFrame(summary, columns=['system', 'templates', 'log messages'])
+    :param systems: system names
+    :param args: arguments
+    :param log_id: log_id of the run log, for the worker processes to log into it
+    :return: a list of summary rows (in the order of systems, without the failed ones) and a list of (system, error)
+    """
+    estimates = {system: estimate_memory_usage(settings[system]['log_dir'], settings[system]['file_ext'],
+                                               chunk_size=args.chunk_size) for system in systems}
+    budget = get_available_memory() or float('inf')
+    logger = logging.getLogger('LogPrep')
+    logger.info(f'run_systems_in_parallel: {len(systems)} systems, parallel_systems={args.parallel_systems}, '
+                f'available memory={budget / 2 ** 20:.0f} MB, estimates (MB)='
+                f'{ {system: round(estimate / 2 ** 20) for system, estimate in estimates.items()} }')
 
-    else:
-        print('\n=== Preprocessed Log Summary (No Template) ===')
-        summary_df = pd.DataFrame(summary, columns=['system', 'log messages'])
+    pending = sorted(systems, key=lambda system: estimates[system], reverse=True)
+    running = {}  # future -> (system, executor)
+    results = {}
+    while len(pending) > 0 or len(running) > 0:
+        while len(pending) > 0 and len(running) < args.parallel_systems:
+            usage = sum(estimates[system] for system, _ in running.values())
+            system = next((system for system in pending if usage + estimates[system] <= budget), None)
+            if system is None:
+                if len(running) > 0:
+                    break  # wait for memory
+                system = pending[0]
+            pending.remove(system)
+            # a process per system, so that a crash (e.g., killed for memory) breaks nothing but the system
+            executor = ProcessPoolExecutor(max_workers=1, initializer=init_system_worker,
+                                           initargs=(log_id, metrics.report_file, metrics.profile_dir))
+            running[executor.submit(run_system_in_worker, system, settings[system], args)] = (system, executor)
+            logger.info(f'run_systems_in_parallel: {system} started')
 
-    print(summary_df)
-    logger.info('run_preprocess: ends without errors')
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            system, executor = running.pop(future)
+            try:
+                results[system] = future.result()
+            except Exception as e:
+                results[system] = None, f'{type(e).__name__}: {e}'
+            executor.shutdown()
+            logger.info(f'run_systems_in_parallel: {system} done (error={results[system][1]})')
+
+    summary = [results[system][0] for system in systems if results[system][1] is None]
+    failures = [(system, results[system][1]) for system in systems if results[system][1] is not None]
+    return summary, failures
+
+
+def init_system_worker(log_id: str, report_file: str, profile_dir: str):
+    common_logger('LogPrep', log_id=log_id)
+    metrics.start(report_file, profile_dir=profile_dir)
+
+
+def run_system_in_worker(system: str, system_settings: dict, args: argparse.Namespace):
+    """
+    Same as run_system() with the given settings of the system (as in the parent process, whatever the start method),
+    but returns (row, error) instead of raising an error or exiting the process.
+    """
+    settings[system] = system_settings
+    print('-'*80)
+    print(f'{system}')
+    logger = logging.getLogger('LogPrep')
+    logger.info(f'system={system}')
+    metrics.start_system(system)
+    try:
+        return run_system(system, args), None
+    except (Exception, SystemExit) as e:
+        logger.exception(f'system={system} failed')
+        return None, f'exited with code {e.code}' if isinstance(e, SystemExit) else f'{type(e).__name__}: {e}'
+    finally:
+        metrics.end_system()
 
 
 if __name__ == '__main__':
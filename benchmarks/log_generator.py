@@ -0,0 +1,104 @@
+import os
+import re
+import random
+import pandas as pd
+from itertools import accumulate
+from datetime import datetime, timedelta
+
+import logging
+logger = logging.getLogger(__name__)
+
+WORDS = ['block', 'packet', 'responder', 'served', 'receiving', 'received', 'deleting', 'file', 'thread',
+         'transfer', 'exception', 'while', 'for', 'to', 'from', 'of', 'size', 'src', 'dest', 'added', 'updated',
+         'verification', 'succeeded', 'terminating', 'starting', 'ask', 'delete', 'allocate', 'namesystem',
+         'blockmap', 'replicate', 'node', 'datanode', 'invalid', 'request', 'writing', 'reading', 'closing']
+COMPONENTS = ['dfs.DataNode', 'dfs.DataNode$PacketResponder', 'dfs.DataNode$DataXceiver', 'dfs.FSNamesystem',
+              'dfs.FSDataset', 'dfs.DataBlockScanner', 'dfs.DataNode$BlockReceiver']
+LEVELS = ['INFO'] * 18 + ['WARN', 'ERROR']
+SESSION_TEMPLATE = 'Starting new session <*>'
+
+
+def generate_templates(num_templates: int, rand: random.Random):
+    """
+    Generate distinct HDFS-like templates having 4 to 13 tokens, 1 to 3 of which are parameters (`<*>`).
+    Each template has a word of its own (e.g., `block7`), so that no message matches two templates.
+
+    :param num_templates: number of templates
+    :param rand: random number generator
+    :return: a list of templates
+    """
+    templates = []
+    for i in range(num_templates):
+        tokens = [rand.choice(WORDS) for _ in range(rand.randint(2, 9))] + [f'{rand.choice(WORDS)}{i}']
+        for _ in range(rand.randint(1, 3)):
+            param = rand.choice(['<*>', 'blk_<*>', '<*>:<*>', '/<*>'])
+            tokens.insert(rand.randint(1, len(tokens)), param)
+        templates.append(' '.join(tokens))
+    return templates
+
+
+def generate_logs(log_dir: str, log_format: str, num_lines: int, num_templates: int = 50, cardinality: int = 1000,
+                  num_files: int = 1, session_length: int = 1000, seed: int = 0, system: str = 'Synthetic'):
+    """
+    Generate unstructured logs following the given log_format (e.g., the one of HDFS in dataset/sample/setup.py),
+    together with their templates (`{system}_templates.csv` in log_dir, as expected by `-mlt`).
+
+    The messages are drawn from num_templates templates (with a Zipf-like skew, as in real logs), and each parameter
+    takes one of `cardinality` values. The known fields (date, time, process, level, component) look like HDFS ones;
+    the other fields are random tokens. Every session_length lines, a session starts with a line having the
+    `Starting new session` message, which can be used as log_split_keyword. The same seed gives the same logs.
+
+    :param log_dir: directory to write `{system}_{i}.log` files into (created if needed)
+    :param log_format: log format (e.g., '<date> <time> <process> <level> <component>: <message>')
+    :param num_lines: total number of lines
+    :param num_templates: number of templates (besides the session one)
+    :param cardinality: number of distinct values per parameter
+    :param num_files: number of log files (the lines are evenly distributed)
+    :param session_length: number of lines per session
+    :param seed: random seed
+    :param system: system name used for file names
+    :return: a list of the generated log files (with path) and the templates file
+    """
+    rand = random.Random(seed)
+    os.makedirs(log_dir, exist_ok=True)
+    templates = [SESSION_TEMPLATE] + generate_templates(num_templates, rand)
+    cum_weights = list(accumulate([0] + [1 / (rank + 1) for rank in range(num_templates)]))
+    components = [rand.choice(COMPONENTS) for _ in templates]
+    params = [str(rand.randrange(10 ** 9)) for _ in range(cardinality)]
+
+    # literal parts and fields of the log format, e.g., ['', '<date>', ' ', '<time>', ...]
+    parts = re.split(r'(<\S+?>)', log_format)
+    parts = [part if part.startswith('<') else re.sub(r'\\(.)', r'\1', part) for part in parts]
+
+    log_files = []
+    timestamp = datetime(2008, 11, 9, 20, 36, 15)
+    lines_per_file = -(-num_lines // num_files)
+    for i in range(num_files):
+        log_file = os.path.join(log_dir, f'{system}_{i + 1}.log')
+        with open(log_file, 'w') as f:
+            for line_id in range(i * lines_per_file, min(num_lines, (i + 1) * lines_per_file)):
+                if line_id % session_length == 0:
+                    t = 0
+                else:
+                    t = rand.choices(range(len(templates)), cum_weights=cum_weights)[0]
+                message = templates[t]
+                while '<*>' in message:
+                    message = message.replace('<*>', rand.choice(params), 1)
+                timestamp += timedelta(seconds=rand.randint(0, 2))
+                fields = {
+                    'date': timestamp.strftime('%y%m%d'),
+                    'time': timestamp.strftime('%H%M%S'),
+                    'process': str(rand.randint(1, 1000)),
+                    'level': rand.choice(LEVELS),
+                    'component': components[t],
+                    'message': message,
+                }
+                f.write(''.join(fields.get(part[1:-1], f'x{rand.randrange(cardinality)}') if part.startswith('<')
+                                else part for part in parts) + '\n')
+        log_files.append(log_file)
+        logger.debug(f'generate_logs: {log_file}')
+
+    templates_file = os.path.join(log_dir, f'{system}_templates.csv')
+    pd.DataFrame({'tid': [f'E{t + 1}' for t in range(len(templates))], 'template': templates}) \
+        .to_csv(templates_file, index=False)
+    return log_files, templates_file
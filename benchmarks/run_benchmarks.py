@@ -0,0 +1,209 @@
+import os
+import json
+import time
+import argparse
+import platform
+import tempfile
+import multiprocessing
+from contextlib import redirect_stdout, redirect_stderr
+from concurrent.futures import ProcessPoolExecutor
+from drain3 import TemplateMiner
+from src.log_preprocess import get_log_files_under_dir, split_log, load_logs_into_df, read_templates_into_df, \
+    match_templates, template_index, PARSE_ENGINES
+from src.template_mining import add_log_messages, mine_templates_in_parallel
+from src.output_format import OUTPUT_FORMATS, DataFrameWriter, get_output_file, check_output_format
+from src.metrics import get_peak_rss_mb
+from benchmarks.log_generator import generate_logs
+from config import settings
+
+STAGES = ['discovery', 'split_log', 'parsing', 'mining', 'matching', 'writing']
+SYSTEM = 'Synthetic'
+SESSION_KEYWORD = 'Starting new session'
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+MIN_SECONDS = 0.05  # shorter stages (e.g., discovery of a few files) are too noisy to compare their lines/sec
+
+
+def prepare_stage(stage: str, work_dir: str, log_format: str, jobs: int, engine: str, output_format: str):
+    """
+    Prepare the inputs of the given stage from the logs generated under work_dir/logs (e.g., parse them for mining),
+    and return a function running the stage itself, so that only the stage is timed.
+    """
+    log_dir = os.path.join(work_dir, 'logs')
+    log_files = get_log_files_under_dir(log_dir=log_dir, file_ext='.log')
+    if stage == 'discovery':
+        return lambda: get_log_files_under_dir(log_dir=log_dir, file_ext='.log')
+    if stage == 'split_log':
+        return lambda: split_log(system=SYSTEM, log_dir=log_dir, log_split_keyword=SESSION_KEYWORD,
+                                 output_dir=os.path.join(work_dir, 'split'))
+    if stage == 'parsing':
+        return lambda: load_logs_into_df(log_format=log_format, log_files=log_files, file_ext='.log', jobs=jobs,
+                                         engine=engine)
+
+    logs_df = load_logs_into_df(log_format=log_format, log_files=log_files, file_ext='.log', jobs=jobs, engine=engine)
+    if stage == 'mining':
+        if jobs > 1:
+            return lambda: mine_templates_in_parallel(logs_df['message'], jobs=jobs)
+        progress = {'line_count': 0, 'start_time': time.time(), 'batch_start_time': time.time()}
+        return lambda: add_log_messages(TemplateMiner(), logs_df['message'], progress)
+
+    template_index.build(read_templates_into_df(system=SYSTEM, template_dir=log_dir))
+    if stage == 'matching':
+        return lambda: match_templates(logs_df, jobs=jobs)
+
+    match_templates(logs_df, jobs=jobs)
+    output_file = get_output_file(work_dir, f'{SYSTEM}_structured_logs', output_format)
+
+    def write():
+        with DataFrameWriter(output_file, output_format) as writer:
+            writer.write(logs_df.copy())  # not to compact logs_df for the next repetition
+    return write
+
+
+def run_stage(stage: str, work_dir: str, log_format: str, jobs: int, engine: str, output_format: str):
+    """
+    Run the given stage (see prepare_stage()) in the current process, without its console output.
+
+    :return: seconds taken by the stage and the peak RSS (MB) of the process (incl. its inputs and worker processes)
+    """
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull), redirect_stderr(devnull):
+        run = prepare_stage(stage, work_dir, log_format, jobs, engine, output_format)
+        start_time = time.perf_counter()
+        run()
+        seconds = time.perf_counter() - start_time
+    return seconds, get_peak_rss_mb(children=True)
+
+
+def check_regressions(results: dict, baseline: dict, tolerance: float):
+    """
+    Compare the results with the baseline (both from run_benchmarks()) for the same stages and numbers of lines.
+    A stage regresses if its lines/sec is lower, or its peak RSS is higher, than the baseline by more than tolerance;
+    lines/sec is not compared if the stage took less than MIN_SECONDS in the baseline.
+
+    :param results: benchmark results
+    :param baseline: baseline results (with the same settings)
+    :param tolerance: allowed relative difference (e.g., 0.25 for 25%)
+    :return: a list of regression messages (empty if none)
+    """
+    regressions = []
+    base = {(r['stage'], r['num_lines']): r for r in baseline['results']}
+    for r in results['results']:
+        b = base.get((r['stage'], r['num_lines']))
+        if b is None:
+            continue
+        if b['seconds'] >= MIN_SECONDS and r['lines_per_sec'] < b['lines_per_sec'] * (1 - tolerance):
+            regressions.append(f"{r['stage']} ({r['num_lines']} lines): {r['lines_per_sec']:.1f} lines/sec, "
+                               f"baseline {b['lines_per_sec']:.1f} lines/sec")
+        if r['peak_rss_mb'] > b['peak_rss_mb'] * (1 + tolerance):
+            regressions.append(f"{r['stage']} ({r['num_lines']} lines): peak RSS {r['peak_rss_mb']:.1f} MB, "
+                               f"baseline {b['peak_rss_mb']:.1f} MB")
+    return regressions
+
+
+def run_benchmarks(log_format: str, num_lines: list, stages: list, num_templates: int = 50, cardinality: int = 1000,
+                   num_files: int = 1, seed: int = 0, jobs: int = 1, engine: str = 'line',
+                   output_format: str = 'csv', repeat: int = 3):
+    """
+    Generate synthetic logs of each size (see benchmarks.log_generator.generate_logs()) and run the given stages on
+    them. Each stage runs in a new process, so that its peak RSS does not include the other stages.
+
+    :return: results (settings, machine, and one result per stage and size), ready to be saved as JSON
+    """
+    results = {
+        'settings': {'log_format': log_format, 'num_templates': num_templates, 'cardinality': cardinality,
+                     'num_files': num_files, 'seed': seed, 'jobs': jobs, 'engine': engine,
+                     'output_format': output_format},
+        'machine': {'platform': platform.platform(), 'python': platform.python_version(), 'cpus': os.cpu_count()},
+        'results': [],
+    }
+    for n in num_lines:
+        with tempfile.TemporaryDirectory() as work_dir:
+            print(f'Generating {n} lines ...')
+            generate_logs(os.path.join(work_dir, 'logs'), log_format, num_lines=n, num_templates=num_templates,
+                          cardinality=cardinality, num_files=num_files, seed=seed, system=SYSTEM)
+            for stage in stages:
+                timings = []
+                for _ in range(repeat):
+                    # a new process for each run, not to measure the memory (and caches) of the other runs
+                    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+                        timings.append(pool.submit(run_stage, stage, work_dir, log_format, jobs, engine,
+                                                   output_format).result())
+                seconds = min(t[0] for t in timings)
+                result = {'stage': stage, 'num_lines': n, 'seconds': round(seconds, 4),
+                          'lines_per_sec': round(n / seconds, 1), 'peak_rss_mb': round(max(t[1] for t in timings), 1)}
+                print(f"{stage:>10}: {result['lines_per_sec']:>12.1f} lines/sec, "
+                      f"peak RSS {result['peak_rss_mb']:.1f} MB")
+                results['results'].append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--system', help="System whose log_format (in config.py) is used to generate logs "
+                                               "(default: HDFS)",
+                        type=str, default='HDFS')
+    parser.add_argument('-n', '--num_lines', help="Numbers of lines to generate, one benchmark per number "
+                                                  "(default: 10000 100000)",
+                        type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('-t', '--num_templates', help="Number of templates (default: 50)", type=int, default=50)
+    parser.add_argument('-c', '--cardinality', help="Number of distinct values per parameter (default: 1000)",
+                        type=int, default=1000)
+    parser.add_argument('-f', '--num_files', help="Number of log files (default: 1)", type=int, default=1)
+    parser.add_argument('--seed', help="Random seed of the log generator (default: 0)", type=int, default=0)
+    parser.add_argument('-st', '--stages', help="Stages to benchmark (default: all)",
+                        choices=STAGES, nargs='+', default=STAGES)
+    parser.add_argument('-j', '--jobs', help="Number of processes (default: 1)", type=int, default=1)
+    parser.add_argument('-pe', '--parse_engine', help="Parsing engine for unstructured logs (default: line)",
+                        choices=PARSE_ENGINES, default='line')
+    parser.add_argument('-of', '--output_format', help="Format of the output file for `writing` (default: csv)",
+                        choices=OUTPUT_FORMATS, default='csv')
+    parser.add_argument('-r', '--repeat', help="Number of runs per stage; the fastest one is reported (default: 3)",
+                        type=int, default=3)
+    parser.add_argument('-o', '--output', help="JSON file to save the results into "
+                                               "(default: output/benchmarks/results.json)",
+                        type=str, default=os.path.join('output', 'benchmarks', 'results.json'))
+    parser.add_argument('-b', '--baseline', help=f"JSON file of the baseline results (default: {DEFAULT_BASELINE})",
+                        type=str, default=DEFAULT_BASELINE)
+    parser.add_argument('-tol', '--tolerance', help="Allowed regression from the baseline, in lines/sec and peak "
+                                                    "RSS (default: 0.25, i.e., 25%%)",
+                        type=float, default=0.25)
+    parser.add_argument('-ub', '--update_baseline', help="Save the results as the baseline instead of comparing "
+                                                         "them with it (default: false)",
+                        action='store_true', default=False)
+    args = parser.parse_args()
+    check_output_format(args.output_format)
+    if not settings.get(args.system, {}).get('log_format'):
+        print(f'ERROR: {args.system} has no log_format for unstructured logs in config.py')
+        exit(-1)
+
+    results = run_benchmarks(log_format=settings[args.system]['log_format'], num_lines=args.num_lines,
+                             stages=args.stages, num_templates=args.num_templates, cardinality=args.cardinality,
+                             num_files=args.num_files, seed=args.seed, jobs=args.jobs, engine=args.parse_engine,
+                             output_format=args.output_format, repeat=args.repeat)
+
+    output_file = args.baseline if args.update_baseline else args.output
+    if os.path.dirname(output_file):
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    with open(output_file, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'Results saved: {output_file}')
+    if args.update_baseline:
+        return
+
+    if not os.path.isfile(args.baseline):
+        print(f'WARNING: No baseline to compare with: {args.baseline}')
+        return
+    with open(args.baseline, 'r') as f:
+        baseline = json.load(f)
+    if baseline['settings'] != results['settings']:
+        print(f'WARNING: The baseline has different settings, so it is not compared: {baseline["settings"]}')
+        return
+    regressions = check_regressions(results, baseline, tolerance=args.tolerance)
+    for regression in regressions:
+        print(f'REGRESSION: {regression}')
+    if len(regressions) > 0:
+        exit(-1)
+    print('No regression from the baseline')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+import io
+import os
+import bz2
+import gzip
+import lzma
+import time
+import queue
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+
+# compressed log files are read through these modules, e.g., HDFS.log.gz or Apache.csv.xz
+COMPRESSION_OPENERS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+DECOMPRESSION_BLOCK_SIZE = 1024 * 1024
+DECOMPRESSION_QUEUE_SIZE = 8
+PREFETCH_BLOCK_SIZE = 1024 * 1024
+PREFETCH_QUEUE_SIZE = 64
+CLOSE_TIMEOUT = 10  # seconds to wait for a background thread to stop when closing
+
+
+def get_compression(file_path: str):
+    """
+    Return the compression extension of the given file (e.g., `.gz`), or None if it is not compressed.
+    """
+    ext = os.path.splitext(file_path)[1]
+    return ext if ext in COMPRESSION_OPENERS else None
+
+
+def strip_compression(file_path: str):
+    """
+    Return the given file path without its compression extension, e.g., HDFS.log for HDFS.log.gz.
+    """
+    return file_path[:-len(get_compression(file_path))] if get_compression(file_path) else file_path
+
+
+def open_log_file(file_path: str, mode: str = 'r', errors: str = 'replace'):
+    """
+    Same as open(file_path, mode, errors=errors) for reading, but compressed files (see COMPRESSION_OPENERS) are
+    decompressed on the fly by a background thread (see BackgroundReader), so that the caller never waits on it.
+
+    :param file_path: log file to read
+    :param mode: `r` (text) or `rb` (binary)
+    :param errors: how to handle decoding errors (text mode only)
+    :return: file object
+    """
+    compression = get_compression(file_path)
+    if compression is None:
+        return open(file_path, mode, errors=errors) if mode == 'r' else open(file_path, mode)
+
+    reader = io.BufferedReader(BackgroundReader(COMPRESSION_OPENERS[compression](file_path, 'rb')),
+                               buffer_size=DECOMPRESSION_BLOCK_SIZE)
+    return io.TextIOWrapper(reader, errors=errors) if mode == 'r' else reader
+
+
+class QueueReader(io.RawIOBase):
+    """
+    Read-only raw stream of the blocks put into the given queue by another thread, until an empty block (the end)
+    or an exception (raised by readinto()).
+    """
+
+    def __init__(self, blocks: queue.Queue):
+        super().__init__()
+        self._blocks = blocks
+        self._block = memoryview(b'')
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while len(self._block) == 0:
+            if self._eof:
+                return 0
+            block = self._blocks.get()
+            if isinstance(block, Exception):
+                self._eof = True
+                raise block
+            if len(block) == 0:
+                self._eof = True
+                return 0
+            self._block = memoryview(block)
+
+        size = min(len(b), len(self._block))
+        b[:size] = self._block[:size]
+        self._block = self._block[size:]
+        return size
+
+
+class BackgroundReader(QueueReader):
+    """
+    Read-only raw stream that reads the given (binary) file object in a background thread, block by block.
+
+    zlib, bz2, and lzma release the GIL while decompressing, so the decompression of the next blocks runs in parallel
+    with the consumer (e.g., the log parser). At most queue_size blocks are read ahead.
+    """
+
+    def __init__(self, fileobj, block_size: int = DECOMPRESSION_BLOCK_SIZE, queue_size: int = DECOMPRESSION_QUEUE_SIZE):
+        super().__init__(queue.Queue(maxsize=queue_size))
+        self._fileobj = fileobj
+        self._block_size = block_size
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._read_blocks, daemon=True)
+        self._thread.start()
+
+    def _read_blocks(self):
+        try:
+            while not self._stop.is_set():
+                block = self._fileobj.read(self._block_size)
+                self._blocks.put(block)
+                if len(block) == 0:
+                    return
+        except Exception as e:
+            self._blocks.put(e)  # raised by the consumer
+
+    def close(self):
+        if not self.closed:
+            # unblock and stop the background thread before closing the file object it reads
+            self._stop.set()
+            if stop_thread(self._thread, self._blocks):
+                self._fileobj.close()
+        super().close()
+
+
+class FilePrefetcher:
+    """
+    Read the given files one after another in a background thread, block by block, so that the next files are
+    already being read while the current one is consumed (e.g., parsed); at most queue_size blocks are read ahead,
+    across files, so that the consumer is never waited for by more than queue_size * block_size bytes.
+
+    open_next() returns the files in the given order, as open_log_file() would (incl. decompression).
+    Call close() (or use `with`) to stop reading ahead, e.g., if not all the files are consumed.
+    """
+
+    def __init__(self, file_paths: list, block_size: int = PREFETCH_BLOCK_SIZE, queue_size: int = PREFETCH_QUEUE_SIZE):
+        self._file_paths = list(file_paths)
+        self._next = 0
+        self._block_size = block_size
+        self._blocks = queue.Queue(maxsize=queue_size)
+        self._files = []  # PrefetchedFile of each file opened by open_next()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._read_files, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _read_files(self):
+        try:
+            for file_path in self._file_paths:
+                with open(file_path, 'rb') as f:
+                    while not self._stop.is_set():
+                        block = f.read(self._block_size)
+                        self._blocks.put(block)  # an empty block ends each file
+                        if len(block) == 0:
+                            break
+                if self._stop.is_set():
+                    return
+        except Exception as e:
+            self._blocks.put(e)  # raised by the consumer of the file
+
+    def open_next(self, mode: str = 'r', errors: str = 'replace'):
+        """
+        Same as open_log_file() for the next file, which must be read to its end (or closed) before the one after.
+
+        :param mode: `r` (text) or `rb` (binary)
+        :param errors: how to handle decoding errors (text mode only)
+        :return: file object
+        """
+        file_path = self._file_paths[self._next]
+        self._next += 1
+        prefetched = PrefetchedFile(self._blocks)
+        self._files.append(prefetched)
+        reader = io.BufferedReader(prefetched, buffer_size=self._block_size)
+        compression = get_compression(file_path)
+        if compression is not None:
+            # decompressed by a thread of its own, while the next blocks are still read ahead
+            reader = io.BufferedReader(BackgroundReader(COMPRESSION_OPENERS[compression](reader, 'rb')),
+                                       buffer_size=DECOMPRESSION_BLOCK_SIZE)
+        return io.TextIOWrapper(reader, errors=errors) if mode == 'r' else reader
+
+    def close(self):
+        """
+        Stop reading ahead. The files opened by open_next() but not read to their end are ended by an error, so that
+        their readers (e.g., the decompression thread of a compressed file) are not blocked on the next blocks.
+        """
+        self._stop.set()
+        stop_thread(self._thread, self._blocks)
+        for prefetched in self._files:
+            if not prefetched._eof:
+                self._blocks.put(ValueError('FilePrefetcher closed before the end of the file'))
+        self._files = []
+
+
+class PrefetchedFile(QueueReader):
+    # a file read by FilePrefetcher, whose blocks left unread when closed are skipped for the next file
+    def close(self):
+        if not self.closed:
+            try:
+                while self.readinto(bytearray(DECOMPRESSION_BLOCK_SIZE)) > 0:
+                    pass
+            except Exception:
+                pass  # e.g., FilePrefetcher closed, but the rest of the file is not read anyway
+        super().close()
+
+
+def stop_thread(thread: threading.Thread, blocks: queue.Queue, timeout: float = CLOSE_TIMEOUT):
+    """
+    Wait for the given (stopping) thread to end, while taking the blocks it puts, not to block it on a full queue.
+
+    :return: whether the thread has ended within the timeout (seconds); if not, it is left running as a daemon
+    """
+    deadline = time.monotonic() + timeout
+    while thread.is_alive():
+        if time.monotonic() >= deadline:
+            logger.warning(f'{thread.name} has not stopped in {timeout} seconds, left running')
+            return False
+        try:
+            blocks.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return True
+
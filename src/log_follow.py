@@ -0,0 +1,290 @@
+import os
+import time
+import pandas as pd
+from drain3 import TemplateMiner
+from src.log_preprocess import find_log_files, read_templates_into_df, template_index, match_cache
+from src.log_format import generate_pattern_from_log_format, compile_log_pattern
+from src.template_mining import add_log_messages, ParameterExtractor
+from src.output_format import get_output_file
+from src.compression import get_compression
+from src.metrics import metrics
+
+import logging
+logger = logging.getLogger(__name__)
+
+FOLLOW_MODES = ['convert', 'mining', 'matching']
+POLL_INTERVAL = 0.1
+RESCAN_INTERVAL = 1.0
+READ_BLOCK_SIZE = 4 * 1024 * 1024
+
+
+class FollowedFile:
+    """
+    An open log file being followed, identified by its device and inode rather than its path,
+    so that it is still read to the end after being rotated (i.e., renamed or removed).
+    """
+
+    def __init__(self, path: str, log_id: int):
+        self.path = path
+        self.log_id = log_id
+        self.file = open(path, 'rb')
+        stat = os.fstat(self.file.fileno())
+        self.key = (stat.st_dev, stat.st_ino)
+        self.partial_line = b''
+        self.rotated = False
+
+    def read_lines(self, block_size: int = READ_BLOCK_SIZE):
+        """
+        Return the complete lines appended since the last call (at most about block_size bytes of them).
+        A file truncated in place (e.g., by logrotate's copytruncate) is read again from its beginning, as long as
+        it is smaller than what has been read when this is called (as for `tail -F`).
+        """
+        if os.fstat(self.file.fileno()).st_size < self.file.tell():
+            logger.info(f'FollowedFile: truncated {self.path}')
+            self.file.seek(0)
+            self.partial_line = b''
+        data = self.file.read(block_size)
+        if not data:
+            return []
+        lines = (self.partial_line + data).split(b'\n')
+        self.partial_line = lines.pop()  # b'' if data ends with a new line
+        return [line.decode('utf-8', errors='replace') for line in lines]
+
+    def close(self):
+        """
+        Close the file, and return its last line if it has no new line at the end (otherwise, None).
+        """
+        self.file.close()
+        return self.partial_line.decode('utf-8', errors='replace') if self.partial_line else None
+
+
+class LogFollower:
+    """
+    Follow the log files under log_dir (as found by get_log_files_under_dir()), like `tail -F`:
+    the lines appended to each file are returned by poll(), and a file appearing later (e.g., after a rotation)
+    is followed from its beginning. Each file gets a new logID, in the order the files are found.
+
+    A rotated file (renamed so that it no longer has file_ext, or removed) is read to its end before being closed,
+    while a file renamed within file_ext (e.g., `a.log` -> `a.1.log`) is simply followed under its new name.
+    Compressed files are ignored, since they are usually rotated files that have already been followed.
+    """
+
+    def __init__(self, log_dir: str, file_ext: str = '.log', rescan_interval: float = RESCAN_INTERVAL):
+        self.log_dir = log_dir
+        self.file_ext = file_ext
+        self.rescan_interval = rescan_interval
+        self.num_files = 0
+        self._files = {}  # (st_dev, st_ino) -> FollowedFile, in the order the files are found
+        self._last_scan_time = None
+
+    def poll(self):
+        """
+        Return the complete lines appended to the followed files since the last call, as (logID, line) pairs,
+        rescanning log_dir for new and rotated files every rescan_interval seconds.
+        """
+        if self._last_scan_time is None or time.monotonic() - self._last_scan_time >= self.rescan_interval:
+            self._scan()
+        log_lines = []
+        for key, followed in list(self._files.items()):
+            lines = followed.read_lines()
+            log_lines.extend((followed.log_id, line) for line in lines)
+            if followed.rotated and len(lines) == 0:
+                last_line = followed.close()
+                if last_line is not None:
+                    log_lines.append((followed.log_id, last_line))
+                del self._files[key]
+                logger.info(f'LogFollower: closed {followed.path}')
+        return log_lines
+
+    def close(self):
+        """
+        Close all the followed files, and return their lines not returned by poll() yet (incl. the last lines without
+        a new line) as poll() does.
+        """
+        log_lines = []
+        for followed in self._files.values():
+            lines = followed.read_lines()
+            while len(lines) > 0:
+                log_lines.extend((followed.log_id, line) for line in lines)
+                lines = followed.read_lines()
+            last_line = followed.close()
+            if last_line is not None:
+                log_lines.append((followed.log_id, last_line))
+        self._files = {}
+        return log_lines
+
+    def _scan(self):
+        self._last_scan_time = time.monotonic()
+        found = set()
+        for root, file in find_log_files(log_dir=self.log_dir, file_ext=self.file_ext):
+            path = os.path.join(root, file)
+            if get_compression(path) is not None:
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue  # removed since found
+            key = (stat.st_dev, stat.st_ino)
+            if key not in self._files:
+                try:
+                    followed = FollowedFile(path, log_id=self.num_files + 1)
+                except FileNotFoundError:
+                    continue
+                key = followed.key  # of the file actually opened
+                self.num_files += 1
+                self._files[key] = followed
+                logger.info(f'LogFollower: following {path} (logID={followed.log_id})')
+            self._files[key].path = path
+            found.add(key)
+        for key, followed in self._files.items():
+            if key not in found and not followed.rotated:
+                followed.rotated = True
+                logger.info(f'LogFollower: rotated {followed.path}')
+
+
+def follow_logs(system: str, log_dir: str, file_ext: str, log_format: str, output_dir: str,
+                mode: str = 'convert',
+                template_dir: str = None,
+                drop_message: bool = False,
+                poll_interval: float = POLL_INTERVAL,
+                rescan_interval: float = RESCAN_INTERVAL,
+                timeout: float = None,
+                stop_event=None):
+    """
+    Structure the lines appended to the log files under log_dir (see LogFollower) as they come, and append them to
+    the structured log file, which is flushed after each poll; a line is therefore written within about
+    poll_interval seconds (plus the time to process the lines of the same poll) after being appended.
+
+    In the `mining` mode, a single TemplateMiner mines all the lines, and each line is written with the template of
+    its cluster at that time (which may be generalized by later lines); the templates file is rewritten whenever the
+    clusters have changed. In the `matching` mode, the templates in template_dir are matched as in
+    get_structured_logs_df(), except that template-non-matching lines are kept (with `__NOT_MATCHING__`).
+
+    :param system: system name
+    :param log_dir: input log dir
+    :param file_ext: input log file extension (unstructured logs only)
+    :param log_format: input log format
+    :param output_dir: output dir
+    :param mode: `convert` (no templates), `mining` (Drain3), or `matching` (existing templates)
+    :param template_dir: input template dir (for matching)
+    :param drop_message: whether drop messages in the structured log (for mining and matching)
+    :param poll_interval: seconds between polls
+    :param rescan_interval: seconds between the scans of log_dir for new and rotated files
+    :param timeout: stop if no line has been appended for the given number of seconds (None: never)
+    :param stop_event: threading.Event to stop following (e.g., from another thread), in addition to Ctrl-C
+    :return: number of structured log lines written and number of templates (None in the convert mode)
+    """
+    header, pattern = generate_pattern_from_log_format(log_format)
+    if file_ext.endswith('.csv'):
+        print(f'ERROR: only unstructured logs can be followed, not {file_ext} files')
+        exit(-1)
+    if 'message' not in header:
+        print(f'ERROR: <message> is not in log_format={log_format}')
+        exit(-1)
+    parser = compile_log_pattern(header, pattern)
+
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    template_miner, progress, templates = None, None, {}
+    if mode == 'mining':
+        structured_log_file = get_output_file(output_dir, f'{system}_structured_logs_drain3', 'csv')
+        templates_file = get_output_file(output_dir, f'{system}_templates_drain3', 'csv')
+        template_miner = TemplateMiner()
+        progress = {'line_count': 0, 'start_time': time.time(), 'batch_start_time': time.time()}
+    elif mode == 'matching':
+        structured_log_file = get_output_file(output_dir, f'{system}_structured_logs', 'csv')
+        template_index.build(read_templates_into_df(system=system, template_dir=template_dir))
+    else:
+        structured_log_file = get_output_file(output_dir, system, 'csv')
+
+    print(f'Following logs under {log_dir} into {structured_log_file} (Ctrl-C to stop) ...')
+    follower = LogFollower(log_dir, file_ext=file_ext, rescan_interval=rescan_interval)
+    line_ids = {}  # logID -> lineID of the last structured line
+    num_lines, max_latency = 0, 0.0
+    last_line_time = time.monotonic()
+    with open(structured_log_file, 'w', newline='') as output:
+        def structure(log_lines: list, poll_time: float):
+            nonlocal num_lines, max_latency
+            rows = []
+            for log_id, line in log_lines:
+                log_line = parser.parse(line.strip())
+                if log_line is not None:
+                    line_ids[log_id] = line_ids.get(log_id, 0) + 1
+                    rows.append([log_id, line_ids[log_id]] + log_line)
+            if len(rows) == 0:
+                return
+            logs_df = pd.DataFrame(rows, columns=['logID', 'lineID'] + header)
+            # strip unnecessary white spaces in messages
+            logs_df['message'] = logs_df['message'].str.strip()
+
+            if mode == 'mining':
+                with metrics.stage('mining') as counts:
+                    logs_df['tid'] = add_log_messages(template_miner, logs_df['message'], progress)
+                    counts['lines'] = len(logs_df)
+                # only the clusters of the new lines can be new or changed
+                changed = False
+                for tid in set(logs_df['tid']):
+                    template = template_miner.drain.id_to_cluster[tid].get_template()
+                    changed = changed or templates.get(tid) != template
+                    templates[tid] = template
+                logs_df['template'] = logs_df['tid'].map(templates)
+                with metrics.stage('extraction') as counts:
+                    extractor = ParameterExtractor([(tid, templates[tid]) for tid in set(logs_df['tid'])])
+                    logs_df['values'] = pd.Series(extractor.extract(logs_df['tid'], logs_df['message']),
+                                                  index=logs_df.index, dtype=object)
+                    counts['lines'] = len(logs_df)
+                if changed:
+                    write_templates(template_miner, templates_file)
+            elif mode == 'matching':
+                with metrics.stage('matching') as counts:
+                    tids, matched, values = match_cache.match_all(template_index, logs_df['message'])
+                    logs_df['tid'], logs_df['template'] = tids, matched
+                    logs_df['values'] = pd.Series(values, index=logs_df.index, dtype=object)
+                    counts['lines'] = len(logs_df)
+            if drop_message and mode != 'convert':
+                logs_df = logs_df.drop(columns=['message'])
+
+            with metrics.stage('writing') as counts:
+                logs_df.to_csv(output, header=(num_lines == 0), index=False)
+                output.flush()
+                counts['lines'] = len(logs_df)
+            num_lines += len(logs_df)
+            max_latency = max(max_latency, time.monotonic() - poll_time)
+
+        try:
+            while stop_event is None or not stop_event.is_set():
+                poll_time = time.monotonic()
+                with metrics.stage('parsing') as counts:
+                    log_lines = follower.poll()
+                    counts['lines'] = len(log_lines)
+                if len(log_lines) > 0:
+                    structure(log_lines, poll_time)
+                    last_line_time = poll_time
+                elif timeout is not None and poll_time - last_line_time >= timeout:
+                    break
+                time.sleep(max(0.0, poll_interval - (time.monotonic() - poll_time)))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            # the lines appended since the last poll, incl. the last ones without a new line (as in the batch modes)
+            structure(follower.close(), time.monotonic())
+            if mode == 'mining':
+                write_templates(template_miner, templates_file)
+
+    logger.info(f'follow_logs: {num_lines} lines from {follower.num_files} files, '
+                f'max latency {max_latency:.3f} sec after polls')
+    print(f'Following logs done. Total of {num_lines} lines from {follower.num_files} files, '
+          f'max latency {max_latency * 1000:.1f} ms after polls')
+    if mode == 'mining':
+        return num_lines, len(template_miner.drain.clusters)
+    if mode == 'matching':
+        return num_lines, template_index.size
+    return num_lines, None
+
+
+def write_templates(template_miner: TemplateMiner, templates_file: str):
+    # write a new file and rename it so that the templates file is never partially written
+    templates_df = pd.DataFrame([[cluster.cluster_id, cluster.get_template()]
+                                 for cluster in template_miner.drain.clusters], columns=['tid', 'template'])
+    templates_df.to_csv(templates_file + '.tmp', index=False)
+    os.replace(templates_file + '.tmp', templates_file)
@@ -0,0 +1,160 @@
+import re
+from functools import lru_cache
+
+import logging
+logger = logging.getLogger(__name__)
+
+_FIELD = re.compile(r'(\(\?P<[^>]+>\.\+\??\))')
+_REGEX_SPECIAL = '.^$*+?{}[]|()'
+
+
+def generate_pattern_from_log_format(log_format: str):
+    header = re.findall(r'<(\S+?)>', log_format)
+    pattern = re.sub(r'(<\S+?>)', r'(?P\1.+?)', log_format)
+    pattern = re.sub(r'<(\S+)_ext>\.\+\?', r'<\1_ext>.+',
+                     pattern)  # bypassing the issue of `test_generate_pattern_from_format_Zookeeper`
+    pattern = re.sub(r'\s+', r'\\s+', pattern)
+    pattern = '^' + pattern + '$'
+    return header, pattern
+
+
+def compile_log_pattern(header: list, pattern: str):
+    """
+    Return a (cached) LogLineParser for the given header and pattern (from generate_pattern_from_log_format()).
+    """
+    return _compile_log_pattern(tuple(header), pattern)
+
+
+@lru_cache(maxsize=None)
+def _compile_log_pattern(header: tuple, pattern: str):
+    return LogLineParser(list(header), pattern)
+
+
+class LogLineParser:
+    """
+    Parse a (stripped) log line in the same way as re.match(pattern, line), but faster whenever possible.
+
+    If the pattern is a sequence of whitespace-delimited tokens made of lazy fields and plain literals
+    (e.g., `<date> <time> <level> <component>: <message>`), the line is split with str.split(maxsplit=k)
+    and each field is cut at the first occurrence of the literal that follows it. This is exactly the first
+    assignment the lazy regex tries, so the result is the same whenever that assignment is valid;
+    otherwise (and for the other patterns, such as the ones with `_ext` or regex syntax) the regex is used.
+    """
+
+    def __init__(self, header: list, pattern: str):
+        self.header = header
+        self.pattern = pattern
+        self.regex = re.compile(pattern)
+        self.tokens = self._compile_tokens()
+        self.strategy = 'regex' if self.tokens is None else 'split'
+        self.max_split = 0 if self.tokens is None else len(self.tokens) - 1
+        self.literal_tokens = [] if self.tokens is None else \
+            [(i, _suffix(items), items) for i, items in reversed(list(enumerate(self.tokens))) if items is not None]
+        logger.debug(f'LogLineParser: strategy={self.strategy}, pattern={pattern}')
+
+    def _compile_tokens(self):
+        # the fields must be in the same order as the header to return the values as they are
+        if list(self.regex.groupindex) != self.header or not (self.pattern.startswith('^') and
+                                                              self.pattern.endswith('$')):
+            return None
+
+        tokens = []
+        for token in self.pattern[1:-1].split(r'\s+'):
+            items = []
+            for i, item in enumerate(_FIELD.split(token)):
+                if i % 2 == 1:  # a field
+                    if not item.endswith('.+?)'):
+                        return None  # greedy fields (e.g., `_ext`) do not stop at the first occurrence
+                    items.append((True, item))
+                elif item != '':  # a literal
+                    literal = _unescape(item)
+                    if literal is None:
+                        return None
+                    items.append((False, literal))
+            if len(items) == 0:
+                return None  # leading/trailing spaces in the log format
+            tokens.append(None if len(items) == 1 and items[0][0] else items)  # None: a single field
+        return tokens
+
+    def parse(self, line: str):
+        """
+        :param line: a stripped log line
+        :return: a list of field values (in the order of header), or None if the line does not match
+        """
+        if self.tokens is not None and '\n' not in line:
+            values = line.split(None, self.max_split)
+            if len(values) == len(self.tokens):
+                # replace the tokens having literals with their fields, from the last one not to shift the indices
+                for i, suffix, items in self.literal_tokens:
+                    if suffix is not None:
+                        # a field followed by a literal, e.g., `<component>:`
+                        if len(values[i]) <= len(suffix) or not values[i].endswith(suffix):
+                            break
+                        values[i] = values[i][:-len(suffix)]
+                        continue
+                    fields = _split_token(values[i], items)
+                    if fields is None:
+                        break
+                    values[i:i + 1] = fields
+                else:
+                    return values
+
+        m = self.regex.match(line)
+        if m:
+            return [m.group(h) for h in self.header]
+        return None
+
+
+def _split_token(part: str, items: list):
+    # cut the fields of a token at the first occurrence of the literal that follows each field
+    fields = []
+    pos = 0
+    last = len(items) - 1
+    for i, (is_field, item) in enumerate(items):
+        if not is_field:
+            if not part.startswith(item, pos):
+                return None
+            pos += len(item)
+            continue
+
+        if i == last:
+            end = len(part)
+        elif items[i + 1][0]:
+            end = pos + 1  # followed by another field
+        elif i + 1 == last:
+            end = len(part) - len(items[i + 1][1])  # the literal ends the token
+        else:
+            end = part.find(items[i + 1][1], pos + 1)
+        if end <= pos:
+            return None
+        fields.append(part[pos:end])
+        pos = end
+    if pos != len(part):
+        return None
+    return fields
+
+
+def _suffix(items: list):
+    # return the literal of a token made of a field followed by a literal, or None for the other tokens
+    if len(items) == 2 and items[0][0] and not items[1][0]:
+        return items[1][1]
+    return None
+
+
+def _unescape(literal: str):
+    # return the plain text matched by the given regex literal, or None if it is not a plain literal
+    text = []
+    i = 0
+    while i < len(literal):
+        c = literal[i]
+        if c == '\\':
+            if i + 1 == len(literal) or literal[i + 1].isascii() and literal[i + 1].isalnum():
+                return None  # e.g., \d, \w
+            text.append(literal[i + 1])
+            i += 2
+            continue
+        if c in _REGEX_SPECIAL:
+            return None
+        text.append(c)
+        i += 1
+    return ''.join(text)
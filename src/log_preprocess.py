@@ -1,38 +1,86 @@
+import io
 import os
 import re
 import time
+import mmap
 import json
 import shutil
+import hashlib
+import numpy as np
 import pandas as pd
+from itertools import islice, chain
+from collections import deque, Counter
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
 from natsort import natsorted
 from drain3 import TemplateMiner
+from drain3.file_persistence import FilePersistence
+from src.template_matcher import TemplateIndex, MatchCache, create_match_pool, generate_pattern_from_template
+from src.log_format import generate_pattern_from_log_format, compile_log_pattern
+from src.template_mining import add_log_messages, mine_templates_in_parallel, ParameterExtractor, \
+    mine_templates_from_sample, compare_with_full_mining
+from src.output_format import DataFrameWriter, get_output_file
+from src.compression import open_log_file, get_compression, strip_compression, FilePrefetcher
+from src.metrics import metrics
+from src.parse_cache import ParsedLogCache
 
 from tqdm import tqdm
 
 import logging
 logger = logging.getLogger(__name__)
-templates_dict = {}
-
+template_index = TemplateIndex()
+match_cache = MatchCache()  # kept for the whole run, across files and systems
+CHUNK_SIZE = 100000
+PARSE_PART_SIZE = 64 * 1024 * 1024
+PARSE_ENGINES = ['line', 'mmap']
+MMAP_BLOCK_SIZE = 16 * 1024 * 1024
+MANIFEST_CHECKSUM_SIZE = 4096
 
-import mmap
 
 def get_num_lines(file_path):
-    fp = open(file_path, "r+")
-    buf = mmap.mmap(fp.fileno(), 0)
-    lines = 0
-    while buf.readline():
-        lines += 1
+    # read-only, so that logs in read-only archives can be counted as well
+    with open(file_path, 'rb') as fp:
+        if os.fstat(fp.fileno()).st_size == 0:
+            return 0
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            lines = 0
+            while buf.readline():
+                lines += 1
     return lines
 
 
 def get_templates_using_drain3(
         system: str, log_dir: str, file_ext: str, log_format: str, output_dir: str,
-        drop_message: bool = False
+        drop_message: bool = False,
+        chunk_size: int = None,
+        jobs: int = 1,
+        engine: str = 'line',
+        incremental: bool = False,
+        output_format: str = 'csv',
+        parse_cache: ParsedLogCache = None,
+        pipeline: bool = False,
+        sample_size: int = None,
+        compare_sampling: bool = False,
+        csv_schema: dict = None
     ):
     """
     Identify templates from the given logs.
     The generated templates are saved as a csv file under the specified output_dir.
-    It also generates structured log file.
+    It also generates structured log file, including the parameter values of each message extracted from the final
+    template of its cluster (see ParameterExtractor).
+
+    In the incremental mode, the Drain3 state is loaded from (and saved to) output_dir, and only the log files that
+    are not in the manifest of processed files (or have been modified since) are mined. The templates file is
+    rewritten with all the clusters, while the structured log of the new files is appended to the existing one;
+    the `tid` of the rows written by the previous runs stays valid, but their `template` (and `values`) may have been
+    generalized since then (see the templates file for the latest ones). Of a file appended to since the last run
+    (see is_appended_log_file()), only the new lines are mined, with its logID and the lineIDs after its previous
+    lines; any other modified file replaces its previous rows in the structured log (and in the cluster sizes),
+    and gets a new logID.
+
+    In the sampling mode, only a stratified sample of the logs is mined, and the other messages are matched against
+    its templates (see mine_templates_from_sample()); the coverage of the sample (and, if compare_sampling is given,
+    its accuracy against mining all the messages) is saved as `{system}_sampling_report.json` under output_dir.
 
     :param system: system name
     :param log_dir: input log dir
@@ -40,73 +88,343 @@ def get_templates_using_drain3(
     :param log_format: input log format (e.g., r'<date> <time> <level> <component>: <message>')
     :param output_dir: output template directory
     :param drop_message: whether drop messages in the structured file or not
-    :return: templates (pandas.DataFrame)
+    :param chunk_size: if given, stream logs in chunks of chunk_size lines instead of loading them all at once
+    :param jobs: number of processes for parsing log files, and for mining templates unless chunk_size or incremental
+                 is given (1: serial; see mine_templates_in_parallel())
+    :param engine: parsing engine for unstructured logs (see read_log_lines())
+    :param incremental: whether to mine only new log files on top of the saved Drain3 state (csv only)
+    :param output_format: format of the output files (see src.output_format.OUTPUT_FORMATS)
+    :param parse_cache: cache of parsed log files, unless chunk_size is given (None: no cache; see load_logs_into_df())
+    :param pipeline: whether to read the next log files and write the structured log in background threads
+    :param sample_size: if given, mine only a sample of about sample_size lines and match the others (in-memory only)
+    :param compare_sampling: whether to mine all the messages as well, to report the accuracy of the sampling mode
+    :param csv_schema: columns to load from .csv files, with their dtypes (None: all, inferred; see read_log_file())
+    :return: number of templates
     """
     print('Generating templates ...')
     init_time = time.time()
+    if sample_size is not None and (chunk_size is not None or incremental):
+        print('ERROR: the sampling mode mines the logs loaded at once, which is not possible with chunk_size or '
+              'incremental')
+        exit(-1)
 
-    # get logs_df
-    logs_df = get_logs_df(system=system, log_dir=log_dir, file_ext=file_ext, log_format=log_format)
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    structured_log_file = get_output_file(output_dir, f'{system}_structured_logs_drain3', output_format)
+    log_files = get_log_files_under_dir(log_dir=log_dir, file_ext=file_ext)
 
     # extract templates
-    template_miner = TemplateMiner()
-    line_count = 0
-    start_time = time.time()
-    batch_start_time = start_time
-    batch_size = 100000
-    logs_df['tid'] = ''
-    for index, row in logs_df.iterrows():
-        result = template_miner.add_log_message(row['message'])
-        logs_df.at[index, 'tid'] = result['cluster_id']
-
-        line_count += 1
-        if line_count % batch_size == 0:
-            time_took = time.time() - batch_start_time
-            rate = batch_size / time_took
-            print(f"Processing line: {line_count}, rate {rate:.1f} lines/sec, "
-                  f"{len(template_miner.drain.clusters)} clusters so far.")
-            batch_start_time = time.time()
-        if result["change_type"] != "none":
-            result_json = json.dumps(result)
-            # logger.info(f"Input ({line_count}): " + line)
-            # logger.info("Result: " + result_json)
-
-    time_took = time.time() - start_time
-    rate = line_count / time_took
+    if incremental:
+        if output_format != 'csv':
+            print('ERROR: the incremental mode appends to the structured log, which requires output_format=csv')
+            exit(-1)
+        manifest_file = os.path.join(output_dir, f'{system}_drain3_manifest.json')
+        manifest = load_file_manifest(manifest_file)
+        template_miner = IncrementalTemplateMiner(
+            FilePersistence(os.path.join(output_dir, f'{system}_drain3_state.bin')))
+        # the files as they are now, so that the lines appended while mining are mined by the next run
+        signatures = {os.path.join(path, file): get_file_signature(os.path.join(path, file))
+                      for path, file in log_files}
+        new_log_files, appended_files, replaced_log_ids = [], [], set()
+        for path, file in log_files:
+            file_path = os.path.join(path, file)
+            entry = manifest['files'].get(file_path)
+            if entry is None:
+                new_log_files.append((path, file))
+            elif (entry['size'], entry['mtime']) == (signatures[file_path]['size'], signatures[file_path]['mtime']):
+                continue
+            elif is_appended_log_file(file_path, file_ext, entry):
+                appended_files.append(file_path)
+            else:
+                new_log_files.append((path, file))
+                if 'log_id' in entry:
+                    replaced_log_ids.add(entry['log_id'])
+        log_files = new_log_files
+        append = len(manifest['files']) > 0 and os.path.exists(structured_log_file)
+        first_log_id = manifest['num_logs'] + 1
+        print(f'Incremental mining: {len(log_files)} new or modified log files, {len(appended_files)} appended '
+              f'log files, {len(template_miner.drain.clusters)} clusters so far')
+
+        if len(replaced_log_ids) > 0 and append:
+            with metrics.stage('writing') as counts:
+                removed = remove_logs_from_csv(structured_log_file, replaced_log_ids)
+                counts['lines'] = sum(removed.values())
+            for tid, count in removed.items():
+                cluster = template_miner.drain.id_to_cluster.get(int(tid))
+                if cluster is not None:
+                    cluster.size -= count
+        with metrics.stage('parsing') as counts:
+            appended_dfs = [read_appended_logs(file_path, log_format=log_format, entry=manifest['files'][file_path],
+                                               size=signatures[file_path]['size']) for file_path in appended_files]
+            counts['lines'] = sum(len(log_df) for log_df in appended_dfs)
+    else:
+        template_miner = TemplateMiner()
+        append = False
+        first_log_id = 1
+        appended_dfs = []
+    progress = {'line_count': 0, 'start_time': time.time(), 'batch_start_time': time.time()}
+    templates = None
+    line_counts = Counter()  # logID -> number of lines mined
+    nothing_to_mine = len(log_files) == 0 and len(appended_dfs) == 0
+    if nothing_to_mine:
+        pass  # nothing new to mine (incremental)
+    elif chunk_size is None:
+        # get logs_df
+        logs_dfs = appended_dfs
+        if len(log_files) > 0:
+            logs_dfs = [load_logs_into_df(log_format=log_format, log_files=log_files, file_ext=file_ext, jobs=jobs,
+                                          engine=engine, first_log_id=first_log_id, parse_cache=parse_cache,
+                                          pipeline=pipeline, csv_schema=csv_schema)] + appended_dfs
+        logs_df = logs_dfs[0] if len(logs_dfs) == 1 else pd.concat(logs_dfs, ignore_index=True)
+        if incremental and 'logID' in logs_df.columns:
+            line_counts.update(logs_df['logID'].value_counts().to_dict())
+        with metrics.stage('mining') as counts:
+            if sample_size is not None:
+                logs_df['tid'], sampling_report = mine_templates_from_sample(template_miner, logs_df, sample_size,
+                                                                             progress, jobs=jobs)
+                progress['line_count'] = len(logs_df)
+            elif jobs > 1 and not incremental:
+                # mine the messages of each token count in parallel (same clusters as template_miner would make)
+                logs_df['tid'], templates = mine_templates_in_parallel(logs_df['message'], jobs=jobs)
+                progress['line_count'] = len(logs_df)
+            else:
+                logs_df['tid'] = add_log_messages(template_miner, logs_df['message'], progress)
+            counts['lines'] = len(logs_df)
+    else:
+        # keep the mined tids in a temporary file since the final templates are known only at the end
+        mined_log_file = get_output_file(output_dir, f'{system}_structured_logs_drain3', 'csv') + '.part'
+        logs_dfs = iter([])
+        if len(log_files) > 0:
+            logs_dfs = iter_logs_from_files(log_format=log_format, log_files=log_files, file_ext=file_ext,
+                                            chunk_size=chunk_size, jobs=jobs, engine=engine,
+                                            first_log_id=first_log_id, pipeline=pipeline, csv_schema=csv_schema)
+        for i, logs_df in enumerate(chain(metrics.iter_stage('parsing', logs_dfs), appended_dfs)):
+            if incremental and 'logID' in logs_df.columns:
+                line_counts.update(logs_df['logID'].value_counts().to_dict())
+            with metrics.stage('mining') as counts:
+                logs_df['tid'] = add_log_messages(template_miner, logs_df['message'], progress)
+                counts['lines'] = len(logs_df)
+            with metrics.stage('writing') as counts:
+                append_df_to_csv(logs_df, mined_log_file, first=(i == 0))
+                counts['lines'] = len(logs_df)
+
+    line_count = progress['line_count']
+    time_took = time.time() - progress['start_time']
+    rate = line_count / time_took if time_took > 0 else 0.0
+    if templates is None:
+        templates = []
+        for cluster in template_miner.drain.clusters:
+            templates.append([cluster.cluster_id, cluster.get_template()])
     print(f"Done processing logs. Total of {line_count} lines, rate {rate:.1f} lines/sec, "
-          f"{len(template_miner.drain.clusters)} clusters")
+          f"{len(templates)} clusters")
     template_miner.profiler.report(0)
 
+    if sample_size is not None and len(log_files) > 0:
+        if compare_sampling:
+            with metrics.stage('comparison') as counts:
+                sampling_report.update(compare_with_full_mining(logs_df['message'], logs_df['tid'], templates))
+                counts['lines'] = len(logs_df)
+        print(f"Sampling: {sampling_report['sample_lines']} lines mined, {sampling_report['matched_lines']} matched "
+              f"(coverage {sampling_report['coverage']:.1%}), {sampling_report['fed_back_lines']} fed back, "
+              f"{sampling_report['sample_templates']} -> {sampling_report['templates']} templates")
+        if compare_sampling:
+            print(f"Sampling vs full mining: {sampling_report['templates']} vs {sampling_report['full_templates']} "
+                  f"templates, grouping accuracy {sampling_report['grouping_accuracy']:.1%}, "
+                  f"mining time {sampling_report['mining_sec'] + sampling_report['matching_sec']:.3f} vs "
+                  f"{sampling_report['full_mining_sec']:.3f} sec")
+        with open(os.path.join(output_dir, f'{system}_sampling_report.json'), 'w') as f:
+            json.dump(sampling_report, f, indent=2)
+
     # remove redundant templates and sort the results
-    templates = []
-    for cluster in template_miner.drain.clusters:
-        templates.append([cluster.cluster_id, cluster.get_template()])
     # templates = natsorted(templates, key=lambda x: x[0])
     print(f'Total number of templates generated: {len(templates)}')
 
     # save templates
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
     templates_df = pd.DataFrame(templates, columns=['tid', 'template'])
-    templates_df.to_csv(os.path.join(output_dir, f'{system}_templates_drain3.csv'), index=False)
+    with DataFrameWriter(get_output_file(output_dir, f'{system}_templates_drain3', output_format),
+                         output_format) as writer:
+        writer.write(templates_df.copy())  # not to compact templates_df
 
     # save structured log
-    logs_df = logs_df.join(templates_df.set_index('tid'), on='tid')
-    logs_df['values'] = '[]'  # TODO: update drain3 to have matching values for each message
-    if drop_message:
-        logs_df = logs_df.drop(columns=['message'])
-    logs_df.to_csv(os.path.join(output_dir, f'{system}_structured_logs_drain3.csv'), index=False)
+    if nothing_to_mine:
+        pass
+    elif chunk_size is None:
+        logs_df = logs_df.join(templates_df.set_index('tid'), on='tid')
+        with metrics.stage('extraction') as counts:
+            # to avoid VisibleDeprecationWarning (ndarray from ragged nested sequences)
+            logs_df['values'] = pd.Series(ParameterExtractor(templates).extract(logs_df['tid'], logs_df['message']),
+                                          index=logs_df.index, dtype=object)
+            counts['lines'] = len(logs_df)
+        if drop_message:
+            logs_df = logs_df.drop(columns=['message'])
+        with DataFrameWriter(structured_log_file, output_format, append=append, background=pipeline) as writer:
+            writer.write(logs_df)
+    else:
+        # read back as str so that the rewritten fields are the same as the ones written above
+        template_by_tid = {str(tid): template for tid, template in templates}
+        extractor = ParameterExtractor(list(template_by_tid.items()))
+        logs_dfs = pd.read_csv(mined_log_file, dtype=str, keep_default_na=False, chunksize=chunk_size)
+        with DataFrameWriter(structured_log_file, output_format, append=append, background=pipeline) as writer:
+            for logs_df in logs_dfs:
+                logs_df['template'] = logs_df['tid'].map(template_by_tid)
+                with metrics.stage('extraction') as counts:
+                    logs_df['values'] = pd.Series(extractor.extract(logs_df['tid'], logs_df['message']),
+                                                  index=logs_df.index, dtype=object)
+                    counts['lines'] = len(logs_df)
+                if drop_message:
+                    logs_df = logs_df.drop(columns=['message'])
+                if output_format != 'csv':
+                    # the numeric columns as in the in-memory mode, to be downcast by the writer
+                    for column in ['tid', 'logID', 'lineID']:
+                        if column in logs_df.columns and logs_df[column].str.isdigit().all():
+                            logs_df[column] = logs_df[column].astype('int64')
+                writer.write(logs_df)
+        os.remove(mined_log_file)
+
+    # record the processed files only after the outputs are written, so that an interrupted run is simply redone
+    if incremental:
+        template_miner.save_state('incremental mining')
+        for i, (path, file) in enumerate(log_files):
+            file_path = os.path.join(path, file)
+            manifest['files'][file_path] = get_manifest_entry(file_path, signatures[file_path],
+                                                              log_id=first_log_id + i,
+                                                              lines=line_counts[first_log_id + i])
+        for file_path in appended_files:
+            entry = manifest['files'][file_path]
+            manifest['files'][file_path] = get_manifest_entry(file_path, signatures[file_path],
+                                                              log_id=entry['log_id'],
+                                                              lines=entry['lines'] + line_counts[entry['log_id']])
+        manifest['num_logs'] += len(log_files)
+        save_file_manifest(manifest_file, manifest)
 
     print('Generating templates done. [Time taken: %.3f sec]' % (time.time() - init_time))
 
     return len(templates)
 
 
+class IncrementalTemplateMiner(TemplateMiner):
+    """
+    TemplateMiner that loads its state from the given persistence handler and saves it periodically
+    (snapshot_interval_minutes in drain3.ini) instead of on every new cluster or template change,
+    since serializing all the clusters for each change would dominate the mining of a long history.
+    Call save_state() at the end of mining.
+    """
+
+    def get_snapshot_reason(self, change_type, cluster_id):
+        return super().get_snapshot_reason('none', cluster_id)
+
+
+def get_file_signature(file_path: str):
+    # a file is considered unchanged as long as its size and modification time are the same
+    stat = os.stat(file_path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+
+def get_manifest_entry(file_path: str, signature: dict, log_id: int, lines: int):
+    """
+    Return the manifest entry of a mined log file, i.e., its signature (see get_file_signature()) when it was mined,
+    its logID, the number of its lines mined so far, and the checksum of its last bytes (see is_appended_log_file()).
+    """
+    return dict(signature, log_id=int(log_id), lines=int(lines),
+                checksum=get_file_checksum(file_path, size=signature['size']))
+
+
+def get_file_checksum(file_path: str, size: int):
+    # checksum of the (at most) MANIFEST_CHECKSUM_SIZE bytes before size
+    with open(file_path, 'rb') as f:
+        f.seek(max(0, size - MANIFEST_CHECKSUM_SIZE))
+        return hashlib.sha1(f.read(size - f.tell())).hexdigest()
+
+
+def is_appended_log_file(file_path: str, file_ext: str, entry: dict):
+    """
+    Return whether the given log file has only been appended to since it was mined, according to its manifest entry
+    (see get_manifest_entry()): it is not smaller than it was, and has the same bytes before that size (checked for the
+    last MANIFEST_CHECKSUM_SIZE bytes only). Compressed and .csv files are never read from where they were mined up to,
+    so they are not considered appended.
+    """
+    if file_ext.endswith('.csv') or get_compression(file_path) is not None or 'checksum' not in entry:
+        return False
+    size = os.path.getsize(file_path)
+    return size >= entry['size'] and get_file_checksum(file_path, size=entry['size']) == entry['checksum']
+
+
+def read_appended_logs(file_path: str, log_format: str, entry: dict, size: int):
+    """
+    Parse the lines appended to the given log file since it was mined, i.e., from entry['size'] to size, as
+    load_logs_into_df() does, but with the logID of the file and the lineIDs after its lines mined before.
+    Note that the file is expected to end with a new line where it was mined up to, as log files are appended to.
+
+    :param file_path: unstructured log file
+    :param log_format: log format for parsing the lines
+    :param entry: manifest entry of the file (see get_manifest_entry())
+    :param size: size of the file up to which the lines are parsed
+    :return: dataframe
+    """
+    header, pattern = generate_pattern_from_log_format(log_format)
+    log_lines = read_log_file_part((0, file_path, '.log', entry['size'], size, header, pattern, 'line', None))
+    log_df = pd.DataFrame(log_lines, columns=header)
+    # strip unnecessary white spaces in messages
+    log_df['message'] = log_df['message'].str.strip()
+    if 'logID' not in header and 'lineID' not in header:
+        log_df.insert(0, 'lineID', np.arange(entry['lines'] + 1, entry['lines'] + len(log_df) + 1))
+        log_df.insert(0, 'logID', entry['log_id'])
+    logger.info(f'read_appended_logs: {len(log_df)} lines from {file_path} ({entry["size"]} to {size} bytes)')
+    return log_df
+
+
+def remove_logs_from_csv(csv_file: str, log_ids: set, chunk_size: int = CHUNK_SIZE):
+    """
+    Remove the rows of the given logIDs from the given structured log (csv), which is rewritten chunk by chunk.
+
+    :param csv_file: structured log file (csv) with logID and tid
+    :param log_ids: logIDs to remove
+    :param chunk_size: number of rows per chunk
+    :return: number of removed rows of each tid (collections.Counter, keyed by tid as str)
+    """
+    removed = Counter()
+    log_ids = {str(log_id) for log_id in log_ids}
+    # read as str so that the rows kept are written as they are
+    for i, logs_df in enumerate(pd.read_csv(csv_file, dtype=str, keep_default_na=False, chunksize=chunk_size)):
+        dropped = logs_df['logID'].isin(log_ids)
+        removed.update(logs_df.loc[dropped, 'tid'].tolist())
+        append_df_to_csv(logs_df[~dropped], csv_file + '.tmp', first=(i == 0))
+    if os.path.exists(csv_file + '.tmp'):
+        os.replace(csv_file + '.tmp', csv_file)
+    logger.info(f'remove_logs_from_csv: {sum(removed.values())} rows of logIDs {sorted(log_ids)} from {csv_file}')
+    return removed
+
+
+def load_file_manifest(manifest_file: str):
+    """
+    Load the manifest of processed log files (file path -> get_manifest_entry()), or an empty one.
+    """
+    if not os.path.exists(manifest_file):
+        return {'files': {}, 'num_logs': 0}
+    with open(manifest_file, 'r') as f:
+        return json.load(f)
+
+
+def save_file_manifest(manifest_file: str, manifest: dict):
+    # write a new file and rename it so that the manifest is never partially written
+    with open(manifest_file + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_file + '.tmp', manifest_file)
+
+
 def get_structured_logs_df(system: str, log_dir: str, file_ext: str, log_format: str, template_dir: str,
                            output_dir: str,
-                           log_split_keyword: str = None):
+                           log_split_keyword: str = None,
+                           jobs: int = 1,
+                           engine: str = 'line',
+                           output_format: str = 'csv',
+                           virtual_split: bool = False,
+                           parse_cache: ParsedLogCache = None,
+                           pipeline: bool = False,
+                           csv_schema: dict = None):
     """
     Return a structured_logs_df (dataframe) from log files and already generated templates.
+    For parquet and feather, structured_logs_df is compacted (see src.output_format.compact_df()) before written.
 
     :param system: system name
     :param log_dir: input log dir
@@ -115,6 +433,13 @@ def get_structured_logs_df(system: str, log_dir: str, file_ext: str, log_format:
     :param template_dir: input template dir
     :param output_dir: output dir
     :param log_split_keyword: log splitting keyword
+    :param jobs: number of processes for parsing log files and template matching (1: serial)
+    :param engine: parsing engine for unstructured logs (see read_log_lines())
+    :param output_format: format of the structured log file (see src.output_format.OUTPUT_FORMATS)
+    :param virtual_split: whether to split logs while parsing them instead of writing split log files
+    :param parse_cache: cache of parsed log files (None: no cache; see get_logs_df())
+    :param pipeline: whether to read the next log files and write the structured log in background threads
+    :param csv_schema: columns to load from .csv files, with their dtypes (None: all, inferred; see read_log_file())
     :return: structured log (pandas.DataFrame) and templates (pandas.DataFrame)
     """
     print('Generating structured_logs_df ...')
@@ -126,24 +451,24 @@ def get_structured_logs_df(system: str, log_dir: str, file_ext: str, log_format:
         log_dir=log_dir,
         file_ext=file_ext,
         log_format=log_format,
-        log_split_keyword=log_split_keyword
+        log_split_keyword=log_split_keyword,
+        jobs=jobs,
+        engine=engine,
+        virtual_split=virtual_split,
+        parse_cache=parse_cache,
+        pipeline=pipeline,
+        csv_schema=csv_schema
     )
 
     # generate templates_df
     templates_df = read_templates_into_df(system=system, template_dir=template_dir)
 
-    # prepare templates_dict
-    templates_dict.clear()
-    templates_df['re'] = templates_df['template'].map(generate_pattern_from_template)
-    for index, row in templates_df.iterrows():
-        templates_dict[row['re']] = (index, row['template'])
+    # prepare template_index (compiled once, grouped by leading/anchor tokens)
+    template_index.build(templates_df)
 
-    # parsing using _find_matching_template()
-    # TODO: how to improve the performance of find_matching_template? at least how to see the percentage?
-    # FIXME: how to avoid using a global variable?
-    logs_df['tid'], logs_df['template'], values = zip(*logs_df['message'].map(find_matching_template))
-    logs_df['values'] = pd.Series(values)  # to avoid VisibleDeprecationWarning (ndarray from ragged nested sequences)
-    logger.info('_find_matching_template() is done')
+    # matching each distinct message once (see match_cache for the hit/miss counters)
+    with create_match_pool(template_index, jobs) if jobs > 1 else nullcontext() as executor:
+        match_templates(logs_df, jobs=jobs, executor=executor)
 
     # remove template-non-matching messages
     num_template_non_matching = len(logs_df[logs_df.template == '__NOT_MATCHING__'])
@@ -164,125 +489,796 @@ def get_structured_logs_df(system: str, log_dir: str, file_ext: str, log_format:
     # save structured_logs_df
     if not os.path.isdir(output_dir):
         os.makedirs(output_dir)
-    logs_df.to_csv(os.path.join(output_dir, f'{system}_structured_logs.csv'), index=False)
+    with DataFrameWriter(get_output_file(output_dir, f'{system}_structured_logs', output_format),
+                         output_format, background=pipeline) as writer:
+        writer.write(logs_df)
     print('Generating structured_logs_df done. [Time taken: %.3f sec]' % (time.time() - start_time))
 
     return logs_df, templates_df
 
 
-def get_logs_df(system: str, log_dir: str, file_ext: str, log_format: str, log_split_keyword: str = None):
+def write_structured_logs_in_chunks(system: str, log_dir: str, file_ext: str, log_format: str, template_dir: str,
+                                    output_dir: str,
+                                    log_split_keyword: str = None,
+                                    jobs: int = 1,
+                                    chunk_size: int = CHUNK_SIZE,
+                                    engine: str = 'line',
+                                    output_format: str = 'csv',
+                                    virtual_split: bool = False,
+                                    pipeline: bool = False,
+                                    csv_schema: dict = None):
+    """
+    Same as get_structured_logs_df(), but streams logs in chunks of chunk_size lines and appends each structured
+    chunk to the output file instead of keeping the whole structured log in memory.
+
+    :param system: system name
+    :param log_dir: input log dir
+    :param file_ext: input log file extension
+    :param log_format: input log format
+    :param template_dir: input template dir
+    :param output_dir: output dir
+    :param log_split_keyword: log splitting keyword
+    :param jobs: number of processes for parsing log files and template matching (1: serial)
+    :param chunk_size: number of log lines per chunk
+    :param engine: parsing engine for unstructured logs (see read_log_lines())
+    :param output_format: format of the structured log file (see src.output_format.OUTPUT_FORMATS)
+    :param virtual_split: whether to split logs while parsing them instead of writing split log files
+    :param pipeline: whether to read the next log files and write the structured chunks in background threads,
+                     i.e., while the current chunk is parsed and matched
+    :param csv_schema: columns to load from .csv files, with their dtypes (None: all, inferred; see read_log_file())
+    :return: templates (pandas.DataFrame) and the number of log entries in the structured log
+    """
+    print('Generating structured logs in chunks ...')
+    start_time = time.time()
+
+    templates_df = read_templates_into_df(system=system, template_dir=template_dir)
+    template_index.build(templates_df)
+
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    structured_log_file = get_output_file(output_dir, f'{system}_structured_logs', output_format)
+
+    logs_dfs = iter_logs_df(system=system, log_dir=log_dir, file_ext=file_ext, log_format=log_format,
+                            log_split_keyword=log_split_keyword, chunk_size=chunk_size, jobs=jobs, engine=engine,
+                            virtual_split=virtual_split, pipeline=pipeline, csv_schema=csv_schema)
+    matched_templates = {}
+    log_ids = set()
+    num_log_entries = 0
+    num_template_non_matching = 0
+    non_matching_logs_df = None
+    # the worker processes (jobs > 1) compile the templates once for all the chunks
+    with create_match_pool(template_index, jobs) if jobs > 1 else nullcontext() as executor, \
+            DataFrameWriter(structured_log_file, output_format, background=pipeline) as writer:
+        for logs_df in logs_dfs:
+            match_templates(logs_df, jobs=jobs, executor=executor)
+
+            # keep a bounded sample of template-non-matching messages
+            non_matching = logs_df[logs_df.template == '__NOT_MATCHING__']
+            if len(non_matching) > 0:  # FOR DEBUGGING
+                num_template_non_matching += len(non_matching)
+                non_matching_logs_df = pd.concat([non_matching_logs_df, non_matching])
+                non_matching_logs_df = non_matching_logs_df.sample(n=min(len(non_matching_logs_df), 100),
+                                                                   random_state=1)
+            logs_df = logs_df[logs_df.template != '__NOT_MATCHING__']
+
+            for tid, template in zip(logs_df['tid'], logs_df['template']):
+                matched_templates.setdefault(tid, template)
+            if 'logID' in logs_df.columns:
+                log_ids.update(logs_df['logID'].unique())
+            num_log_entries += len(logs_df)
+            writer.write(logs_df)
+
+    if non_matching_logs_df is not None:
+        non_matching_logs_df.to_csv(os.path.join(output_dir, f'{system}_non_template_msgs_100.csv'), index=False)
+    logger.info(f"Total number of template-non-matching messages: {num_template_non_matching}")
+    templates_df = pd.DataFrame(list(matched_templates.items()), columns=['tid', 'template']).set_index('tid')
+
+    logger.info(f"Total number of logs in structured logs: {len(log_ids)}")
+    logger.info(f'Total number of log entries in structured logs: {num_log_entries}')
+    print('Generating structured logs in chunks done. [Time taken: %.3f sec]' % (time.time() - start_time))
+
+    return templates_df, num_log_entries
+
+
+def match_templates(logs_df: pd.DataFrame, jobs: int = 1, executor: ProcessPoolExecutor = None):
+    """
+    Add the `tid`, `template`, and `values` columns to logs_df (in place) using the current template_index.
+
+    :param logs_df: structured log (without templates)
+    :param jobs: number of processes for template matching (1: serial)
+    :param executor: pool from create_match_pool() for the current template_index (None: a new pool if jobs > 1)
+    :return: logs_df
+    """
+    # FIXME: how to avoid using a global variable?
+    # worker processes (jobs > 1) build their own index from the templates, not from the global template_index
+    # TODO: how to see the percentage of find_matching_template?
+    with metrics.stage('matching') as counts:
+        hits, misses = match_cache.hits, match_cache.misses
+        tids, templates, values = match_cache.match_all(template_index, logs_df['message'], jobs=jobs,
+                                                        executor=executor)
+        logs_df['tid'], logs_df['template'] = tids, templates
+        # to avoid VisibleDeprecationWarning (ndarray from ragged nested sequences)
+        logs_df['values'] = pd.Series(values, index=logs_df.index, dtype=object)
+        counts['lines'] = len(logs_df)
+        counts['cache_hits'] = match_cache.hits - hits
+        counts['cache_misses'] = match_cache.misses - misses
+        counts['non_matching'] = int((logs_df['template'] == '__NOT_MATCHING__').sum())
+    logger.info('_find_matching_template() is done')
+    return logs_df
+
+
+def get_logs_df(system: str, log_dir: str, file_ext: str, log_format: str, log_split_keyword: str = None,
+                jobs: int = 1, engine: str = 'line', virtual_split: bool = False, parse_cache: ParsedLogCache = None,
+                pipeline: bool = False, csv_schema: dict = None):
     """
     Get structured log (without templates) as a pandas.DataFrame.
+    With a parse_cache, unchanged log files are not parsed again (see load_logs_into_df()); the split logs are cached
+    as a whole, keyed by all the (original) log files and log_split_keyword, so that a cached one is not even split.
 
     :param system: system name
     :param log_dir: input log dir
     :param file_ext: input log file extension
     :param log_format: input log format (e.g., "<date> <time> <level> <component>: <message>")
     :param log_split_keyword: log file splitting keyword (e.g., "initialize logging")
+    :param jobs: number of processes for parsing log files (1: serial)
+    :param engine: parsing engine for unstructured logs (see read_log_lines())
+    :param virtual_split: whether to split logs while parsing them (see iter_split_log_lines()) instead of writing
+                          split log files; the split logs are then parsed line by line in a single process
+    :param parse_cache: cache of parsed log files (None: no cache)
+    :param pipeline: whether to read the next log files in a background thread while parsing (see load_logs_into_df())
+    :param csv_schema: columns to load from .csv files, with their dtypes (None: all, inferred; see read_log_file())
     :return: structured log (without templates) in the form of pandas.DataFrame
     """
 
     # split log files if specified
     if log_split_keyword is not None:
-        log_dir = split_log(system=system, log_dir=log_dir, log_split_keyword=log_split_keyword)
+        cache_key = None
+        if parse_cache is not None:
+            # the log files to split, i.e., not the ones written by split_log() before (always modified)
+            split_log_dir = os.path.join(log_dir, 'split')
+            log_files = [os.path.join(path, file) for path, file in get_log_files_under_dir(log_dir)
+                         if os.path.commonpath([split_log_dir, path]) != split_log_dir]
+            cache_key = parse_cache.key(log_files, log_format=log_format, file_ext=file_ext, csv_schema=csv_schema,
+                                        log_split_keyword=log_split_keyword, virtual_split=virtual_split)
+            logs_df = parse_cache.get(cache_key)
+            if logs_df is not None:
+                metrics.count('parsing', lines=len(logs_df), cache_hits=1)
+                print('Total number of log messages in raw logs (cached): %d' % len(logs_df))
+                return logs_df
+
+        if virtual_split:
+            logs_df = load_split_logs_into_df(log_format=log_format, log_dir=log_dir,
+                                              log_split_keyword=log_split_keyword)
+        else:
+            # the split log files are not cached one by one since they are rewritten (i.e., modified) for each run
+            split_log_dir = split_log(system=system, log_dir=log_dir, log_split_keyword=log_split_keyword)
+            logs_df = load_logs_into_df(log_format=log_format,
+                                        log_files=get_log_files_under_dir(log_dir=split_log_dir, file_ext=file_ext),
+                                        file_ext=file_ext, jobs=jobs, engine=engine, pipeline=pipeline,
+                                        csv_schema=csv_schema)
+        if cache_key is not None:
+            parse_cache.put(cache_key, logs_df)
+        return logs_df
 
     # collect all log files to read
     log_files = get_log_files_under_dir(log_dir=log_dir, file_ext=file_ext)
 
     # convert log files into a dataframe
-    logs_df = load_logs_into_df(log_format=log_format, log_files=log_files, file_ext=file_ext)
+    logs_df = load_logs_into_df(log_format=log_format, log_files=log_files, file_ext=file_ext, jobs=jobs,
+                                engine=engine, parse_cache=parse_cache, pipeline=pipeline, csv_schema=csv_schema)
     return logs_df
 
 
+def iter_logs_df(system: str, log_dir: str, file_ext: str, log_format: str, log_split_keyword: str = None,
+                 chunk_size: int = CHUNK_SIZE, jobs: int = 1, engine: str = 'line', virtual_split: bool = False,
+                 pipeline: bool = False, csv_schema: dict = None):
+    """
+    Same as get_logs_df(), but yields the structured log in chunks of (at most) chunk_size lines.
+
+    :param system: system name
+    :param log_dir: input log dir
+    :param file_ext: input log file extension
+    :param log_format: input log format (e.g., "<date> <time> <level> <component>: <message>")
+    :param log_split_keyword: log file splitting keyword (e.g., "initialize logging")
+    :param chunk_size: number of log lines per chunk
+    :param jobs: number of processes for parsing log files (1: serial)
+    :param engine: parsing engine for unstructured logs (see read_log_lines())
+    :param virtual_split: whether to split logs while parsing them instead of writing split log files
+    :param pipeline: whether to read the next log files in a background thread while parsing
+                     (see iter_logs_from_files())
+    :param csv_schema: columns to load from .csv files, with their dtypes (None: all, inferred; see read_log_file())
+    :return: generator of structured log chunks (without templates) in the form of pandas.DataFrame
+    """
+    if log_split_keyword is not None and virtual_split:
+        return metrics.iter_stage('parsing', iter_split_logs_df(log_format=log_format, log_dir=log_dir,
+                                                                log_split_keyword=log_split_keyword,
+                                                                chunk_size=chunk_size))
+    if log_split_keyword is not None:
+        log_dir = split_log(system=system, log_dir=log_dir, log_split_keyword=log_split_keyword)
+    log_files = get_log_files_under_dir(log_dir=log_dir, file_ext=file_ext)
+    return metrics.iter_stage('parsing', iter_logs_from_files(log_format=log_format, log_files=log_files,
+                                                              file_ext=file_ext, chunk_size=chunk_size, jobs=jobs,
+                                                              engine=engine, pipeline=pipeline,
+                                                              csv_schema=csv_schema))
+
+
+def write_chunks(logs_dfs, output_file: str, output_format: str = 'csv', background: bool = False):
+    """
+    Write the given chunks (e.g., from iter_logs_df()) into a single file, one by one.
+
+    :param logs_dfs: iterable of pandas.DataFrame having the same columns
+    :param output_file: output file
+    :param output_format: format of the output file (see src.output_format.OUTPUT_FORMATS)
+    :param background: whether to write each chunk in a writer thread while the next one is made (see DataFrameWriter)
+    :return: total number of rows written
+    """
+    with DataFrameWriter(output_file, output_format, background=background) as writer:
+        for logs_df in logs_dfs:
+            writer.write(logs_df)
+    return writer.num_rows
+
+
+def append_df_to_csv(df: pd.DataFrame, output_file: str, first: bool):
+    # the first chunk (re)creates the file with the header, the others are appended without it
+    df.to_csv(output_file, mode='w' if first else 'a', header=first, index=False)
+
+
 def get_log_files_under_dir(log_dir: str, file_ext='.log'):
     """
     Return a list of log files (with path, as tuple) under the given log_dir.
 
     :param log_dir: the root directory for searching log files
-    :param file_ext: (optional) log file extension; `.log` by default
+    :param file_ext: (optional) log file extension; `.log` by default (compressed ones, e.g., `.log.gz`, as well)
     :return: a (sorted) list of tuples composed of (log_path, log_file)
     """
-    raw_logs = []
-    for root, dirs, files in os.walk(log_dir):
-        for file in files:
-            if file.endswith(file_ext):
-                raw_logs.append((root, file))
-                logger.debug('collected log file: %s/%s' % (root, file))
+    with metrics.stage('discovery') as counts:
+        raw_logs = find_log_files(log_dir=log_dir, file_ext=file_ext)
+        counts['files'] = len(raw_logs)
+    for root, file in raw_logs:
+        logger.debug('collected log file: %s/%s' % (root, file))
     print('Total number of logs: %d' % len(raw_logs))
 
     if len(raw_logs) == 0:
         print(f'ERROR: No log files detected under: {log_dir}')
         exit(0)
 
+    return raw_logs
+
+
+def find_log_files(log_dir: str, file_ext='.log'):
+    # same as get_log_files_under_dir(), but quietly (e.g., to be repeated), even if there is no log file
+    raw_logs = []
+    for root, dirs, files in os.walk(log_dir):
+        for file in files:
+            if strip_compression(file).endswith(file_ext):
+                raw_logs.append((root, file))
     return natsorted(raw_logs)
 
 
-def load_logs_into_df(log_format: str, log_files: list, file_ext: str):
+def load_logs_into_df(log_format: str, log_files: list, file_ext: str, jobs: int = 1, engine: str = 'line',
+                      first_log_id: int = 1, parse_cache: ParsedLogCache = None, pipeline: bool = False,
+                      csv_schema: dict = None):
     """
     Parse log files according to the given log_format and return a dataframe.
+    With a parse_cache, the log files parsed by a previous run are loaded from the cache instead of being parsed,
+    unless they have been modified since then; the newly parsed ones are added to the cache.
 
     :param log_format: log format for parsing log files
     :param log_files: log files to read
     :param file_ext: target log file extension (e.g., .log, .csv)
+    :param jobs: number of processes for parsing log files (1: serial)
+    :param engine: parsing engine for unstructured logs (see read_log_lines())
+    :param first_log_id: logID of the first log file (if logID is added)
+    :param parse_cache: cache of parsed log files (None: no cache)
+    :param pipeline: whether to read the next files in a background thread while parsing (see FilePrefetcher),
+                     unless they are parsed in parallel or mapped (engine=mmap)
+    :param csv_schema: columns to load from .csv files, with their dtypes (None: all, inferred; see read_log_file())
     :return: dataframe
     """
     header, pattern = generate_pattern_from_log_format(log_format)
+    if not file_ext.endswith('.csv') and 'message' not in header:
+        print(f'ERROR: <message> is not in log_format={log_format}')
+        exit(-1)
+    if file_ext.endswith('.csv') and csv_schema is not None and 'message' not in csv_schema:
+        print(f'ERROR: message is not in csv_schema={csv_schema}')
+        exit(-1)
+
+    with metrics.stage('parsing') as counts:
+        # reuse the files parsed by the previous runs (if not changed since), and parse only the others
+        cached_log_dfs, cache_keys = {}, {}
+        if parse_cache is not None:
+            for path, file in log_files:
+                key = parse_cache.key([os.path.join(path, file)], log_format=log_format, file_ext=file_ext,
+                                      csv_schema=csv_schema)
+                cache_keys[(path, file)] = key
+                log_df = parse_cache.get(key)
+                if log_df is not None:
+                    cached_log_dfs[(path, file)] = log_df
+            counts['cache_hits'] = len(cached_log_dfs)
+        files_to_parse = [(path, file) for path, file in log_files if (path, file) not in cached_log_dfs]
+
+        prefetch = pipeline and jobs == 1 and (file_ext.endswith('.csv') or engine != 'mmap')
+        # the reader thread (if prefetch) reads the next files while the current one is parsed
+        with FilePrefetcher([os.path.join(path, file) for path, file in files_to_parse]) if prefetch \
+                else nullcontext() as prefetcher:
+            if len(files_to_parse) == 0:
+                parsed_log_dfs = iter([])
+            elif prefetch:
+                mode = 'rb' if file_ext.endswith('.csv') else 'r'
+                parsed_log_dfs = (read_log_file(os.path.join(path, file), file_ext=file_ext, header=header,
+                                                pattern=pattern, engine=engine, log=prefetcher.open_next(mode),
+                                                csv_schema=csv_schema)
+                                  for path, file in files_to_parse)
+            elif jobs > 1:
+                parsed_log_dfs = iter(read_log_files_in_parallel(log_files=files_to_parse, file_ext=file_ext,
+                                                                 header=header, pattern=pattern, jobs=jobs,
+                                                                 engine=engine, csv_schema=csv_schema))
+            else:
+                # process each log file, one by one
+                parsed_log_dfs = (read_log_file(os.path.join(path, file), file_ext=file_ext, header=header,
+                                                pattern=pattern, engine=engine, csv_schema=csv_schema)
+                                  for path, file in files_to_parse)
+
+            log_id = first_log_id
+            log_dfs = []
+            for path, file in log_files:
+                log_df = cached_log_dfs.pop((path, file), None)
+                if log_df is None:
+                    log_df = next(parsed_log_dfs)
+                    if parse_cache is not None:
+                        parse_cache.put(cache_keys[(path, file)], log_df)  # as read, before modified below
+                # strip unnecessary white spaces in messages
+                log_df['message'] = log_df['message'].str.strip()
+                length = log_df['message'].size
+
+                # add logID and lineID columns if needed
+                if 'logID' not in header and 'logID' not in log_df.columns and 'lineID' not in log_df.columns:
+                    log_df.insert(0, 'lineID', np.arange(1, length + 1))
+                    log_df.insert(0, 'logID', log_id)
+                    log_id += 1
 
-    log_id = 1
-    log_dfs = []
-    for path, file in log_files:
-        # process each log file, one by one
+                # append log_df to logs_df
+                log_dfs.append(log_df)
+                counts['bytes'] = counts.get('bytes', 0) + os.path.getsize(os.path.join(path, file))
+                logger.info(f'loaded log file (length={length}): {os.path.join(path, file)}')
 
-        if file_ext.endswith('.csv'):
-            # simply read the csv file since it's already structured
-            log_df = pd.read_csv(os.path.join(path, file))
+        logs_df = pd.concat(log_dfs, ignore_index=True)
+        counts['lines'] = len(logs_df)
+    print('Total number of log messages in raw logs: %d' % len(logs_df))
+
+    return logs_df
+
+
+def load_split_logs_into_df(log_format: str, log_dir: str, log_split_keyword: str):
+    """
+    Same as load_logs_into_df() for the log files written by split_log(), but without writing them.
+
+    :param log_format: log format for parsing log files
+    :param log_dir: input log dir
+    :param log_split_keyword: log splitting keyword
+    :return: dataframe
+    """
+    with metrics.stage('parsing') as counts:
+        logs_df = pd.concat(list(iter_split_logs_df(log_format=log_format, log_dir=log_dir,
+                                                    log_split_keyword=log_split_keyword, chunk_size=None)),
+                            ignore_index=True)
+        counts['lines'] = len(logs_df)
+    return logs_df
+
+
+def iter_split_logs_df(log_format: str, log_dir: str, log_split_keyword: str, chunk_size: int = CHUNK_SIZE):
+    """
+    Same as iter_logs_from_files() for the log files written by split_log(), but without writing them.
+
+    :param log_format: log format for parsing log files
+    :param log_dir: input log dir
+    :param log_split_keyword: log splitting keyword
+    :param chunk_size: number of log lines per chunk (None: a single chunk)
+    :return: generator of dataframes
+    """
+    header, _ = generate_pattern_from_log_format(log_format)
+    if 'message' not in header:
+        print(f'ERROR: <message> is not in log_format={log_format}')
+        exit(-1)
+    columns = header if 'logID' in header or 'lineID' in header else ['logID', 'lineID'] + header
+
+    log_lines = iter_split_logs(log_format=log_format, log_dir=log_dir, log_split_keyword=log_split_keyword)
+    batches = [list(log_lines)] if chunk_size is None else iter_batches(log_lines, chunk_size)
+    num_log_lines, num_chunks = 0, 0
+    for lines in batches:
+        logs_df = pd.DataFrame(lines, columns=columns)
+        # strip unnecessary white spaces in messages
+        logs_df['message'] = logs_df['message'].str.strip()
+        num_log_lines += len(logs_df)
+        num_chunks += 1
+        yield logs_df
+    if num_chunks == 0:
+        yield pd.DataFrame(columns=header)  # as iter_logs_from_files() does
+    print('Total number of log messages in raw logs: %d' % num_log_lines)
+
+
+def iter_logs_from_files(log_format: str, log_files: list, file_ext: str, chunk_size: int = CHUNK_SIZE,
+                         jobs: int = 1, engine: str = 'line', first_log_id: int = 1, pipeline: bool = False,
+                         csv_schema: dict = None):
+    """
+    Same as load_logs_into_df(), but yields the dataframe in chunks of (at most) chunk_size lines,
+    so that the memory usage does not depend on the size of the log files.
+    The logID and lineID columns are numbered in the same way as load_logs_into_df().
+    Note that the dtypes of .csv files are inferred for each chunk, not for each file, unless given in csv_schema.
+
+    :param log_format: log format for parsing log files
+    :param log_files: log files to read
+    :param file_ext: target log file extension (e.g., .log, .csv)
+    :param chunk_size: number of log lines per chunk
+    :param jobs: number of processes for parsing unstructured log files (1: serial; see iter_log_lines_in_parallel())
+    :param engine: parsing engine for unstructured logs (see read_log_lines())
+    :param first_log_id: logID of the first log file (if logID is added)
+    :param pipeline: whether to read the next files in a background thread while parsing (see FilePrefetcher),
+                     unless they are parsed in parallel or mapped (engine=mmap)
+    :param csv_schema: columns to load from .csv files, with their dtypes (None: all, inferred; see read_log_file())
+    :return: generator of dataframes
+    """
+    header, pattern = generate_pattern_from_log_format(log_format)
+    if file_ext.endswith('.csv') and csv_schema is not None and 'message' not in csv_schema:
+        print(f'ERROR: message is not in csv_schema={csv_schema}')
+        exit(-1)
+
+    log_id = first_log_id
+    num_log_lines = 0
+    pending, num_pending = [], 0
+    # a single pool for all the files, not one per file
+    parse_in_parallel = jobs > 1 and not file_ext.endswith('.csv')
+    prefetch = pipeline and not parse_in_parallel and (file_ext.endswith('.csv') or engine != 'mmap')
+    with ProcessPoolExecutor(max_workers=jobs) if parse_in_parallel else nullcontext() as executor, \
+            FilePrefetcher([os.path.join(path, file) for path, file in log_files]) if prefetch else nullcontext() \
+            as prefetcher:
+        for path, file in log_files:
+            # process each log file, one by one, chunk by chunk
+            log = prefetcher.open_next('rb' if file_ext.endswith('.csv') else 'r') if prefetch else None
+            if file_ext.endswith('.csv'):
+                log_dfs = iter_csv_chunks(os.path.join(path, file), chunk_size=chunk_size, log=log,
+                                          csv_schema=csv_schema)
+                first_log_df = next(log_dfs)  # even for a csv file without rows
+                columns = first_log_df.columns
+                log_dfs = chain([first_log_df], log_dfs)
+            else:
+                if 'message' not in header:
+                    print(f'ERROR: <message> is not in log_format={log_format}')
+                    exit(-1)
+                columns = header
+                if executor is not None:
+                    log_lines = iter_log_lines_in_parallel(executor, os.path.join(path, file), header=header,
+                                                           pattern=pattern, jobs=jobs, engine=engine)
+                else:
+                    log_lines = read_log_lines(os.path.join(path, file), header=header, pattern=pattern, engine=engine,
+                                               log=log)
+                log_dfs = (pd.DataFrame(lines, columns=header) for lines in iter_batches(log_lines, chunk_size))
+            add_ids = 'logID' not in header and 'logID' not in columns and 'lineID' not in columns
+
+            length = 0
+            for log_df in log_dfs:
+                # strip unnecessary white spaces in messages
+                log_df['message'] = log_df['message'].str.strip()
+
+                # add logID and lineID columns if needed
+                if add_ids:
+                    log_df.insert(0, 'lineID', range(length + 1, length + len(log_df) + 1))
+                    log_df.insert(0, 'logID', log_id)
+                length += len(log_df)
+
+                pending.append(log_df)
+                num_pending += len(log_df)
+                while num_pending >= chunk_size:
+                    logs_df = pd.concat(pending, ignore_index=True)
+                    rest = logs_df.iloc[chunk_size:].reset_index(drop=True)
+                    pending, num_pending = [rest], len(rest)
+                    num_log_lines += chunk_size
+                    yield logs_df.iloc[:chunk_size].copy()  # not a view of logs_df, so that it can be modified
+
+            if add_ids:
+                log_id += 1
+            metrics.count('parsing', bytes=os.path.getsize(os.path.join(path, file)))
+            logger.info(f'loaded log file (length={length}): {os.path.join(path, file)}')
+
+    if num_pending > 0 or num_log_lines == 0:
+        num_log_lines += num_pending
+        yield pd.concat(pending, ignore_index=True) if len(pending) > 0 else pd.DataFrame(columns=header)
+    print('Total number of log messages in raw logs: %d' % num_log_lines)
+
+
+def read_log_file(file_path: str, file_ext: str, header: list, pattern: str, engine: str = 'line', log=None,
+                  csv_schema: dict = None):
+    """
+    Read a single log file as it is, i.e., without stripping messages and adding logID and lineID.
+
+    A .csv file is read with all its columns and their dtypes inferred, unless a csv_schema (`csv_schema` in the
+    settings, e.g., {'date': 'str', 'level': 'category', 'message': 'str'}) is given: only its columns are then
+    loaded (in the order of the file), with the given dtypes (see get_read_csv_options()).
+
+    :param file_path: log file to read
+    :param file_ext: target log file extension (e.g., .log, .csv)
+    :param header: field names (e.g., from generate_pattern_from_log_format())
+    :param pattern: log line pattern (e.g., from generate_pattern_from_log_format())
+    :param engine: parsing engine for unstructured logs (see read_log_lines())
+    :param log: file_path already opened (e.g., by FilePrefetcher), in binary mode for .csv (None: open file_path)
+    :param csv_schema: columns to load from .csv files, with their dtypes (None: all, inferred)
+    :return: dataframe
+    """
+    if file_ext.endswith('.csv'):
+        # simply read the csv file since it's already structured
+        with open_log_file(file_path, 'rb') if log is None else log as f:
+            return pd.read_csv(f, **get_read_csv_options(csv_schema))
+    else:
+        # start processing the given log file using `header` and `pattern`
+        log_lines = list(read_log_lines(file_path, header=header, pattern=pattern, engine=engine, log=log))
+        return pd.DataFrame(log_lines, columns=header)
+
+
+def iter_csv_chunks(file_path: str, chunk_size: int, log=None, csv_schema: dict = None):
+    with open_log_file(file_path, 'rb') if log is None else log as f:
+        yield from pd.read_csv(f, **get_read_csv_options(csv_schema, chunk_size=chunk_size))
+
+
+def get_read_csv_options(csv_schema: dict = None, chunk_size: int = None):
+    """
+    Return the keyword arguments of pd.read_csv() for a structured log file with the given schema.
+    The C parser converts each field to its declared dtype as it is, e.g., `007` stays `007` for `str`, so that a file
+    read at once and in chunks gives the same dataframe. The pyarrow engine is not used, since pandas converts the
+    columns already inferred by pyarrow (e.g., `007` into `7.0`), instead of giving the dtypes to pyarrow.
+
+    :param csv_schema: columns to load, with their dtypes (None: all, inferred)
+    :param chunk_size: number of rows per chunk (None: the whole file at once)
+    :return: dict
+    """
+    options = {} if chunk_size is None else {'chunksize': chunk_size}
+    if csv_schema is None:
+        return options
+    options.update(usecols=list(csv_schema), dtype=dict(csv_schema))
+    return options
+
+
+def read_log_lines(file_path: str, header: list, pattern: str, engine: str = 'line', log=None):
+    """
+    Parse the given unstructured log file line by line, skipping the lines not matching the pattern.
+    Compressed files (see open_log_file()) are decompressed by a background thread while parsing,
+    and always parsed line by line since they cannot be mapped.
+
+    :param file_path: log file to read
+    :param header: field names (e.g., from generate_pattern_from_log_format())
+    :param pattern: log line pattern (e.g., from generate_pattern_from_log_format())
+    :param engine: `line` (iterate over the lines) or `mmap` (see read_log_lines_from_buffer())
+    :param log: file_path already opened in text mode (e.g., by FilePrefetcher), always parsed line by line
+                without counting its lines first (None: open file_path)
+    :return: generator of parsed log lines (a list of field values, in the order of header)
+    """
+    compressed = get_compression(file_path) is not None
+    if log is not None:
+        with log:
+            yield from parse_log_lines(tqdm(log), header=header, pattern=pattern)
+        return
+    if engine == 'mmap' and not compressed:
+        yield from read_log_lines_from_buffer(file_path, header=header, pattern=pattern)
+        return
+
+    with open_log_file(file_path) as log:
+        # for line in log:
+        yield from parse_log_lines(tqdm(log, total=None if compressed else get_num_lines(file_path)),
+                                   header=header, pattern=pattern)
+
+
+def parse_log_lines(lines, header: list, pattern: str):
+    parser = compile_log_pattern(header, pattern)
+    for line in lines:
+        log_line = parser.parse(line.strip())
+        if log_line is not None:
+            yield log_line
         else:
-            # start processing the given log file using `header` and `pattern`
-            if 'message' not in header:
-                print(f'ERROR: <message> is not in log_format={log_format}')
-                exit(-1)
-
-            log_lines = []
-            with open(os.path.join(path, file), 'r', errors='replace') as log:
-                # for line in log:
-                for line in tqdm(log, total=get_num_lines(os.path.join(path, file))):
-                    m = re.match(pattern, line.strip())
-                    if m:
-                        log_line = [m.group(h) for h in header]
-                        log_lines.append(log_line)
+            logger.debug(f'Skip non-matched log_line={line.strip()}')
+
+
+def read_log_lines_from_buffer(file_path: str, header: list, pattern: str, start: int = 0, end: int = None,
+                               progress: bool = True):
+    """
+    Same as read_log_lines(), but maps the file (read-only) and runs a single multiline pattern over the buffer
+    with finditer() instead of matching each line in Python. The buffer is decoded in blocks ending with a line,
+    and the progress is reported in bytes, so the file is never read twice.
+
+    :param file_path: log file to read
+    :param header: field names (e.g., from generate_pattern_from_log_format())
+    :param pattern: log line pattern (e.g., from generate_pattern_from_log_format())
+    :param start: first byte to read (must be the beginning of a line)
+    :param end: last byte (exclusive) to read (must be the end of a line or the file); None for the end of the file
+    :param progress: whether to show a progress bar
+    :return: generator of parsed log lines (a list of field values, in the order of header)
+    """
+    buffer_pattern = generate_buffer_pattern(pattern)
+    with open(file_path, 'rb') as fp:
+        size = os.fstat(fp.fileno()).st_size
+        end = size if end is None else end
+        if end <= start:
+            return
+
+        num_lines, num_matched = 0, 0
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as buf, \
+                tqdm(total=end - start, unit='B', unit_scale=True, disable=not progress) as bar:
+            block_start = start
+            while block_start < end:
+                block_end = end
+                if block_start + MMAP_BLOCK_SIZE < end:
+                    block_end = buf.find(b'\n', block_start + MMAP_BLOCK_SIZE - 1, end) + 1 or end
+                # decode as open(file_path, 'r', errors='replace') does (incl. universal newlines)
+                text = io.TextIOWrapper(io.BytesIO(buf[block_start:block_end]), errors='replace').read()
+                num_lines += text.count('\n') + (0 if text.endswith('\n') else 1)
+
+                for m in buffer_pattern.finditer(text):
+                    if '\n' in m.group(0):
+                        # the pattern (e.g., a negated character class in log_format) went across lines;
+                        # parse these lines one by one as read_log_lines() does
+                        for log_line in parse_log_lines(m.group(0).split('\n'), header=header, pattern=pattern):
+                            num_matched += 1
+                            yield log_line
                     else:
-                        logger.debug(f'Skip non-matched log_line={line.strip()}')
-            log_df = pd.DataFrame(log_lines, columns=header)
+                        num_matched += 1
+                        yield list(m.group(*header)) if len(header) > 1 else [m.group(header[0])]
 
-        # strip unnecessary white spaces in messages
-        log_df['message'] = log_df['message'].str.strip()
-        length = log_df['message'].size
+                bar.update(block_end - block_start)
+                block_start = block_end
+        logger.debug(f'Skip {num_lines - num_matched} non-matched log lines in {file_path}')
 
-        # add logID and lineID columns if needed
-        if 'logID' not in header and 'logID' not in log_df.columns and 'lineID' not in log_df.columns:
-            log_df.insert(0, 'lineID', None)
-            log_df['lineID'] = [i + 1 for i in range(length)]
-            log_df.insert(0, 'logID', log_id)
-            log_id += 1
 
-        # append log_df to logs_df
-        log_dfs.append(log_df)
-        logger.info(f'loaded log file (length={length}): {os.path.join(path, file)}')
+def generate_buffer_pattern(pattern: str):
+    """
+    Turn a log line pattern (from generate_pattern_from_log_format()) into a compiled multiline pattern that
+    matches the same lines, with the same groups, within a buffer of many lines.
+    As re.match(pattern, line.strip()) does, leading spaces are skipped atomically
+    and the match must end with a non-space character followed by trailing spaces only.
+    """
+    body = pattern[1:-1].replace(r'\s+', r'[^\S\n]+')  # without `^` and `$`; spaces never include a new line
+    last_field = re.search(r'\(\?P<([^>]+)>\.\+\??\)$', body)
+    if last_field:
+        # a trailing field (e.g., <message>) simply ends with the last non-space character of the line
+        body = body[:last_field.start()] + f'(?P<{last_field.group(1)}>' + r'[^\n]*\S)'
+        tail = r'[^\S\n]*$'
+    else:
+        tail = r'(?<!\s)[^\S\n]*$'
+    return re.compile(r'(?m)^(?=(?P<_lead>[^\S\n]*))(?P=_lead)(?:' + body + ')' + tail)
 
-    logs_df = pd.concat(log_dfs, ignore_index=True)
-    print(f'Total number of log messages in raw logs: %d' % len(logs_df))
 
-    return logs_df
+def read_log_files_in_parallel(log_files: list, file_ext: str, header: list, pattern: str, jobs: int,
+                               part_size: int = PARSE_PART_SIZE, engine: str = 'line', csv_schema: dict = None):
+    """
+    Same as calling read_log_file() for each log file, but in a pool of `jobs` processes.
+    Unstructured log files larger than part_size bytes are split at line boundaries so that
+    a single huge file is parsed by several processes; compressed files are read as a whole by a single process.
+
+    :param log_files: log files to read
+    :param file_ext: target log file extension (e.g., .log, .csv)
+    :param header: field names (e.g., from generate_pattern_from_log_format())
+    :param pattern: log line pattern (e.g., from generate_pattern_from_log_format())
+    :param jobs: number of processes
+    :param part_size: (approximate) maximum number of bytes per part
+    :param engine: parsing engine for unstructured logs (see read_log_lines())
+    :param csv_schema: columns to load from .csv files, with their dtypes (None: all, inferred; see read_log_file())
+    :return: a list of dataframes, in the same order as log_files
+    """
+    parts = []
+    for i, (path, file) in enumerate(log_files):
+        file_path = os.path.join(path, file)
+        if file_ext.endswith('.csv') or get_compression(file_path) is not None:
+            parts.append((i, file_path, file_ext, None, None, header, pattern, engine, csv_schema))
+        else:
+            for start, end in split_file_at_line_boundaries(file_path, part_size=part_size):
+                parts.append((i, file_path, file_ext, start, end, header, pattern, engine, None))
+    logger.info(f'read_log_files_in_parallel: {len(log_files)} files in {len(parts)} parts, jobs={jobs}')
+
+    log_lines = [[] for _ in log_files]
+    log_dfs = [None for _ in log_files]
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for (i, *_), parsed in tqdm(zip(parts, executor.map(read_log_file_part, parts)), total=len(parts)):
+            if isinstance(parsed, pd.DataFrame):
+                log_dfs[i] = parsed
+            else:
+                log_lines[i].extend(parsed)
+    return [log_df if log_df is not None else pd.DataFrame(lines, columns=header)
+            for log_df, lines in zip(log_dfs, log_lines)]
+
+
+def iter_log_lines_in_parallel(executor: ProcessPoolExecutor, file_path: str, header: list, pattern: str, jobs: int,
+                               part_size: int = PARSE_PART_SIZE, engine: str = 'line'):
+    """
+    Same as read_log_lines(), but parses the parts of the file (see split_file_at_line_boundaries()) in the given pool.
+    At most `jobs` parts are parsed ahead of the consumer, so the memory usage stays bounded by jobs * part_size
+    as in the streaming mode, instead of the size of the log file.
+    A compressed file cannot be split at byte offsets, so it is decompressed here (see open_log_file())
+    and its lines are sent to the pool in parts of about part_size characters instead.
+
+    :param executor: pool of (at least) `jobs` processes
+    :param file_path: unstructured log file to read
+    :param header: field names (e.g., from generate_pattern_from_log_format())
+    :param pattern: log line pattern (e.g., from generate_pattern_from_log_format())
+    :param jobs: number of parts parsed ahead
+    :param part_size: (approximate) maximum number of bytes per part
+    :param engine: parsing engine for unstructured logs (see read_log_lines())
+    :return: generator of parsed log lines (a list of field values, in the order of header)
+    """
+    if get_compression(file_path) is None:
+        parts = split_file_at_line_boundaries(file_path, part_size=part_size)
+        logger.info(f'iter_log_lines_in_parallel: {file_path} in {len(parts)} parts, jobs={jobs}')
+        tasks = ((read_log_file_part, (0, file_path, '.log', start, end, header, pattern, engine, None))
+                 for start, end in parts)
+    else:
+        logger.info(f'iter_log_lines_in_parallel: {file_path} (compressed) in parts of lines, jobs={jobs}')
+        parts = None
+        tasks = ((parse_log_lines_part, (lines, header, pattern))
+                 for lines in iter_line_parts(file_path, part_size=part_size))
+
+    futures = deque()
+    for fn, part in tqdm(tasks, total=None if parts is None else len(parts)):
+        futures.append(executor.submit(fn, part))
+        if len(futures) > jobs:
+            yield from futures.popleft().result()  # keeps the order of parts
+    while len(futures) > 0:
+        yield from futures.popleft().result()
+
+
+def read_log_file_part(part: tuple):
+    _, file_path, file_ext, start, end, header, pattern, engine, csv_schema = part
+    if start is None:
+        return read_log_file(file_path, file_ext=file_ext, header=header, pattern=pattern, engine=engine,
+                             csv_schema=csv_schema)
+    if engine == 'mmap':
+        return list(read_log_lines_from_buffer(file_path, header=header, pattern=pattern, start=start, end=end,
+                                               progress=False))
+
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    # decode as open(file_path, 'r', errors='replace') does; parts never split a line
+    log = io.TextIOWrapper(io.BytesIO(data), errors='replace')
+    return list(parse_log_lines(log, header=header, pattern=pattern))
+
+
+def parse_log_lines_part(part: tuple):
+    lines, header, pattern = part
+    return list(parse_log_lines(lines, header=header, pattern=pattern))
+
+
+def iter_line_parts(file_path: str, part_size: int):
+    """
+    Yield the lines of the given (possibly compressed) file in lists of about part_size characters.
+    """
+    with open_log_file(file_path) as log:
+        while True:
+            lines = log.readlines(part_size)
+            if len(lines) == 0:
+                return
+            yield lines
 
 
-def generate_pattern_from_log_format(log_format: str):
-    header = re.findall(r'<(\S+?)>', log_format)
-    pattern = re.sub(r'(<\S+?>)', r'(?P\1.+?)', log_format)
-    pattern = re.sub(r'<(\S+)_ext>\.\+\?', r'<\1_ext>.+',
-                     pattern)  # bypassing the issue of `test_generate_pattern_from_format_Zookeeper`
-    pattern = re.sub(r'\s+', r'\\s+', pattern)
-    pattern = '^' + pattern + '$'
-    return header, pattern
+def split_file_at_line_boundaries(file_path: str, part_size: int):
+    """
+    Return byte ranges (start, end) of the given file, each of which is about part_size bytes and ends with a line.
+    """
+    size = os.path.getsize(file_path)
+    offsets = [0]
+    with open(file_path, 'rb') as f:
+        while offsets[-1] + part_size < size:
+            f.seek(offsets[-1] + part_size)
+            f.readline()
+            if f.tell() >= size:
+                break
+            offsets.append(f.tell())
+    offsets.append(size)
+    return list(zip(offsets[:-1], offsets[1:]))
+
+
+def iter_batches(iterable, batch_size: int):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if len(batch) == 0:
+            return
+        yield batch
 
 
 def split_log(system: str, log_dir: str, log_split_keyword: str, output_dir: str = None):
@@ -304,22 +1300,28 @@ def split_log(system: str, log_dir: str, log_split_keyword: str, output_dir: str
     read_lines = list()
 
     # split a single log file containing multiple execution logs
-    for path, log_file in get_log_files_under_dir(log_dir):
-        with open(os.path.join(path, log_file), 'r', errors='replace') as log:
-            for line in log:
-                if log_split_keyword in line and len(read_lines) > 0:
-                    # write a new log (file)
+    with metrics.stage('split_log') as counts:
+        for path, log_file in get_log_files_under_dir(log_dir):
+            with open_log_file(os.path.join(path, log_file)) as log:
+                num_lines = 0
+                for line in log:
+                    if log_split_keyword in line and len(read_lines) > 0:
+                        # write a new log (file)
+                        write_new_log(system=system, log_id=log_id, log_lines=read_lines,
+                                      split_log_dir=split_log_dir)
+
+                        # initialize read_lines and update log_id
+                        read_lines = list()
+                        log_id += 1
+
+                    read_lines.append(line)
+                    num_lines += 1
+
+                # write remaining read_lines
+                if len(read_lines) > 0:
                     write_new_log(system=system, log_id=log_id, log_lines=read_lines, split_log_dir=split_log_dir)
-
-                    # initialize read_lines and update log_id
-                    read_lines = list()
-                    log_id += 1
-
-                read_lines.append(line)
-
-            # write remaining read_lines
-            if len(read_lines) > 0:
-                write_new_log(system=system, log_id=log_id, log_lines=read_lines, split_log_dir=split_log_dir)
+            counts['lines'] = counts.get('lines', 0) + num_lines
+            counts['bytes'] = counts.get('bytes', 0) + os.path.getsize(os.path.join(path, log_file))
 
     print('Splitting logs done. [Time taken: %.3f sec]' % (time.time() - start_time))
     return split_log_dir
@@ -333,36 +1335,101 @@ def write_new_log(system: str, log_id: int, log_lines: list, split_log_dir: str)
     logger.debug(f'{new_log} (size={len(log_lines)})')
 
 
-def read_templates_into_df(system: str, template_dir: str):
+def iter_split_log_lines(log_dir: str, log_split_keyword: str):
     """
-    Read templates from `self.template_dir/{self.system}_templates.csv`.
-    Exit here if there is no such file.
+    Same as reading the log files written by split_log() one by one, but without writing them:
+    the lines of all log files are split into logs in the same way, i.e., a new log starts at each line having
+    log_split_keyword, and a last line without a new line is joined with the next line if it is in the same log.
+    The `split` directory (of split_log()) under log_dir, if any, is ignored.
+
+    :param log_dir: input log dir
+    :param log_split_keyword: log splitting keyword
+    :return: generator of (log_id, line), where log_id starts from 1
     """
+    split_log_dir = os.path.join(log_dir, 'split')
+    log_id = 1
+    num_read_lines = 0
+    partial_line = ''
+    for path, log_file in get_log_files_under_dir(log_dir):
+        if os.path.commonpath([split_log_dir, path]) == split_log_dir:
+            continue
+        with open_log_file(os.path.join(path, log_file)) as log:
+            for line in log:
+                if log_split_keyword in line and num_read_lines > 0:
+                    if partial_line:
+                        yield log_id, partial_line
+                        partial_line = ''
+                    num_read_lines = 0
+                    log_id += 1
+                num_read_lines += 1
 
-    templates_df = None
+                line = partial_line + line
+                if line.endswith('\n'):
+                    partial_line = ''
+                    yield log_id, line
+                else:
+                    partial_line = line  # the last line of a log file
+    if partial_line:
+        yield log_id, partial_line
 
-    # read templates (if exist)
-    template_file = os.path.join(template_dir, f'{system}_templates.csv')
-    if os.path.isfile(template_file):
-        templates_df = pd.read_csv(os.path.join(template_file), index_col='tid')
-        print(f'Total number of templates loaded: {len(templates_df)}')
-        logger.info(f'Total number of templates loaded: {len(templates_df)}')
-    else:
-        print(f'ERROR: No such file: {template_file}')
-        exit(0)
 
-    if 'template' not in templates_df.columns:
-        print(f'ERROR: {template_file} has no columns `tid` and `template`')
-        exit(0)
+def iter_split_logs(log_format: str, log_dir: str, log_split_keyword: str):
+    """
+    Parse the logs from iter_split_log_lines() according to the given log_format.
+
+    :param log_format: log format for parsing log files
+    :param log_dir: input log dir
+    :param log_split_keyword: log splitting keyword
+    :return: generator of parsed log lines, each of which starts with logID and lineID unless logID is in log_format
+    """
+    header, pattern = generate_pattern_from_log_format(log_format)
+    parser = compile_log_pattern(header, pattern)
+    add_ids = 'logID' not in header and 'lineID' not in header
+    current_log_id, line_id = None, 0
+    for log_id, line in iter_split_log_lines(log_dir, log_split_keyword):
+        log_line = parser.parse(line.strip())
+        if log_line is None:
+            logger.debug(f'Skip non-matched log_line={line.strip()}')
+            continue
+        if not add_ids:
+            yield log_line
+            continue
+        if log_id != current_log_id:
+            current_log_id, line_id = log_id, 0
+        line_id += 1
+        yield [log_id, line_id] + log_line
 
+
+def read_templates_into_df(system: str, template_dir: str):
+    """
+    Read templates from `self.template_dir/{self.system}_templates.csv`.
+    Exit here if there is no such file.
+    """
+    try:
+        templates_df = load_templates_df(system=system, template_dir=template_dir)
+    except (FileNotFoundError, ValueError) as e:
+        print(f'ERROR: {e}')
+        exit(0)
+    print(f'Total number of templates loaded: {len(templates_df)}')
+    logger.info(f'Total number of templates loaded: {len(templates_df)}')
     return templates_df
 
 
-def generate_pattern_from_template(template: str):
-    escaped = re.escape(template)
-    spaced_escape = re.sub(r'\\\s+', "\\\s+", escaped)
-    spaced_escape = re.sub(r'<[A-Z]{1,3}>', r'<\*>', spaced_escape)  # substitue <NUM> or <ID> into <*>
-    return "^" + spaced_escape.replace(r"<\*>", r"(.*?)") + "$"  # a single <*> can consume multiple tokens
+def load_templates_df(system: str, template_dir: str):
+    """
+    Same as read_templates_into_df(), but raises an error instead of exiting, e.g., for a library (see LogStructurer).
+
+    :param system: system name
+    :param template_dir: template dir having `{system}_templates.csv`
+    :return: templates (pandas.DataFrame, indexed by tid)
+    """
+    template_file = os.path.join(template_dir, f'{system}_templates.csv')
+    if not os.path.isfile(template_file):
+        raise FileNotFoundError(f'No such file: {template_file}')
+    templates_df = pd.read_csv(template_file)
+    if 'tid' not in templates_df.columns or 'template' not in templates_df.columns:
+        raise ValueError(f'{template_file} has no columns `tid` and `template`')
+    return templates_df.set_index('tid')
 
 
 def find_matching_template(message):
@@ -371,13 +1438,4 @@ def find_matching_template(message):
     :param message: a log message (only the message)
     :return: (tid, template, parameter_list)
     """
-    for r in sorted(templates_dict.keys(), key=lambda x: len(x), reverse=True):
-        m = re.match(r, message)
-        if m:
-            tid, template = templates_dict[r]
-            if '<*>' in template:
-                return tid, template, list(m.groups())
-            else:
-                return tid, template, []
-    logger.debug(f'No template: {message}')
-    return '-', '__NOT_MATCHING__', '-'
+    return template_index.match(message)
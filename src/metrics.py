@@ -0,0 +1,275 @@
+import os
+import re
+import sys
+import json
+import time
+import cProfile
+import resource
+import threading
+from contextlib import contextmanager
+
+import logging
+logger = logging.getLogger(__name__)
+
+STAGE_COUNTERS = ['lines', 'bytes']
+
+
+class StageMetrics:
+    """
+    Per-stage metrics of a run, e.g., the wall time, CPU time, lines, and bytes of `parsing` for each system.
+
+    A stage is measured with `with metrics.stage('parsing') as counts: ...`, where counts (a dict) takes the numbers
+    processed by the stage (e.g., counts['lines'] += len(logs_df)); entering the same stage again (e.g., for each
+    chunk) accumulates the numbers. Nested stages are exclusive, i.e., the time of `discovery` in `split_log` is not
+    counted for `split_log`. Nothing is measured until start() is called, so the stages cost nothing by default.
+    Stages can be measured by several threads at a time (e.g., `writing` by the writer thread of a pipeline), each
+    with its own nesting; the CPU time of a thread other than the main one is its own only, and it is not profiled.
+
+    The memory of a stage is its peak RSS (`peak_rss_mb`) and the RSS it has added (`rss_delta_mb`, negative if freed),
+    both exclusive of its nested stages as the times are. On Linux, the peak RSS of the process is reset whenever a
+    stage of the main thread starts or resumes (see reset_peak_rss()), so that the peak is the stage's own; elsewhere,
+    it is the peak of the process so far. A stage of another thread takes the RSS when it pauses instead, not to reset
+    the peak of the main thread. Worker processes (e.g., `-j`) are only in `children_peak_rss_mb` of the `total` record.
+
+    The records of each system, followed by a `total` record for the whole system, are appended to a JSONL report
+    when the system ends (see end_system()), and all the records are written as a JSON report by finish().
+    With a profile_dir, a cProfile dump is written for each stage of each system as well (`{system}_{stage}.prof`).
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.system = None
+        self.report_file = None
+        self.profile_dir = None
+        self._records = {}  # (system, stage) -> record
+        self._profiles = {}  # (system, stage) -> cProfile.Profile
+        self._local = threading.local()  # stack (`active`) of (record, start times) per thread, the innermost last
+        self._lock = threading.Lock()  # for the records and profiles shared by the threads
+        self._start_time = None
+        self._system_start_times = None
+        self._resettable = False  # whether the peak RSS can be reset (see reset_peak_rss())
+
+    def start(self, report_file: str, profile_dir: str = None):
+        """
+        Start recording the stages. Several processes (e.g., one per system) can share the same report_file.
+
+        :param report_file: JSONL report (the JSON report has the same name with `.json` instead)
+        :param profile_dir: directory to dump cProfile data into (None: no profiling)
+        """
+        self.enabled = True
+        self.report_file = report_file
+        self.profile_dir = profile_dir
+        self._start_time = time.time()
+        self._resettable = reset_peak_rss()
+        if profile_dir is not None:
+            os.makedirs(profile_dir, exist_ok=True)
+
+    def start_system(self, system: str):
+        self.end_system()
+        self.system = system
+        self._system_start_times = (time.perf_counter(), get_cpu_time())
+        if self._resettable:
+            reset_peak_rss()
+
+    def end_system(self):
+        """
+        Append the records of the current system to the JSONL report and dump its profiles (if any).
+        """
+        if not self.enabled or self.system is None:
+            return
+        wall_start, cpu_start = self._system_start_times
+        # the peak of the system is the largest one of its stages or of the time between them
+        peak_rss_mb = get_stage_peak_rss_mb() if self._resettable else get_peak_rss_mb()
+        for (system, _), record in self._records.items():
+            if system == self.system:
+                peak_rss_mb = max(peak_rss_mb, record.get('peak_rss_mb', 0.0))
+        self._records[(self.system, 'total')] = {
+            'system': self.system, 'stage': 'total', 'wall_sec': time.perf_counter() - wall_start,
+            'cpu_sec': get_cpu_time() - cpu_start, 'peak_rss_mb': peak_rss_mb,
+            'children_peak_rss_mb': get_peak_rss_mb(children=True)}
+        records = [rounded(record) for (system, _), record in self._records.items() if system == self.system]
+        with open(self.report_file, 'a') as f:
+            # in a single write, not to interleave with the records of another process (see finish())
+            f.write(''.join(json.dumps(record) + '\n' for record in records))
+        for (system, stage), profile in self._profiles.items():
+            if system == self.system:
+                profile.dump_stats(os.path.join(self.profile_dir, f'{system}_{stage}.prof'))
+        logger.info(f'StageMetrics: {len(records)} stages of {self.system} written into {self.report_file}')
+        self.system = None
+
+    def finish(self, **info):
+        """
+        End the current system and write all the records as a JSON report, with the given info (e.g., arguments).
+        """
+        if not self.enabled:
+            return
+        self.end_system()
+        report = dict(info, wall_sec=round(time.time() - self._start_time, 4), systems={})
+        if os.path.exists(self.report_file):
+            # from the JSONL report, so that the systems run by other processes (see start()) are included
+            with open(self.report_file, 'r') as f:
+                for line in f:
+                    record = json.loads(line)
+                    report['systems'].setdefault(record['system'], {})[record['stage']] = record
+        with open(os.path.splitext(self.report_file)[0] + '.json', 'w') as f:
+            json.dump(report, f, indent=2)
+        self.enabled = False
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Measure the given stage of the current system, and yield a dict of its counters (e.g., `lines`).
+        """
+        counts = {}
+        if not self.enabled:
+            yield counts
+            return
+
+        record = self._get_record(name)
+        active = self._get_active()
+        if len(active) > 0:
+            self._pause(*active[-1])
+        active.append((record, self._resume(record)))
+        try:
+            yield counts
+        finally:
+            self._pause(*active.pop())  # resumed since entered if a nested stage has ended
+            if len(active) > 0:
+                active[-1] = (active[-1][0], self._resume(active[-1][0]))
+
+            with self._lock:
+                record['calls'] += 1
+                for counter, value in counts.items():
+                    record[counter] = record.get(counter, 0) + value
+                record['lines_per_sec'] = record['lines'] / record['wall_sec'] if record['wall_sec'] > 0 else 0.0
+
+    def count(self, name: str, **counts):
+        """
+        Add the given counters (e.g., bytes=1024) to the given stage of the current system, without measuring time.
+        """
+        if not self.enabled:
+            return
+        record = self._get_record(name)
+        with self._lock:
+            for counter, value in counts.items():
+                record[counter] = record.get(counter, 0) + value
+
+    def iter_stage(self, name: str, iterable):
+        """
+        Yield the items of iterable (e.g., the chunks of a streamed log), measuring the time taken by each item as
+        the given stage; the number of rows (len()) of each item is counted as `lines`.
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name) as counts:
+                item = next(iterator, StopIteration)
+                if item is not StopIteration:
+                    counts['lines'] = len(item)
+            if item is StopIteration:
+                return
+            yield item
+
+    def _get_record(self, name: str):
+        with self._lock:
+            return self._records.setdefault((self.system, name), {
+                'system': self.system, 'stage': name, 'calls': 0, 'wall_sec': 0.0, 'cpu_sec': 0.0,
+                'peak_rss_mb': 0.0, 'rss_delta_mb': 0.0, **{counter: 0 for counter in STAGE_COUNTERS}})
+
+    def _get_active(self):
+        if not hasattr(self._local, 'active'):
+            self._local.active = []
+        return self._local.active
+
+    def _resume(self, record: dict):
+        main_thread = threading.current_thread() is threading.main_thread()
+        if main_thread and self.profile_dir is not None:
+            with self._lock:
+                profile = self._profiles.setdefault((record['system'], record['stage']), cProfile.Profile())
+            profile.enable()
+        if main_thread and self._resettable:
+            reset_peak_rss()
+        return time.perf_counter(), get_cpu_time() if main_thread else time.thread_time(), get_rss_mb()
+
+    def _pause(self, record: dict, start_times: tuple):
+        main_thread = threading.current_thread() is threading.main_thread()
+        if main_thread and self.profile_dir is not None:
+            self._profiles[(record['system'], record['stage'])].disable()
+        wall_start, cpu_start, rss_start = start_times
+        wall_sec = time.perf_counter() - wall_start
+        cpu_sec = (get_cpu_time() if main_thread else time.thread_time()) - cpu_start
+        rss_end = get_rss_mb()
+        if main_thread and self._resettable:
+            peak_rss_mb = get_stage_peak_rss_mb()
+        else:
+            peak_rss_mb = rss_end if rss_end is not None and self._resettable else get_peak_rss_mb()
+        with self._lock:
+            record['wall_sec'] += wall_sec
+            record['cpu_sec'] += cpu_sec
+            record['peak_rss_mb'] = max(record['peak_rss_mb'], peak_rss_mb)
+            if rss_start is not None and rss_end is not None:
+                record['rss_delta_mb'] += rss_end - rss_start
+
+
+def rounded(record: dict):
+    return {key: round(value, 4) if isinstance(value, float) else value for key, value in record.items()}
+
+
+def get_cpu_time():
+    # including the worker processes that have ended (e.g., a pool shut down in the stage)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time() + children.ru_utime + children.ru_stime
+
+
+def get_peak_rss_mb(children: bool = False):
+    """
+    Return the peak RSS (MB) of this process (and of its largest ended child process, if children) since it started.
+    """
+    # ru_maxrss is in kilobytes on Linux, but in bytes on macOS
+    unit = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if children:
+        peak = max(peak, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak / unit
+
+
+def reset_peak_rss():
+    """
+    Reset the peak RSS of this process to its current RSS, so that get_stage_peak_rss_mb() returns the peak since then.
+    Linux only, by clearing the high water mark (VmHWM) through /proc/self/clear_refs.
+
+    :return: whether the peak RSS has been reset
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def get_stage_peak_rss_mb():
+    """
+    Return the peak RSS (MB) of this process since the last reset_peak_rss() (or since it started).
+    """
+    peak = read_proc_status_mb('VmHWM')
+    return get_peak_rss_mb() if peak is None else peak
+
+
+def get_rss_mb():
+    """
+    Return the current RSS (MB) of this process, or None if unknown (i.e., not on Linux).
+    """
+    return read_proc_status_mb('VmRSS')
+
+
+def read_proc_status_mb(field: str):
+    # e.g., `VmRSS:    10088 kB` in /proc/self/status
+    try:
+        with open('/proc/self/status', 'r') as f:
+            m = re.search(rf'^{field}:\s+(\d+) kB', f.read(), re.MULTILINE)
+    except OSError:
+        return None
+    return int(m.group(1)) / 1024 if m else None
+
+
+metrics = StageMetrics()  # kept for the whole run, across systems
@@ -0,0 +1,196 @@
+import os
+import ast
+import queue
+import threading
+import pandas as pd
+from src.metrics import metrics
+
+import logging
+logger = logging.getLogger(__name__)
+
+OUTPUT_FORMATS = ['csv', 'parquet', 'feather']
+CATEGORY_COLUMNS = ['tid', 'template', 'level', 'component']
+ID_COLUMNS = ['logID', 'lineID']
+WRITE_QUEUE_SIZE = 2  # dataframes waiting for the writer thread
+
+
+def get_output_file(output_dir: str, name: str, output_format: str = 'csv'):
+    """
+    Return the path of an output file, e.g., output/HDFS/HDFS_structured_logs.parquet.
+
+    :param output_dir: output dir
+    :param name: file name without extension (e.g., HDFS_structured_logs)
+    :param output_format: one of OUTPUT_FORMATS
+    :return: file path
+    """
+    return os.path.join(output_dir, f'{name}.{output_format}')
+
+
+def check_output_format(output_format: str):
+    """
+    Exit if the given output format is unknown or its (optional) dependency, pyarrow, is not installed.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        print(f'ERROR: unknown output_format={output_format} (must be one of {OUTPUT_FORMATS})')
+        exit(-1)
+    if output_format != 'csv':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            print(f'ERROR: output_format={output_format} requires pyarrow (pip install pyarrow)')
+            exit(-1)
+
+
+def compact_df(df: pd.DataFrame):
+    """
+    Downcast the columns of a (structured) log dataframe, in place, to reduce its memory usage:
+    - `tid`, `template`, `level`, and `component` become categorical (dictionary-encoded)
+    - `logID` and `lineID` become uint32
+    - `values` becomes a list column (the stringified lists, e.g., '[]', are parsed)
+    The other columns (e.g., `message`) are kept as they are.
+
+    :param df: dataframe
+    :return: df
+    """
+    for column in CATEGORY_COLUMNS:
+        if column in df.columns and not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype('category')
+    for column in ID_COLUMNS:
+        if column in df.columns and pd.api.types.is_integer_dtype(df[column].dtype):
+            df[column] = df[column].astype('uint32')
+    if 'values' in df.columns and len(df) > 0 and isinstance(df['values'].iat[0], str):
+        parsed = {values: ast.literal_eval(values) for values in df['values'].unique()}
+        df['values'] = df['values'].map(parsed)
+    return df
+
+
+class DataFrameWriter:
+    """
+    Write dataframes having the same columns (e.g., chunks of a structured log) into a single file, one by one.
+
+    For csv, each dataframe is appended as it is (to the existing file as well if append is True). For parquet and
+    feather (Arrow IPC), each dataframe is compacted (see compact_df()) and written as a row group (record batch); the
+    categories of each column only grow across dataframes, so that a single dictionary per column (extended with
+    deltas) is shared by all of them.
+
+    In the background mode, the dataframes are serialized and written by a writer thread, while the caller goes on
+    (e.g., parsing the next chunk); write() waits only if WRITE_QUEUE_SIZE dataframes are already waiting, and an
+    error of the writer thread is raised by the next write() or close().
+    """
+
+    def __init__(self, output_file: str, output_format: str = 'csv', append: bool = False, background: bool = False):
+        if append and output_format != 'csv':
+            raise ValueError(f'Cannot append to an existing {output_format} file: {output_file}')
+        self.output_file = output_file
+        self.output_format = output_format
+        self.num_rows = 0
+        self._writer = None
+        self._schema = None
+        self._append = append
+        self._categories = {}
+        self._initial_size = os.path.getsize(output_file) if append and os.path.exists(output_file) else 0
+        self._thread = None
+        self._error = None
+        if background:
+            self._queue = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+            self._thread = threading.Thread(target=self._write_in_background, daemon=True)
+            self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write(self, df: pd.DataFrame):
+        """
+        Write the given dataframe; note that it is compacted in place for parquet and feather.
+        In the background mode, it is written later, so it must not be modified after this call.
+        """
+        if self._thread is None:
+            self._write(df)
+            return
+        self._raise_error()
+        self._queue.put(df)
+
+    def _write_in_background(self):
+        while True:
+            df = self._queue.get()
+            if df is None:
+                return
+            if self._error is None:
+                try:
+                    self._write(df)
+                except Exception as e:
+                    self._error = e  # the other dataframes are dropped, but still taken not to block write()
+
+    def _raise_error(self):
+        error, self._error = self._error, None  # raised once
+        if error is not None:
+            raise error
+
+    def _write(self, df: pd.DataFrame):
+        with metrics.stage('writing') as counts:
+            if self.output_format == 'csv':
+                # the first dataframe (re)creates the file with the header, the others are appended without it
+                first = self._schema is None and not self._append
+                df.to_csv(self.output_file, mode='w' if first else 'a', header=first, index=False)
+                self._schema = list(df.columns)
+            else:
+                table = self._to_table(compact_df(df))
+                if self._writer is None:
+                    self._open(table.schema)
+                self._writer.write_table(table.cast(self._schema))
+            counts['lines'] = len(df)
+        self.num_rows += len(df)
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            self._raise_error()
+        with metrics.stage('writing') as counts:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            if self._schema is not None and self._initial_size is not None:
+                counts['bytes'] = os.path.getsize(self.output_file) - self._initial_size
+                self._initial_size = None  # counted once, even if closed again
+        logger.info(f'DataFrameWriter: {self.num_rows} rows written into {self.output_file}')
+
+    def _open(self, schema):
+        import pyarrow.ipc as ipc
+        import pyarrow.parquet as pq
+        self._schema = schema
+        if self.output_format == 'parquet':
+            self._writer = pq.ParquetWriter(self.output_file, schema)
+        else:
+            self._writer = ipc.new_file(self.output_file, schema,
+                                        options=ipc.IpcWriteOptions(compression='lz4', emit_dictionary_deltas=True))
+
+    def _to_table(self, df: pd.DataFrame):
+        import pyarrow as pa
+
+        # extend the categories seen so far, so that the dictionaries only grow
+        for column in df.columns:
+            if isinstance(df[column].dtype, pd.CategoricalDtype):
+                categories = self._categories.get(column)
+                if categories is None:
+                    categories = df[column].cat.categories
+                else:
+                    new_categories = df[column].cat.categories.difference(categories, sort=False)
+                    if len(new_categories) > 0:
+                        categories = categories.append(new_categories)
+                    df[column] = df[column].cat.set_categories(categories)
+                self._categories[column] = categories
+
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        fields = []
+        for field in table.schema:
+            if pa.types.is_dictionary(field.type):
+                field = field.with_type(pa.dictionary(pa.int32(), field.type.value_type))
+            elif field.name == 'values':
+                field = field.with_type(pa.list_(pa.string()))
+            fields.append(field)
+        return table.cast(pa.schema(fields, metadata=table.schema.metadata))
@@ -0,0 +1,91 @@
+import os
+import json
+import hashlib
+import pandas as pd
+
+import logging
+logger = logging.getLogger(__name__)
+
+PARSE_CACHE_VERSION = 1  # to be increased whenever the parsed dataframes change
+PARSE_CACHE_SIZE = 2 * 1024 ** 3
+
+
+class ParsedLogCache:
+    """
+    On-disk cache of parsed log dataframes (e.g., from read_log_file()), shared across runs and modes.
+
+    An entry is keyed by the path, size, and mtime of its log file(s) and by the parameters of parsing them
+    (e.g., log_format and log_split_keyword), so that a new or changed log file is never served from the cache.
+    Entries are pickled dataframes, which keep the dtypes as they are and load much faster than parsing.
+    Once the total size of the entries exceeds max_size bytes, the least recently used ones are evicted.
+    Entries are written atomically, so that several processes (e.g., `-ps`) can share the same cache_dir.
+    """
+
+    def __init__(self, cache_dir: str, max_size: int = PARSE_CACHE_SIZE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, file_paths: list, **params):
+        """
+        Return the key of the given log files parsed with the given parameters (e.g., log_format).
+        """
+        signatures = []
+        for file_path in file_paths:
+            stat = os.stat(file_path)
+            signatures.append([os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns])
+        return hashlib.sha1(json.dumps([PARSE_CACHE_VERSION, signatures, sorted(params.items())]).encode()).hexdigest()
+
+    def get(self, key: str):
+        """
+        Return the cached dataframe of the given key, or None if there is none.
+        """
+        entry = self._get_entry_file(key)
+        try:
+            df = pd.read_pickle(entry)
+            os.utime(entry)  # recently used
+        except (FileNotFoundError, EOFError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        logger.debug(f'ParsedLogCache: hit {entry}')
+        return df
+
+    def put(self, key: str, df: pd.DataFrame):
+        """
+        Cache the given dataframe (as it is now) with the given key, and evict old entries if needed.
+        """
+        entry = self._get_entry_file(key)
+        tmp_file = f'{entry}.{os.getpid()}.tmp'
+        df.to_pickle(tmp_file, protocol=5)
+        os.replace(tmp_file, entry)
+        logger.debug(f'ParsedLogCache: put {entry}')
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until their total size is at most max_size.
+        """
+        entries = []
+        for file in os.listdir(self.cache_dir):
+            if file.endswith('.pkl'):
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, file))
+                except FileNotFoundError:
+                    continue  # evicted by another process
+                entries.append((stat.st_mtime, stat.st_size, file))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, file in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, file))
+            except FileNotFoundError:
+                pass
+            total_size -= size
+            logger.debug(f'ParsedLogCache: evicted {file}')
+
+    def _get_entry_file(self, key: str):
+        return os.path.join(self.cache_dir, f'{key}.pkl')
@@ -0,0 +1,71 @@
+import pandas as pd
+from src.log_format import generate_pattern_from_log_format, compile_log_pattern
+from src.template_matcher import TemplateIndex, MatchCache, MATCH_CACHE_SIZE
+from src.log_preprocess import load_templates_df
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class LogStructurer:
+    """
+    Structure batches of log lines in memory, e.g., for a service calling LogPrep as a library.
+
+    The log format and the templates of a system (an entry of `settings` in config.py) are compiled once, when the
+    structurer is created, and never changed afterwards; structure() only reads them and has no disk I/O, so that
+    a single structurer can be shared by several threads. Template matching is cached (see MatchCache) per
+    structurer, not in the module-global cache of src.log_preprocess. Errors are raised, not exited.
+    """
+
+    def __init__(self, system_settings: dict, system: str = None, templates_df: pd.DataFrame = None,
+                 match_cache_size: int = MATCH_CACHE_SIZE):
+        """
+        :param system_settings: settings of the system, i.e., `log_format` and (optionally) `template_dir`
+        :param system: system name, to read `{system}_templates.csv` in template_dir (None: no templates file)
+        :param templates_df: templates (pandas.DataFrame indexed by tid) instead of the templates file
+        :param match_cache_size: maximum number of distinct messages whose matching result is kept
+        """
+        log_format = system_settings.get('log_format')
+        if not log_format:
+            raise ValueError(f'No log_format for unstructured logs in the settings of {system}')
+        self.header, pattern = generate_pattern_from_log_format(log_format)
+        if 'message' not in self.header:
+            raise ValueError(f'<message> is not in log_format={log_format}')
+        self._parser = compile_log_pattern(self.header, pattern)
+        self._message_index = self.header.index('message')
+
+        if templates_df is None and system is not None and system_settings.get('template_dir'):
+            templates_df = load_templates_df(system=system, template_dir=system_settings['template_dir'])
+        self.template_index = None if templates_df is None else TemplateIndex(templates_df)
+        self.match_cache = MatchCache(maxsize=match_cache_size, thread_safe=True)
+        self.columns = ['lineID'] + self.header
+        if self.template_index is not None:
+            self.columns += ['tid', 'template', 'values']
+        logger.info(f'LogStructurer: {system}, {0 if templates_df is None else len(templates_df)} templates')
+
+    def structure(self, lines, as_records: bool = False):
+        """
+        Parse the given log lines with the log format and, if there are templates, match their messages.
+        The lines not matching the log format are skipped, while the messages not matching any template are kept
+        with `__NOT_MATCHING__` as their template.
+
+        :param lines: log lines (e.g., a list of str, with or without new lines)
+        :param as_records: whether to return a list of dicts instead of a dataframe
+        :return: structured log (pandas.DataFrame, or a list of dicts), whose lineID is the (1-based) position of
+                 each line in lines, followed by the fields of the log format, and `tid`, `template`, and `values`
+        """
+        rows = []
+        for line_id, line in enumerate(lines, start=1):
+            log_line = self._parser.parse(line.strip())
+            if log_line is not None:
+                # strip unnecessary white spaces in messages
+                log_line[self._message_index] = log_line[self._message_index].strip()
+                rows.append([line_id] + log_line)
+
+        if self.template_index is not None:
+            for row in rows:
+                row.extend(self.match_cache.match(self.template_index, row[self._message_index + 1]))
+
+        if as_records:
+            return [dict(zip(self.columns, row)) for row in rows]
+        return pd.DataFrame(rows, columns=self.columns)
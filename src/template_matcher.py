@@ -0,0 +1,282 @@
+import re
+import math
+import hashlib
+import threading
+import pandas as pd
+from collections import OrderedDict
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+
+import logging
+logger = logging.getLogger(__name__)
+
+NOT_MATCHING = ('-', '__NOT_MATCHING__', '-')
+MATCH_CACHE_SIZE = 1000000
+MATCH_CHUNK_SIZE = 10000
+
+# whitespace characters escaped by `re.escape()` and therefore turned into `\s+` by generate_pattern_from_template()
+_ESCAPED_SPACES = ' \t\n\r\v\f'
+_TOKEN_DELIMITER = re.compile(r'[ \t\n\r\v\f]+')
+_WILDCARD = re.compile(r'<\*>|<[A-Z]{1,3}>')
+
+
+def generate_pattern_from_template(template: str):
+    escaped = re.escape(template)
+    spaced_escape = re.sub(r'\\\s+', "\\\s+", escaped)
+    spaced_escape = re.sub(r'<[A-Z]{1,3}>', r'<\*>', spaced_escape)  # substitue <NUM> or <ID> into <*>
+    return "^" + spaced_escape.replace(r"<\*>", r"(.*?)") + "$"  # a single <*> can consume multiple tokens
+
+
+class TemplateIndex:
+    """
+    Precompiled templates grouped like the first levels of Drain's parse tree, so that a message is only tested
+    against the few templates that can possibly match it.
+
+    Templates are split into whitespace-delimited tokens and put into one of the following groups:
+    - exact: no wildcard at all; keyed by the full token sequence (hence by token count as well)
+    - leading: the first token is a literal; keyed by that token, which must also be the first token of the message
+    - anchored: the first token has a wildcard; keyed by the longest literal token, which must appear in the message
+    - others: no usable literal token; always tested
+    A template with a wildcard also records the minimum number of message tokens it needs (one per token having at
+    least one literal character), since a `<*>` may consume zero or more tokens.
+
+    The candidates are verified with the original regex in the same order as a linear scan over all templates
+    sorted by regex length (longest first), so the results are identical to the linear scan.
+    """
+
+    def __init__(self, templates_df: pd.DataFrame = None):
+        self.size = 0
+        self.fingerprint = ''
+        self.templates = []
+        self._exact = {}
+        self._leading = {}
+        self._anchored = {}
+        self._others = []
+        if templates_df is not None:
+            self.build(templates_df)
+
+    def build(self, templates_df: pd.DataFrame):
+        """
+        (Re)build the index from templates_df (index: tid, column: template).
+
+        :param templates_df: templates (pandas.DataFrame), e.g., from read_templates_into_df()
+        """
+        self._exact.clear()
+        self._leading.clear()
+        self._anchored.clear()
+        self._others = []
+
+        # the same regex may come from different templates; the last one wins as in a dict keyed by regex
+        patterns = {}
+        for tid, template in zip(templates_df.index, templates_df['template']):
+            patterns[generate_pattern_from_template(template)] = (tid, template)
+        self.size = len(patterns)
+        self.templates = list(patterns.values())
+        self.fingerprint = hashlib.sha1(repr(
+            [(r, str(tid), template) for r, (tid, template) in patterns.items()]).encode()).hexdigest()
+
+        for rank, r in enumerate(sorted(patterns.keys(), key=lambda x: len(x), reverse=True)):
+            tid, template = patterns[r]
+            entry = (rank, re.compile(r), tid, template, '<*>' in template)
+            self._add(entry, template)
+
+        logger.info(f'TemplateIndex: {self.size} templates '
+                    f'(exact={sum(len(v) for v in self._exact.values())}, '
+                    f'leading={sum(len(v) for v in self._leading.values())}, '
+                    f'anchored={sum(len(v) for v in self._anchored.values())}, '
+                    f'others={len(self._others)})')
+        return self
+
+    def _add(self, entry: tuple, template: str):
+        tokens = _TOKEN_DELIMITER.split(template)
+        if '' in tokens or any(c.isspace() and c not in _ESCAPED_SPACES for c in template):
+            # leading/trailing/unicode spaces do not tokenize like messages; keep them out of the index
+            self._others.append((0,) + entry)
+            return
+
+        literals = [t for t in tokens if not _WILDCARD.search(t)]
+        if len(literals) == len(tokens):
+            self._exact.setdefault(tuple(tokens), []).append(entry)
+            return
+
+        min_tokens = sum(1 for t in tokens if _WILDCARD.sub('', t) != '')
+        if len(tokens) > 1 and tokens[0] in literals:
+            self._leading.setdefault(tokens[0], []).append((min_tokens,) + entry)
+        elif len(literals) > 0:
+            anchor = max(literals, key=len)
+            self._anchored.setdefault(anchor, []).append((min_tokens,) + entry)
+        else:
+            self._others.append((min_tokens,) + entry)
+
+    def candidates(self, message: str):
+        """
+        Return the templates that can possibly match the given message, in precedence order.
+
+        :param message: a log message (only the message)
+        :return: a list of (rank, compiled_regex, tid, template, has_wildcard)
+        """
+        tokens = message.split()
+        num_tokens = len(tokens)
+
+        found = list(self._exact.get(tuple(tokens), []))
+        groups = [self._others]
+        if num_tokens > 0:
+            groups.append(self._leading.get(tokens[0], []))
+            for token in set(tokens):
+                if token in self._anchored:
+                    groups.append(self._anchored[token])
+        for group in groups:
+            for entry in group:
+                if entry[0] <= num_tokens:
+                    found.append(entry[1:])
+        found.sort(key=lambda x: x[0])
+        return found
+
+    def match(self, message: str):
+        """
+        Find the matching template of the given message.
+
+        :param message: a log message (only the message)
+        :return: (tid, template, parameter_list)
+        """
+        for _, r, tid, template, has_wildcard in self.candidates(message):
+            m = r.match(message)
+            if m:
+                if has_wildcard:
+                    return tid, template, list(m.groups())
+                else:
+                    return tid, template, []
+        logger.debug(f'No template: {message}')
+        return NOT_MATCHING
+
+
+class MatchCache:
+    """
+    Bounded LRU cache of message -> (tid, template, parameter_list).
+
+    Entries are keyed by the fingerprint of the TemplateIndex as well, so that a single cache can be kept for a whole
+    run (across files and systems) without returning a template of another template set.
+    A thread-safe cache can be shared by several threads; only its entries are locked, not the matching itself.
+    """
+
+    def __init__(self, maxsize: int = MATCH_CACHE_SIZE, thread_safe: bool = False):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock() if thread_safe else nullcontext()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def match(self, index: TemplateIndex, message: str):
+        """
+        Same as index.match(message), but reuses the result of a previous call for the same message.
+
+        :param index: template index to use in case of a miss
+        :param message: a log message (only the message)
+        :return: (tid, template, parameter_list)
+        """
+        key = (index.fingerprint, message)
+        result = self._get(key)
+        if result is None:
+            result = index.match(message)
+            with self._lock:
+                self.misses += 1
+            self._put(key, result)
+        return result
+
+    def match_all(self, index: TemplateIndex, messages: pd.Series, jobs: int = 1,
+                  executor: ProcessPoolExecutor = None):
+        """
+        Match every message in the given series, resolving each distinct message only once.
+
+        :param index: template index to use in case of a miss
+        :param messages: log messages (pandas.Series)
+        :param jobs: number of worker processes for the cache misses (1: no worker process)
+        :param executor: pool from create_match_pool() for the same index (None: a new pool per call if jobs > 1)
+        :return: three lists of the same length as messages: tids, templates, and parameter_lists
+        """
+        codes, uniques = pd.factorize(messages, use_na_sentinel=False)
+        if jobs > 1:
+            results = [self._get((index.fingerprint, message)) for message in uniques]
+            missing = [i for i, result in enumerate(results) if result is None]
+            with self._lock:
+                self.misses += len(missing)
+            matched = match_in_parallel(index, [uniques[i] for i in missing], jobs=jobs, executor=executor)
+            for i, result in zip(missing, matched):
+                results[i] = result
+                self._put((index.fingerprint, uniques[i]), result)
+        else:
+            results = [self.match(index, message) for message in uniques]
+        logger.info(f'MatchCache: {len(messages)} messages, {len(uniques)} distinct, '
+                    f'hits={self.hits}, misses={self.misses}, size={len(self)}')
+        if len(results) == 0:
+            return [], [], []
+        tids, templates, values = zip(*results)
+        return [tids[c] for c in codes], [templates[c] for c in codes], [values[c] for c in codes]
+
+    def _get(self, key: tuple):
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self.hits += 1
+                self._entries.move_to_end(key)
+        return result
+
+    def _put(self, key: tuple, result: tuple):
+        if self.maxsize > 0:
+            with self._lock:
+                self._entries[key] = result
+                if len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+
+
+_worker_index = None
+
+
+def _init_match_worker(templates: list):
+    # compile the templates once per worker process, not per chunk
+    global _worker_index
+    _worker_index = TemplateIndex(pd.DataFrame(templates, columns=['tid', 'template']).set_index('tid'))
+
+
+def _match_chunk(messages: list):
+    return [_worker_index.match(message) for message in messages]
+
+
+def create_match_pool(index: TemplateIndex, jobs: int):
+    """
+    Create a pool of `jobs` processes, each of which compiles the templates of the given index once.
+    The pool can be reused by match_in_parallel() as long as the templates do not change (e.g., for every chunk).
+
+    :param index: template index whose templates are sent to the worker processes
+    :param jobs: number of worker processes
+    :return: concurrent.futures.ProcessPoolExecutor (to be shut down by the caller, e.g., with a `with` statement)
+    """
+    return ProcessPoolExecutor(max_workers=jobs, initializer=_init_match_worker, initargs=(index.templates,))
+
+
+def match_in_parallel(index: TemplateIndex, messages: list, jobs: int, chunk_size: int = MATCH_CHUNK_SIZE,
+                      executor: ProcessPoolExecutor = None):
+    """
+    Match the given messages in a pool of `jobs` processes, chunk by chunk.
+
+    :param index: template index whose templates are sent to the worker processes
+    :param messages: log messages (only the messages)
+    :param jobs: number of worker processes
+    :param chunk_size: maximum number of messages per chunk
+    :param executor: pool from create_match_pool() for the same index (None: a new pool just for this call)
+    :return: a list of (tid, template, parameter_list), in the same order as messages
+    """
+    if len(messages) == 0:
+        return []
+    chunk_size = max(1, min(chunk_size, math.ceil(len(messages) / jobs)))
+    chunks = [messages[i:i + chunk_size] for i in range(0, len(messages), chunk_size)]
+    logger.info(f'match_in_parallel: {len(messages)} messages in {len(chunks)} chunks, jobs={jobs}')
+
+    results = []
+    with create_match_pool(index, jobs) if executor is None else nullcontext(executor) as pool:
+        for chunk_results in pool.map(_match_chunk, chunks):  # keeps the order of chunks
+            results.extend(chunk_results)
+    return results
@@ -0,0 +1,316 @@
+import re
+import math
+import time
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from drain3 import TemplateMiner
+from src.template_matcher import generate_pattern_from_template, TemplateIndex, MatchCache
+
+import logging
+logger = logging.getLogger(__name__)
+
+MINING_CHUNK_SIZE = 10000
+SAMPLE_STRATA = ['logID', 'component', 'level']
+
+
+def add_log_messages(template_miner: TemplateMiner, messages: pd.Series, progress: dict):
+    """
+    Feed the given messages to template_miner and return their cluster ids.
+
+    A message is given to template_miner only if it has not been added since the last change of the clusters
+    (a new cluster or a new template); otherwise, adding it again would return the same cluster without any change,
+    so only the size of that cluster is updated. The clusters are therefore identical to the ones from adding every
+    message, while each distinct message is mined only once as long as the clusters are stable.
+
+    :param template_miner: Drain3 template miner
+    :param messages: log messages (pandas.Series)
+    :param progress: line_count, start_time, and batch_start_time to continue the periodic report across calls,
+                     and (optionally) mined_tids, i.e., message -> cluster id since the last change of the clusters
+    :return: a list of cluster ids
+    """
+    batch_size = 100000
+    mined_tids = progress.setdefault('mined_tids', {})
+    clusters = template_miner.drain.id_to_cluster
+    tids = []
+    for message in messages:
+        tid = mined_tids.get(message)
+        if tid is None:
+            result = template_miner.add_log_message(message)
+            tid = result['cluster_id']
+            if result['change_type'] != 'none':
+                mined_tids.clear()  # the other messages may go to the new/changed cluster
+            mined_tids[message] = tid
+        else:
+            clusters[tid].size += 1  # as add_log_message() does for an existing cluster
+        tids.append(tid)
+
+        progress['line_count'] += 1
+        line_count = progress['line_count']
+        if line_count % batch_size == 0:
+            time_took = time.time() - progress['batch_start_time']
+            rate = batch_size / time_took
+            print(f"Processing line: {line_count}, rate {rate:.1f} lines/sec, "
+                  f"{len(template_miner.drain.clusters)} clusters so far.")
+            progress['batch_start_time'] = time.time()
+    logger.info(f'add_log_messages: {len(messages)} messages, {len(mined_tids)} distinct since the last change')
+    return tids
+
+
+def mine_templates_in_parallel(messages: pd.Series, jobs: int, chunk_size: int = MINING_CHUNK_SIZE):
+    """
+    Same as add_log_messages() with a new TemplateMiner, but mines the messages in a pool of `jobs` processes.
+
+    Drain groups messages by their (masked) token count at the first level of its tree, so messages of different
+    token counts never meet in the same cluster. The messages are therefore partitioned by masked token count,
+    and each partition is mined by its own TemplateMiner. Since Drain numbers clusters in the order they are created,
+    i.e., in the order of the first message of each cluster, the clusters of all partitions are renumbered by the
+    position of their first message; both the cluster ids and the templates are then the same as serial mining.
+    Note that a single partition is mined by one process, so the speedup is bounded by the largest partition.
+
+    :param messages: log messages (pandas.Series)
+    :param jobs: number of worker processes
+    :param chunk_size: maximum number of distinct messages per chunk for masking
+    :return: a list of cluster ids (one per message) and a list of [cluster_id, template] (in the order of ids)
+    """
+    codes, uniques = pd.factorize(messages, use_na_sentinel=False)
+    uniques = list(uniques)
+    if len(uniques) == 0:
+        return [], []
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_mining_worker) as executor:
+        # masking is as costly as mining, so the token counts of the distinct messages are computed in parallel too
+        chunk_size = max(1, min(chunk_size, math.ceil(len(uniques) / jobs)))
+        chunks = [uniques[i:i + chunk_size] for i in range(0, len(uniques), chunk_size)]
+        token_counts = np.concatenate(list(executor.map(_count_tokens, chunks)))
+        row_token_counts = token_counts[codes]
+
+        # one shard per token count (largest first, not to wait for it at the end)
+        shards = []
+        for token_count in np.unique(token_counts):
+            rows = np.flatnonzero(row_token_counts == token_count)
+            shard_codes, shard_uniques = pd.factorize(codes[rows])
+            shards.append((rows, [uniques[c] for c in shard_uniques], shard_codes))
+        shards.sort(key=lambda shard: len(shard[0]), reverse=True)
+        logger.info(f'mine_templates_in_parallel: {len(messages)} messages ({len(uniques)} distinct) '
+                    f'in {len(shards)} shards, jobs={jobs}')
+
+        clusters = []  # (position of the first message, shard, local cluster id, template)
+        shard_tids = []
+        for i, ((rows, _, _), (tids, templates)) in enumerate(
+                zip(shards, executor.map(_mine_shard, [shard[1:] for shard in shards]))):
+            tids = np.asarray(tids)
+            local_ids, first_positions = np.unique(tids, return_index=True)
+            first_rows = dict(zip(local_ids.tolist(), rows[first_positions].tolist()))
+            clusters.extend((first_rows[local_id], i, local_id, template) for local_id, template in templates)
+            shard_tids.append(tids)
+
+    # renumber the clusters in the order they are created by serial mining
+    clusters.sort(key=lambda x: x[0])
+    global_ids = {(i, local_id): tid for tid, (_, i, local_id, _) in enumerate(clusters, start=1)}
+    row_tids = np.empty(len(messages), dtype=np.int64)
+    for i, ((rows, _, _), tids) in enumerate(zip(shards, shard_tids)):
+        local_ids = np.unique(tids)
+        mapping = np.array([global_ids[(i, local_id)] for local_id in local_ids.tolist()])
+        row_tids[rows] = mapping[np.searchsorted(local_ids, tids)]
+    return row_tids.tolist(), [[tid, template] for tid, (_, _, _, template) in enumerate(clusters, start=1)]
+
+
+def sample_logs_df(logs_df: pd.DataFrame, sample_size: int, strata: list = None, random_state: int = 1):
+    """
+    Draw a stratified sample of the rows of logs_df, e.g., per log file and per component and level.
+
+    Each stratum (a distinct combination of the strata columns in logs_df) gets a share of sample_size proportional
+    to its number of rows, but at least one row, so that the rare components and levels are in the sample as well;
+    the sample therefore has at most sample_size rows plus one per stratum. The rows of a stratum are drawn at random.
+
+    :param logs_df: logs (pandas.DataFrame)
+    :param sample_size: number of rows to draw (all rows if logs_df is not larger)
+    :param strata: columns to stratify by, if in logs_df (default: SAMPLE_STRATA)
+    :param random_state: seed of the random draws
+    :return: positions of the sampled rows (numpy.ndarray), in the order of logs_df
+    """
+    num_rows = len(logs_df)
+    if num_rows <= sample_size:
+        return np.arange(num_rows)
+    columns = [column for column in (SAMPLE_STRATA if strata is None else strata) if column in logs_df.columns]
+    if len(columns) == 0:
+        codes = np.zeros(num_rows, dtype=np.int64)
+    else:
+        codes = logs_df.groupby(columns, sort=False, dropna=False).ngroup().to_numpy()
+    sizes = np.bincount(codes)
+    quotas = np.maximum(1, sizes * sample_size // num_rows)
+
+    # rank the rows of each stratum in a random order, and keep the ones ranked within its quota
+    order = np.random.default_rng(random_state).permutation(num_rows)
+    by_stratum = order[np.argsort(codes[order], kind='stable')]
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    ranks = np.empty(num_rows, dtype=np.int64)
+    ranks[by_stratum] = np.arange(num_rows) - np.repeat(starts, sizes)
+    sample = np.flatnonzero(ranks < quotas[codes])
+    logger.info(f'sample_logs_df: {len(sample)} of {num_rows} rows from {len(sizes)} strata of {columns}')
+    return sample
+
+
+def mine_templates_from_sample(template_miner: TemplateMiner, logs_df: pd.DataFrame, sample_size: int,
+                               progress: dict, jobs: int = 1):
+    """
+    Same as add_log_messages() for the messages of logs_df, but only a stratified sample of them (see sample_logs_df())
+    is mined; the other messages are matched against the templates mined from the sample (see TemplateIndex), and
+    only the ones not matching any template are mined in a second pass, in their order in logs_df.
+
+    Most messages thus skip Drain3, at the cost of small differences from mining all of them: a `<*>` may match
+    several tokens (see generate_pattern_from_template()), while Drain3 never clusters messages of different token
+    counts together, and a template generalized in the second pass is not matched again. See compare_with_full_mining().
+
+    :param template_miner: Drain3 template miner
+    :param logs_df: logs (pandas.DataFrame) with `message`, and the columns to stratify by (see SAMPLE_STRATA)
+    :param sample_size: number of messages to mine in the first pass (see sample_logs_df())
+    :param progress: as in add_log_messages()
+    :param jobs: number of processes for matching (1: serial; see MatchCache.match_all())
+    :return: a list of cluster ids (one per message), and a dict of the number of lines and seconds of each pass
+    """
+    messages = logs_df['message']
+    tids = np.zeros(len(logs_df), dtype=np.int64)
+    start_time = time.time()
+    sample = sample_logs_df(logs_df, sample_size)
+    tids[sample] = add_log_messages(template_miner, messages.iloc[sample], progress)
+    num_sample_templates = len(template_miner.drain.clusters)
+    mining_time = time.time() - start_time
+
+    start_time = time.time()
+    rest = np.setdiff1d(np.arange(len(logs_df)), sample, assume_unique=True)
+    index = TemplateIndex(pd.DataFrame([[cluster.cluster_id, cluster.get_template()]
+                                        for cluster in template_miner.drain.clusters],
+                                       columns=['tid', 'template']).set_index('tid'))
+    matched_tids = pd.Series(MatchCache().match_all(index, messages.iloc[rest], jobs=jobs)[0], dtype=object)
+    matched = (matched_tids != '-').to_numpy()
+    tids[rest[matched]] = matched_tids[matched].astype(np.int64)
+    for tid, count in zip(*np.unique(tids[rest[matched]], return_counts=True)):
+        template_miner.drain.id_to_cluster[tid].size += count  # as add_log_message() does for an existing cluster
+    matching_time = time.time() - start_time
+
+    start_time = time.time()
+    fed_back = rest[~matched]
+    tids[fed_back] = add_log_messages(template_miner, messages.iloc[fed_back], progress)
+    feedback_time = time.time() - start_time
+
+    stats = {
+        'lines': len(logs_df),
+        'sample_lines': len(sample),
+        'matched_lines': int(matched.sum()),
+        'fed_back_lines': len(fed_back),
+        'sample_templates': num_sample_templates,
+        'templates': len(template_miner.drain.clusters),
+        'coverage': float(matched.sum() / len(rest)) if len(rest) > 0 else 1.0,
+        'mining_sec': round(mining_time + feedback_time, 3),
+        'matching_sec': round(matching_time, 3),
+    }
+    logger.info(f'mine_templates_from_sample: {stats}')
+    return tids.tolist(), stats
+
+
+def compare_with_full_mining(messages: pd.Series, tids: list, templates: list):
+    """
+    Mine all the given messages with a new TemplateMiner, and compare the result with the given one (e.g., from
+    mine_templates_from_sample()) as LogPAI's grouping accuracy does: a message is grouped correctly if the messages
+    of its cluster are exactly the ones of its cluster in the full mining.
+
+    :param messages: log messages (pandas.Series)
+    :param tids: cluster ids of the messages to compare
+    :param templates: a list of [cluster_id, template] of the clusters to compare
+    :return: a dict of the number of templates and seconds of the full mining, the grouping accuracy, and the ratios of
+             the messages and templates of the full mining with the same template in the given result
+    """
+    start_time = time.time()
+    template_miner = TemplateMiner()
+    progress = {'line_count': 0, 'start_time': start_time, 'batch_start_time': start_time}
+    full_tids = add_log_messages(template_miner, messages, progress)
+    mining_time = time.time() - start_time
+    full_templates = {cluster.cluster_id: cluster.get_template() for cluster in template_miner.drain.clusters}
+
+    pairs = pd.DataFrame({'tid': tids, 'full_tid': full_tids})
+    one_to_one = (pairs.groupby('tid')['full_tid'].transform('nunique') == 1) & \
+                 (pairs.groupby('full_tid')['tid'].transform('nunique') == 1)
+    template_by_tid = {tid: template for tid, template in templates}
+    same_template = pairs['tid'].map(template_by_tid) == pairs['full_tid'].map(full_templates)
+    found = set(template_by_tid.values())
+    return {
+        'full_templates': len(full_templates),
+        'full_mining_sec': round(mining_time, 3),
+        'grouping_accuracy': float(one_to_one.mean()) if len(pairs) > 0 else 1.0,
+        'template_accuracy': float(same_template.mean()) if len(pairs) > 0 else 1.0,
+        'template_recall': sum(template in found for template in full_templates.values()) / max(1, len(full_templates)),
+    }
+
+
+_worker_miner = None
+
+
+def _init_mining_worker():
+    # load the configuration (drain3.ini) and compile the masking instructions once per worker process
+    global _worker_miner
+    _worker_miner = TemplateMiner()
+
+
+def _count_tokens(messages: list):
+    drain, masker = _worker_miner.drain, _worker_miner.masker
+    return np.array([len(drain.get_content_as_tokens(masker.mask(message))) for message in messages], dtype=np.int64)
+
+
+def _mine_shard(shard: tuple):
+    uniques, codes = shard
+    template_miner = TemplateMiner()
+    progress = {'line_count': 0, 'start_time': time.time(), 'batch_start_time': time.time()}
+    tids = add_log_messages(template_miner, pd.Series(uniques, dtype=object).take(codes), progress)
+    return tids, [(cluster.cluster_id, cluster.get_template()) for cluster in template_miner.drain.clusters]
+
+
+class ParameterExtractor:
+    """
+    Extract the parameter values of messages from the (final) templates of their clusters, without matching them
+    against all the templates: each message is matched only against the pattern of its own cluster, compiled once per
+    cluster with generate_pattern_from_template() as for `-mlt`, and each distinct (cluster, message) is matched once
+    per call. Unlike TemplateIndex.match(), the values of masked tokens (e.g., `<NUM>`) are extracted as well,
+    since Drain3 masks parameters only.
+    """
+
+    def __init__(self, templates: list):
+        """
+        :param templates: a list of [cluster_id, template], e.g., from mine_templates_in_parallel()
+        """
+        self.templates = {tid: template for tid, template in templates}
+        self.num_not_matching = 0
+        self._patterns = {}
+
+    def extract(self, tids, messages):
+        """
+        Return the list of parameter values of each message ([] if the message does not match its template,
+        which happens only if the template has changed since the message was mined, e.g., in the incremental mode).
+
+        :param tids: cluster ids of the messages
+        :param messages: log messages
+        :return: a list of lists of parameter values
+        """
+        extracted = {}
+        values = []
+        for tid, message in zip(tids, messages):
+            key = (tid, message)
+            parameters = extracted.get(key)
+            if parameters is None:
+                parameters = extracted[key] = self._extract(tid, message)
+            values.append(parameters)
+        logger.info(f'ParameterExtractor: {len(values)} messages ({len(extracted)} distinct), '
+                    f'{self.num_not_matching} not matching their templates so far')
+        return values
+
+    def _extract(self, tid, message):
+        pattern = self._patterns.get(tid)
+        if pattern is None:
+            pattern = self._patterns[tid] = re.compile(generate_pattern_from_template(self.templates[tid]))
+        m = pattern.match(message)
+        if m is None:
+            self.num_not_matching += 1
+            logger.debug(f'No parameters: {message} (tid={tid}, template={self.templates[tid]})')
+            return []
+        return list(m.groups())
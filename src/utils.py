@@ -1,15 +1,19 @@
 import os
 from datetime import datetime
+from src.compression import strip_compression
 
 import logging
 logger = logging.getLogger(__name__)
+MEMORY_PER_LOG_BYTE = 10  # a structured log (pandas.DataFrame) takes about 10 times the size of its text
 
 
-def common_logger(name: str, level='DEBUG'):
+def common_logger(name: str, level='DEBUG', log_id: str = None):
+    # a log_id (from a previous call) makes, e.g., a worker process log into the same file
     if not os.path.exists('_logs'):
         os.makedirs(os.path.join('_logs'))
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    log_id = timestamp + f'_{os.getpid()}'
+    if log_id is None:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        log_id = timestamp + f'_{os.getpid()}'
     log_file = os.path.join('_logs', f'{name}_{log_id}.log')
     logging.basicConfig(filename=log_file,
                         format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
@@ -19,3 +23,36 @@ def common_logger(name: str, level='DEBUG'):
     elif level == 'INFO':
         lg.setLevel(logging.INFO)
     return lg, log_id
+
+
+def get_available_memory():
+    """
+    Return the memory (in bytes) available for new processes without swapping, or None if unknown.
+    """
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def estimate_memory_usage(log_dir: str, file_ext: str, chunk_size: int = None):
+    """
+    Estimate the peak memory usage (in bytes) of preprocessing the log files under log_dir, i.e., MEMORY_PER_LOG_BYTE
+    times their total size, or times the size of a chunk (chunk_size lines of 1 KB at most) if it is smaller.
+    Note that compressed log files are counted as they are, so their usage is underestimated.
+    """
+    size = 0
+    for root, dirs, files in os.walk(log_dir):
+        for file in files:
+            if strip_compression(file).endswith(file_ext):
+                size += os.path.getsize(os.path.join(root, file))
+    if chunk_size is not None:
+        size = min(size, chunk_size * 1024)
+    return size * MEMORY_PER_LOG_BYTE
@@ -0,0 +1,48 @@
+import os
+import tempfile
+import unittest
+from benchmarks.log_generator import generate_logs
+from benchmarks.run_benchmarks import check_regressions
+from src.log_preprocess import *
+from dataset.sample.setup import settings
+
+
+class TestBenchmarks(unittest.TestCase):
+    def test_generate_logs(self):
+        log_format = settings['HDFS']['log_format']
+        with tempfile.TemporaryDirectory() as log_dir:
+            log_files, templates_file = generate_logs(os.path.join(log_dir, 'a'), log_format, num_lines=1000,
+                                                      num_templates=10, num_files=3, session_length=100, seed=1)
+            generate_logs(os.path.join(log_dir, 'b'), log_format, num_lines=1000, num_templates=10, num_files=3,
+                          session_length=100, seed=1)
+            self.assertEqual(3, len(log_files))
+            for log_file in log_files + [templates_file]:
+                with open(log_file) as a, open(log_file.replace(os.path.join(log_dir, 'a'),
+                                                                os.path.join(log_dir, 'b'))) as b:
+                    self.assertEqual(a.read(), b.read())  # same seed, same logs
+
+            # every line is parsed and matches a template
+            logs_df = load_logs_into_df(log_format=log_format, log_files=get_log_files_under_dir(
+                os.path.join(log_dir, 'a')), file_ext='.log')
+            self.assertEqual(1000, len(logs_df))
+            template_index.build(read_templates_into_df(system='Synthetic', template_dir=os.path.join(log_dir, 'a')))
+            match_templates(logs_df)
+            self.assertEqual(0, (logs_df['template'] == '__NOT_MATCHING__').sum())
+            self.assertEqual(10, (logs_df['tid'] == 'E1').sum())  # a session every 100 lines
+
+    def test_check_regressions(self):
+        baseline = {'results': [{'stage': 'parsing', 'num_lines': 100, 'seconds': 1.0, 'lines_per_sec': 100.0,
+                                 'peak_rss_mb': 100.0},
+                                {'stage': 'discovery', 'num_lines': 100, 'seconds': 0.001,
+                                 'lines_per_sec': 100000.0, 'peak_rss_mb': 100.0}]}
+        results = {'results': [{'stage': 'parsing', 'num_lines': 100, 'seconds': 1.5, 'lines_per_sec': 66.7,
+                                'peak_rss_mb': 110.0},
+                               {'stage': 'discovery', 'num_lines': 100, 'seconds': 0.01, 'lines_per_sec': 10000.0,
+                                'peak_rss_mb': 130.0},
+                               {'stage': 'mining', 'num_lines': 100, 'seconds': 1.0, 'lines_per_sec': 100.0,
+                                'peak_rss_mb': 100.0}]}
+        regressions = check_regressions(results, baseline, tolerance=0.25)
+        self.assertEqual(2, len(regressions))
+        self.assertTrue(regressions[0].startswith('parsing (100 lines): 66.7 lines/sec'))
+        self.assertTrue(regressions[1].startswith('discovery (100 lines): peak RSS 130.0 MB'))
+        self.assertEqual([], check_regressions(results, baseline, tolerance=0.5))
@@ -0,0 +1,59 @@
+import os
+import gzip
+import tempfile
+import threading
+import unittest
+from src.compression import *
+
+
+class TestCompression(unittest.TestCase):
+    def test_open_log_file(self):
+        lines = [f'line {i} \xe9\n' for i in range(100000)]
+        with tempfile.TemporaryDirectory() as log_dir:
+            for ext, opener in COMPRESSION_OPENERS.items():
+                file_path = os.path.join(log_dir, f'test.log{ext}')
+                with opener(file_path, 'wt') as f:
+                    f.writelines(lines)
+                self.assertEqual(ext, get_compression(file_path))
+                self.assertEqual(os.path.join(log_dir, 'test.log'), strip_compression(file_path))
+                with open_log_file(file_path) as f:
+                    self.assertEqual(lines, f.readlines())
+                with open_log_file(file_path, 'rb') as f:
+                    self.assertEqual(''.join(lines).encode(), f.read())
+
+                # closed before the end, while the background thread is blocked on the full queue
+                reader = BackgroundReader(opener(file_path, 'rb'), block_size=10, queue_size=2)
+                self.assertEqual(b'line 0 ', reader.read(7))
+                reader.close()
+                self.assertFalse(reader._thread.is_alive())
+
+            self.assertIsNone(get_compression(os.path.join(log_dir, 'test.log')))
+
+    def test_error_in_background(self):
+        with tempfile.TemporaryDirectory() as log_dir:
+            file_path = os.path.join(log_dir, 'test.log.gz')
+            with open(file_path, 'wb') as f:
+                f.write(b'not gzip')
+            with open_log_file(file_path) as f:
+                with self.assertRaises(gzip.BadGzipFile):
+                    f.read()
+
+    def test_close_prefetcher_before_the_end(self):
+        data = os.urandom(1024 * 1024)  # not compressible, to be read in many blocks
+        with tempfile.TemporaryDirectory() as log_dir:
+            file_paths = [os.path.join(log_dir, 'test.log.gz'), os.path.join(log_dir, 'test.log')]
+            with gzip.open(file_paths[0], 'wb') as f:
+                f.write(data)
+            with open(file_paths[1], 'wb') as f:
+                f.write(data)
+
+            for i, file_path in enumerate(file_paths):
+                prefetcher = FilePrefetcher(file_paths[i:], block_size=1024, queue_size=2)
+                f = prefetcher.open_next('rb')
+                self.assertEqual(data[:100], f.read(100))
+                # closed in a thread, not to hang the test if it deadlocks
+                closing = threading.Thread(target=lambda: (prefetcher.close(), f.close()), daemon=True)
+                closing.start()
+                closing.join(timeout=5)
+                self.assertFalse(closing.is_alive())
+                self.assertFalse(prefetcher._thread.is_alive())
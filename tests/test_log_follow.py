@@ -0,0 +1,118 @@
+import os
+import time
+import tempfile
+import threading
+import unittest
+import pandas as pd
+from drain3 import TemplateMiner
+from src.log_follow import *
+from src.log_preprocess import read_log_lines
+from src.template_mining import add_log_messages
+
+LOG_FORMAT = '<date> <time> <process> <level> <component>: <message>'
+MAX_LATENCY = 2.0  # seconds, generous for a loaded machine (the poll interval is 0.1 seconds)
+
+
+class LogAppender:
+    """
+    Append lines to the log files under log_dir as a running service (and logrotate) would, and measure how long
+    it takes for them to be in the structured log file written by follow_logs().
+    """
+
+    def __init__(self, log_dir: str, structured_log_file: str):
+        self.log_dir = log_dir
+        self.structured_log_file = structured_log_file
+        self.num_lines = 0
+        self.latencies = []
+
+    def append(self, file: str, lines: list):
+        with open(os.path.join(self.log_dir, file), 'a') as f:
+            f.writelines(lines)
+        self.num_lines += len(lines)
+        start_time = time.monotonic()
+        while self._count_structured_lines() < self.num_lines:
+            if time.monotonic() - start_time > 10 * MAX_LATENCY:
+                raise TimeoutError(f'{self.num_lines - self._count_structured_lines()} lines not followed')
+            time.sleep(0.01)
+        self.latencies.append(time.monotonic() - start_time)
+
+    def _count_structured_lines(self):
+        if not os.path.exists(self.structured_log_file):
+            return 0
+        with open(self.structured_log_file, 'rb') as f:
+            return max(0, f.read().count(b'\n') - 1)  # without the header
+
+
+class TestLogFollow(unittest.TestCase):
+    def setUp(self):
+        with open(os.path.join('dataset', 'sample', 'HDFS', 'HDFS_2k.log'), 'r') as f:
+            self.lines = f.readlines()
+
+    def follow(self, log_dir: str, output_dir: str, mode: str):
+        stop_event = threading.Event()
+        thread = threading.Thread(target=follow_logs, kwargs=dict(
+            system='HDFS', log_dir=log_dir, file_ext='.log', log_format=LOG_FORMAT, output_dir=output_dir, mode=mode,
+            poll_interval=0.1, rescan_interval=0.2, stop_event=stop_event))
+        thread.start()
+        return stop_event, thread
+
+    def test_follow_rotated_logs(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            log_dir, output_dir = os.path.join(work_dir, 'logs'), os.path.join(work_dir, 'output')
+            os.makedirs(log_dir)
+            stop_event, thread = self.follow(log_dir, output_dir, mode='convert')
+            appender = LogAppender(log_dir, os.path.join(output_dir, 'HDFS.csv'))
+            try:
+                for i in range(0, 500, 50):
+                    appender.append('HDFS.log', self.lines[i:i + 50])
+                # rotated by renaming, with a few lines written just before the rename
+                with open(os.path.join(log_dir, 'HDFS.log'), 'a') as f:
+                    f.writelines(self.lines[500:510])
+                os.rename(os.path.join(log_dir, 'HDFS.log'), os.path.join(log_dir, 'HDFS.log.1'))
+                appender.num_lines += 10
+                appender.append('HDFS.log', self.lines[510:1000])
+                # rotated by copying and truncating in place
+                os.truncate(os.path.join(log_dir, 'HDFS.log'), 0)
+                time.sleep(0.5)  # polled before growing back to where it was read up to (as tail -F requires)
+                appender.append('HDFS.log', self.lines[1000:1500])
+                # a new file, without a new line at the end (written when stopped)
+                appender.append('HDFS-2.log', self.lines[1500:2000])
+                with open(os.path.join(log_dir, 'HDFS-2.log'), 'a') as f:
+                    f.write('081111 000000 1 INFO dfs.DataNode: last line')
+            finally:
+                stop_event.set()
+                thread.join()
+
+            self.assertLess(max(appender.latencies), MAX_LATENCY)
+            logs_df = pd.read_csv(os.path.join(output_dir, 'HDFS.csv'), dtype=str, keep_default_na=False)
+            header, pattern = generate_pattern_from_log_format(LOG_FORMAT)
+            with tempfile.NamedTemporaryFile('w', suffix='.log') as f:
+                f.writelines(self.lines)
+                f.flush()
+                expected = [[value.strip() for value in line] for line in read_log_lines(f.name, header, pattern)]
+            expected.append(['081111', '000000', '1', 'INFO', 'dfs.DataNode', 'last line'])
+            self.assertEqual(expected, logs_df[header].values.tolist())
+            self.assertEqual(['1'] * 510 + ['2'] * 990 + ['3'] * 501, logs_df['logID'].tolist())
+            self.assertEqual([str(i + 1) for i in range(990)], logs_df['lineID'][510:1500].tolist())
+
+    def test_follow_mining(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            log_dir, output_dir = os.path.join(work_dir, 'logs'), os.path.join(work_dir, 'output')
+            os.makedirs(log_dir)
+            stop_event, thread = self.follow(log_dir, output_dir, mode='mining')
+            appender = LogAppender(log_dir, os.path.join(output_dir, 'HDFS_structured_logs_drain3.csv'))
+            try:
+                for i in range(0, 2000, 200):
+                    appender.append('HDFS.log', self.lines[i:i + 200])
+            finally:
+                stop_event.set()
+                thread.join()
+
+            self.assertLess(max(appender.latencies), MAX_LATENCY)
+            logs_df = pd.read_csv(os.path.join(output_dir, 'HDFS_structured_logs_drain3.csv'))
+            template_miner = TemplateMiner()
+            progress = {'line_count': 0, 'start_time': time.time(), 'batch_start_time': time.time()}
+            self.assertEqual(add_log_messages(template_miner, logs_df['message'], progress), logs_df['tid'].tolist())
+            templates_df = pd.read_csv(os.path.join(output_dir, 'HDFS_templates_drain3.csv'))
+            self.assertEqual([[c.cluster_id, c.get_template()] for c in template_miner.drain.clusters],
+                             templates_df.values.tolist())
@@ -0,0 +1,51 @@
+import os
+import re
+import random
+import unittest
+from src.log_format import *
+from dataset.sample.setup import settings
+
+
+# log formats of the dataset, plus some of the ones commonly used for LogHub logs
+# (only the ones for which the reference regex does not backtrack for minutes on HDFS lines)
+LOG_FORMATS = [settings[system]['log_format'] for system in settings if settings[system]['log_format']] + [
+    '<Date> <Time> <Pid> <Level> <Component>: <Content>',
+    '<Date> <Time> - <Level>  \\[<Node>:<Component>@<Id>\\] - <Content>',
+    '<Date> <Time> <Level> \\[<Process>\\] <Component>: <Content>',
+    '<Date> <Time> <Level> <Component>: <Content>',
+    '<Label> <Timestamp> <Date> <Node> <Time> <NodeRepeat> <Type> <Component> <Level> <Content>',
+    '<Logrecord> <Node> <Component> <State> <Time> <Flag> <Content>',
+    '\\[<Time>\\] <Program> - <Content>',
+    '<node>:<port> <level_ext> <message>',
+]
+
+
+class TestLogFormat(unittest.TestCase):
+    def assert_same_as_regex(self, log_format: str, lines: list):
+        header, pattern = generate_pattern_from_log_format(log_format)
+        parser = LogLineParser(header, pattern)
+        for line in lines:
+            m = re.match(pattern, line)
+            self.assertEqual([m.group(h) for h in header] if m else None, parser.parse(line),
+                             f'log_format={log_format}, line={line}')
+
+    def test_strategy(self):
+        self.assertEqual('split', compile_log_pattern(*generate_pattern_from_log_format(
+            '<date> <time> <process> <level> <component>: <message>')).strategy)
+        self.assertEqual('regex', compile_log_pattern(*generate_pattern_from_log_format(
+            '<node>:<port> <level_ext> <message>')).strategy)
+        self.assertEqual('regex', compile_log_pattern(*generate_pattern_from_log_format(
+            '<date>.<time> <message>')).strategy)
+
+    def test_same_as_regex_on_hdfs(self):
+        with open(os.path.join('dataset', 'sample', 'HDFS', 'HDFS_2k.log'), 'r') as f:
+            lines = [line.strip() for line in f]
+        for log_format in LOG_FORMATS:
+            self.assert_same_as_regex(log_format, lines)
+
+    def test_same_as_regex_on_random_lines(self):
+        rand = random.Random(1)
+        chars = ['a', 'b', '1', ':', '::', '-', '[', ']', '@', '.', ' ', '  ', '\t', '\xa0', '\n']
+        lines = [''.join(rand.choice(chars) for _ in range(rand.randint(0, 30))).strip() for _ in range(5000)]
+        for log_format in LOG_FORMATS:
+            self.assert_same_as_regex(log_format, lines)
@@ -0,0 +1,48 @@
+import os
+import argparse
+import tempfile
+import unittest
+import pandas as pd
+import LogPrep
+from src.metrics import metrics
+
+
+class TestLogPrep(unittest.TestCase):
+    def test_run_systems_in_parallel(self):
+        sample_dir = os.path.abspath(os.path.join('dataset', 'sample'))
+        systems = {
+            'HDFS': dict(LogPrep.settings['HDFS'], log_dir=os.path.join(sample_dir, 'HDFS')),
+            'Missing': dict(LogPrep.settings['HDFS'], log_dir=os.path.join(sample_dir, 'Missing')),
+            'Apache': dict(LogPrep.settings['Apache'], log_dir=os.path.join(sample_dir, 'Apache')),
+        }
+        args = argparse.Namespace(identify_templates=False, merge_logs_and_templates=False, drop_message=False,
+                                  jobs=1, chunk_size=None, parse_engine='line', incremental=False,
+                                  output_format='csv', virtual_split=False, parallel_systems=2, parse_cache=None,
+                                  follow=False, pipeline=False, sample_mining=None,
+                                  sample_mining_compare=False)
+        cwd = os.getcwd()
+        original_settings = dict(LogPrep.settings)
+        with tempfile.TemporaryDirectory() as work_dir:
+            os.chdir(work_dir)
+            LogPrep.settings.update(systems)
+            try:
+                metrics.start(os.path.join(work_dir, 'metrics.jsonl'))
+                summary, failures = LogPrep.run_systems_in_parallel(list(systems), args, log_id='test')
+                metrics.finish()
+            finally:
+                LogPrep.settings.clear()
+                LogPrep.settings.update(original_settings)
+                os.chdir(cwd)
+
+            # in the order of systems, whatever the order they end in
+            self.assertEqual([['HDFS', 2000], ['Apache', 2000]], summary)
+            self.assertEqual([('Missing', 'exited with code 0')], failures)  # no log files
+            self.assertEqual(2000, len(pd.read_csv(os.path.join(work_dir, 'output', 'HDFS', 'HDFS.csv'))))
+            with open(os.path.join(work_dir, 'metrics.jsonl')) as f:
+                self.assertEqual(3, sum('"stage": "total"' in line for line in f))
+
+    def test_positive_int(self):
+        self.assertEqual(2, LogPrep.positive_int('2'))
+        for value in ['0', '-1', 'x']:
+            with self.assertRaises((argparse.ArgumentTypeError, ValueError)):
+                LogPrep.positive_int(value)
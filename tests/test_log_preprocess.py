@@ -1,6 +1,10 @@
+import gzip
 import unittest
 import tempfile
 from src.log_preprocess import *
+from src.template_matcher import match_in_parallel, create_match_pool
+from src.template_mining import sample_logs_df
+from src.compression import COMPRESSION_OPENERS, FilePrefetcher
 
 
 class TestLogPreprocess(unittest.TestCase):
@@ -20,4 +24,356 @@ class TestLogPreprocess(unittest.TestCase):
             with open(os.path.join(output_dir, f'{system}_2.log'), 'r') as f:
                 self.assertEqual(['restart\n', 'event3 port\n', 'event4 port\n', 'event5 port'], f.readlines())
 
+    def test_virtual_split(self):
+        log_format = '<component> <message>'
+        with tempfile.TemporaryDirectory() as log_dir:
+            with open(os.path.join(log_dir, 'test_1.log'), 'w') as f:
+                f.write('event0 port\nrestart\nevent1 port\nevent2')  # no new line at the end
+            with open(os.path.join(log_dir, 'test_2.log'), 'w') as f:
+                f.write(' port\nrestart\nevent3 port\n')
+            with open(os.path.join(log_dir, 'test_3.log'), 'w') as f:
+                f.write('restart\nevent4 port\nno_message\nevent5 port\n')
+
+            # the `split` directory of split_log() is ignored
+            expected = get_logs_df('test_system', log_dir, '.log', log_format, log_split_keyword='restart')
+            self.assertTrue(os.path.isdir(os.path.join(log_dir, 'split')))
+            actual = get_logs_df('test_system', log_dir, '.log', log_format, log_split_keyword='restart',
+                                 virtual_split=True)
+            pd.testing.assert_frame_equal(expected, actual)
+            self.assertEqual([1, 2, 2, 3, 4, 4], list(actual['logID']))
+            self.assertEqual(['event2', 'port'], [actual['component'][2], actual['message'][2]])  # joined lines
+
+            expected = list(iter_logs_df('test_system', log_dir, '.log', log_format, log_split_keyword='restart',
+                                         chunk_size=4))
+            actual = list(iter_logs_df('test_system', log_dir, '.log', log_format, log_split_keyword='restart',
+                                       chunk_size=4, virtual_split=True))
+            self.assertEqual(len(expected), len(actual))
+            for expected_df, actual_df in zip(expected, actual):
+                pd.testing.assert_frame_equal(expected_df, actual_df)
+
+    def test_template_index(self):
+        templates_df = pd.DataFrame({'template': ['Receiving block <*>', 'Receiving block blk_<*> src: <*>',
+                                                  '<*>:<*> Served block <*>', 'Verification succeeded']},
+                                    index=pd.Index(['E1', 'E2', 'E3', 'E4'], name='tid'))
+        template_index.build(templates_df)
+
+        # the longest regex wins as before
+        self.assertEqual(('E2', 'Receiving block blk_<*> src: <*>', ['1', '/10.0.0.1:50010']),
+                         find_matching_template('Receiving block blk_1 src: /10.0.0.1:50010'))
+        self.assertEqual(('E1', 'Receiving block <*>', ['blk_2']), find_matching_template('Receiving block blk_2'))
+        self.assertEqual(('E3', '<*>:<*> Served block <*>', ['10.0.0.1', '50010', 'blk_3']),
+                         find_matching_template('10.0.0.1:50010 Served block blk_3'))
+        self.assertEqual(('E4', 'Verification succeeded', []), find_matching_template('Verification  succeeded'))
+        self.assertEqual(('-', '__NOT_MATCHING__', '-'), find_matching_template('Verification failed'))
+
+    def test_match_cache(self):
+        index = TemplateIndex(pd.DataFrame({'template': ['Receiving block <*>', 'Deleting block <*>']},
+                                           index=pd.Index(['E1', 'E2'], name='tid')))
+        cache = MatchCache(maxsize=2)
+        messages = pd.Series(['Receiving block blk_1', 'Receiving block blk_1', 'Deleting block blk_1', 'x'])
+
+        tids, templates, values = cache.match_all(index, messages)
+        self.assertEqual(['E1', 'E1', 'E2', '-'], tids)
+        self.assertEqual([['blk_1'], ['blk_1'], ['blk_1'], '-'], values)
+        self.assertEqual((0, 3, 2), (cache.hits, cache.misses, len(cache)))
+
+        # the least recently used entry has been evicted
+        cache.match_all(index, pd.Series(['x', 'Receiving block blk_1']))
+        self.assertEqual((1, 4), (cache.hits, cache.misses))
+
+    def test_match_in_parallel(self):
+        index = TemplateIndex(pd.DataFrame({'template': ['Receiving block <*>', 'Deleting block <*>']},
+                                           index=pd.Index(['E1', 'E2'], name='tid')))
+        messages = [f'{action} block blk_{i}' for i in range(50) for action in ['Receiving', 'Deleting', 'Moving']]
+        self.assertEqual([index.match(m) for m in messages],
+                         match_in_parallel(index, messages, jobs=2, chunk_size=7))
+
+        # the same pool for several calls (e.g., chunks in the streaming mode)
+        with create_match_pool(index, jobs=2) as executor:
+            for i in range(0, len(messages), 40):
+                self.assertEqual([index.match(m) for m in messages[i:i + 40]],
+                                 match_in_parallel(index, messages[i:i + 40], jobs=2, executor=executor))
+
+    def test_parameter_extractor(self):
+        extractor = ParameterExtractor([[1, 'send <*> to <IP>:<NUM>'], [2, 'done'], [3, 'got <*> bytes']])
+        tids = [1, 2, 1, 3, 1]
+        messages = ['send a to 10.0.0.1:80', 'done', 'send a to 10.0.0.1:80', 'lost 3 bytes', 'send  b c to 1.2.3.4:8']
+        values = extractor.extract(tids, messages)
+        self.assertEqual([['a', '10.0.0.1', '80'], [], ['a', '10.0.0.1', '80'], [], ['b c', '1.2.3.4', '8']], values)
+        self.assertIs(values[0], values[2])  # extracted once per distinct (cluster, message)
+        self.assertEqual(1, extractor.num_not_matching)
+
+    def test_add_log_messages(self):
+        # the last message goes to a cluster created after its first occurrence
+        messages = ['a b c d e f g', 'a b x y z f g', 'a b c d e q r', 'a b c d e f g'] * 3 + ['a b c d e q r']
+
+        per_message = TemplateMiner()
+        expected = [per_message.add_log_message(message)['cluster_id'] for message in messages]
+        progress = {'line_count': 0, 'start_time': time.time(), 'batch_start_time': time.time()}
+        template_miner = TemplateMiner()
+        tids = add_log_messages(template_miner, pd.Series(messages[:5]), progress)
+        tids += add_log_messages(template_miner, pd.Series(messages[5:]), progress)
+
+        self.assertEqual(expected, tids)
+        self.assertEqual(len(messages), progress['line_count'])
+        self.assertEqual([(c.cluster_id, c.get_template(), c.size) for c in per_message.drain.clusters],
+                         [(c.cluster_id, c.get_template(), c.size) for c in template_miner.drain.clusters])
+
+    def test_mine_templates_in_parallel(self):
+        # different token counts after masking (e.g., `<IP>`), and a cluster created after its first message's repeat
+        messages = ['a b c d e f g', 'a b x y z f g', 'a b c d e q r', 'a b c d e f g', 'from 10.0.0.1', 'from host a',
+                    'from 10.0.0.2', '', 'a b', 'a c', 'a b c d e q r']
+        template_miner = TemplateMiner()
+        expected = [template_miner.add_log_message(message)['cluster_id'] for message in messages]
+        tids, templates = mine_templates_in_parallel(pd.Series(messages), jobs=2, chunk_size=3)
+        self.assertEqual(expected, tids)
+        self.assertEqual([[c.cluster_id, c.get_template()] for c in template_miner.drain.clusters], templates)
+
+    def test_sample_mining(self):
+        logs_df = pd.DataFrame({'logID': [1] * 90 + [2] * 10, 'level': ['INFO'] * 99 + ['ERROR'],
+                                'message': [f'send {i} bytes' for i in range(90)] + ['a b x y z f g'] * 9 +
+                                           ['disk failed']})
+        sample = sample_logs_df(logs_df, sample_size=10)
+        self.assertEqual(list(sample), sorted(sample))
+        self.assertEqual([9, 2, 1], [sum(logs_df['logID'][sample] == 1), sum(logs_df['logID'][sample] == 2),
+                                     sum(logs_df['level'][sample] == 'ERROR')])  # the rare ones too
+
+        # unmatched messages are mined in a second pass
+        logs_df.loc[95, 'message'] = 'a b c d e f g'
+        progress = {'line_count': 0, 'start_time': time.time(), 'batch_start_time': time.time()}
+        template_miner = TemplateMiner()
+        tids, stats = mine_templates_from_sample(template_miner, logs_df, sample_size=10, progress=progress)
+        templates = [[c.cluster_id, c.get_template()] for c in template_miner.drain.clusters]
+        self.assertEqual((100, 11, 11 + stats['matched_lines'] + stats['fed_back_lines']),
+                         (len(tids), stats['sample_lines'], stats['lines']))
+        self.assertEqual(len(logs_df), sum(c.size for c in template_miner.drain.clusters))
+        self.assertEqual(1, stats['fed_back_lines'])
+        report = compare_with_full_mining(logs_df['message'], tids, templates)
+        self.assertEqual((1.0, 1.0, 1.0), (report['grouping_accuracy'], report['template_accuracy'],
+                                           report['template_recall']))
+        self.assertEqual(len(templates), report['full_templates'])
+
+    def test_incremental_mining(self):
+        log_format = '<date> <time> <process> <level> <component>: <message>'
+        with open(os.path.join('dataset', 'sample', 'HDFS', 'HDFS_2k.log'), 'r') as f:
+            lines = f.readlines()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            log_dir = os.path.join(tmp_dir, 'logs')
+            os.makedirs(log_dir)
+            for i in range(2):
+                with open(os.path.join(log_dir, f'test_{i}.log'), 'w') as f:
+                    f.writelines(lines[i * 1000:(i + 1) * 1000])
+            get_templates_using_drain3('test_system', log_dir, '.log', log_format, os.path.join(tmp_dir, 'full'))
+
+            # the second file arrives after the first incremental run
+            output_dir = os.path.join(tmp_dir, 'incremental')
+            shutil.move(os.path.join(log_dir, 'test_1.log'), tmp_dir)
+            get_templates_using_drain3('test_system', log_dir, '.log', log_format, output_dir, incremental=True)
+            shutil.move(os.path.join(tmp_dir, 'test_1.log'), log_dir)
+            for _ in range(2):  # nothing to mine in the second run
+                get_templates_using_drain3('test_system', log_dir, '.log', log_format, output_dir, incremental=True)
+
+            for file in ['test_system_templates_drain3.csv', 'test_system_structured_logs_drain3.csv']:
+                expected = pd.read_csv(os.path.join(tmp_dir, 'full', file))
+                actual = pd.read_csv(os.path.join(output_dir, file))
+                if file.endswith('structured_logs_drain3.csv'):
+                    # the templates (and values) of the first run may have been generalized by the second one
+                    expected = expected.drop(columns=['template', 'values'])
+                    actual = actual.drop(columns=['template', 'values'])
+                pd.testing.assert_frame_equal(expected, actual)
+
+    def test_incremental_mining_of_modified_files(self):
+        log_format = '<date> <time> <process> <level> <component>: <message>'
+        with open(os.path.join('dataset', 'sample', 'HDFS', 'HDFS_2k.log'), 'r') as f:
+            lines = f.readlines()
+        for chunk_size in [None, 300]:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                log_dir, output_dir = os.path.join(tmp_dir, 'logs'), os.path.join(tmp_dir, 'incremental')
+                os.makedirs(log_dir)
+                log_file = os.path.join(log_dir, 'test_0.log')
+                with open(log_file, 'w') as f:
+                    f.writelines(lines[:1000])
+                get_templates_using_drain3('test_system', log_dir, '.log', log_format, output_dir,
+                                           chunk_size=chunk_size, incremental=True)
+
+                # appended: only the new lines are mined, as the continuation of the same log
+                with open(log_file, 'a') as f:
+                    f.writelines(lines[1000:1500])
+                get_templates_using_drain3('test_system', log_dir, '.log', log_format, output_dir,
+                                           chunk_size=chunk_size, incremental=True)
+                get_templates_using_drain3('test_system', log_dir, '.log', log_format, os.path.join(tmp_dir, 'full'))
+                columns = ['logID', 'lineID', 'message', 'tid']
+                expected = pd.read_csv(os.path.join(tmp_dir, 'full', 'test_system_structured_logs_drain3.csv'))
+                actual = pd.read_csv(os.path.join(output_dir, 'test_system_structured_logs_drain3.csv'))
+                pd.testing.assert_frame_equal(expected[columns], actual[columns])
+                template_miner = IncrementalTemplateMiner(
+                    FilePersistence(os.path.join(output_dir, 'test_system_drain3_state.bin')))
+                self.assertEqual(1500, sum(cluster.size for cluster in template_miner.drain.clusters))
+
+                # rewritten: its previous rows are replaced
+                with open(log_file, 'w') as f:
+                    f.writelines(lines[1500:1510])
+                get_templates_using_drain3('test_system', log_dir, '.log', log_format, output_dir,
+                                           chunk_size=chunk_size, incremental=True)
+                actual = pd.read_csv(os.path.join(output_dir, 'test_system_structured_logs_drain3.csv'))
+                self.assertEqual([2] * 10, actual['logID'].tolist())
+                self.assertEqual(list(range(1, 11)), actual['lineID'].tolist())
+                template_miner = IncrementalTemplateMiner(
+                    FilePersistence(os.path.join(output_dir, 'test_system_drain3_state.bin')))
+                self.assertEqual(10, sum(cluster.size for cluster in template_miner.drain.clusters))
+
+    def test_iter_logs_from_files(self):
+        log_format = '<component> <message>'
+        with tempfile.TemporaryDirectory() as output_dir:
+            split_log(system='test_system', log_dir=os.path.join('tests', 'resources', 'single_log'),
+                      log_split_keyword='restart', output_dir=output_dir)
+            log_files = get_log_files_under_dir(log_dir=output_dir)
+
+            logs_df = load_logs_into_df(log_format=log_format, log_files=log_files, file_ext='.log')
+            chunks = list(iter_logs_from_files(log_format=log_format, log_files=log_files, file_ext='.log',
+                                               chunk_size=2))
+
+        self.assertEqual([2, 2, 1], [len(chunk) for chunk in chunks])  # `restart` lines have no message
+        pd.testing.assert_frame_equal(logs_df, pd.concat(chunks, ignore_index=True))
+        self.assertEqual([1, 1, 2, 2, 2], list(logs_df['logID']))
+        self.assertEqual([1, 2, 1, 2, 3], list(logs_df['lineID']))
+
+    def test_csv_schema(self):
+        csv_schema = {'code': 'str', 'level': 'category', 'message': 'str'}
+        with tempfile.TemporaryDirectory() as log_dir:
+            for i in range(2):
+                with open(os.path.join(log_dir, f'test_{i}.csv'), 'w') as f:
+                    # `code` would be inferred as int64 for the first chunk, but as object for the second one
+                    f.write('date,code,level,message\n2024-01-01,200,INFO, ok\n2024-01-01,200,INFO,ok\n'
+                            '2024-01-02,E1,ERROR,failed \n')
+            log_files = get_log_files_under_dir(log_dir=log_dir, file_ext='.csv')
+            logs_df = load_logs_into_df(log_format='', log_files=log_files, file_ext='.csv', csv_schema=csv_schema)
+            chunks = list(iter_logs_from_files(log_format='', log_files=log_files, file_ext='.csv', chunk_size=2,
+                                               csv_schema=csv_schema))
+            parallel_df = load_logs_into_df(log_format='', log_files=log_files, file_ext='.csv', jobs=2,
+                                            csv_schema=csv_schema)
+            with self.assertRaises(SystemExit):
+                load_logs_into_df(log_format='', log_files=log_files, file_ext='.csv', csv_schema={'level': 'str'})
+
+        self.assertEqual(['logID', 'lineID', 'code', 'level', 'message'], list(logs_df.columns))
+        self.assertEqual(['object', 'category', 'object'], [str(dtype) for dtype in logs_df.dtypes[2:]])
+        self.assertEqual([1, 1, 1, 2, 2, 2], list(logs_df['logID']))
+        self.assertEqual([1, 2, 3, 1, 2, 3], list(logs_df['lineID']))
+        self.assertEqual(['ok', 'ok', 'failed'] * 2, list(logs_df['message']))
+        self.assertTrue(all(chunk['code'].dtype == object for chunk in chunks))
+        pd.testing.assert_frame_equal(logs_df.astype({'level': str}),
+                                      pd.concat(chunks, ignore_index=True).astype({'level': str}))
+        pd.testing.assert_frame_equal(logs_df, parallel_df)
+
+    def test_csv_schema_values(self):
+        # declared columns are read as they are, whether the file is read at once or in chunks
+        csv_schema = {'code': 'str', 'amount': 'str', 'message': 'str'}
+        with tempfile.TemporaryDirectory() as log_dir:
+            with open(os.path.join(log_dir, 'test.csv'), 'w') as f:
+                f.write('code,amount,message\n007,1.50,a\n,,b\n010,2.0,\n')
+            log_files = get_log_files_under_dir(log_dir=log_dir, file_ext='.csv')
+            logs_df = load_logs_into_df(log_format='', log_files=log_files, file_ext='.csv', csv_schema=csv_schema)
+            chunks = list(iter_logs_from_files(log_format='', log_files=log_files, file_ext='.csv', chunk_size=2,
+                                               csv_schema=csv_schema))
+
+        pd.testing.assert_frame_equal(logs_df, pd.concat(chunks, ignore_index=True))
+        self.assertEqual(['007', '010'], logs_df['code'].dropna().tolist())
+        self.assertEqual(['1.50', '2.0'], logs_df['amount'].dropna().tolist())
+        self.assertEqual([False, True, False], logs_df['code'].isna().tolist())
+        self.assertEqual([False, False, True], logs_df['message'].isna().tolist())
+        self.assertFalse('engine' in get_read_csv_options(csv_schema))
+
+    def test_read_log_files_in_parallel(self):
+        header, pattern = generate_pattern_from_log_format('<date> <time> <process> <level> <component>: <message>')
+        log_files = get_log_files_under_dir(log_dir=os.path.join('dataset', 'sample', 'HDFS'))
+        serial = [read_log_file(os.path.join(path, file), file_ext='.log', header=header, pattern=pattern)
+                  for path, file in log_files]
+        parallel = read_log_files_in_parallel(log_files, file_ext='.log', header=header, pattern=pattern, jobs=2,
+                                              part_size=10000)  # about 30 parts for HDFS_2k.log
+        self.assertEqual(len(serial), len(parallel))
+        for serial_df, parallel_df in zip(serial, parallel):
+            pd.testing.assert_frame_equal(serial_df, parallel_df)
+
+        # streaming: parts are parsed ahead in a bounded window, in order
+        for path, file in log_files:
+            file_path = os.path.join(path, file)
+            with ProcessPoolExecutor(max_workers=2) as executor:
+                self.assertEqual(list(read_log_lines(file_path, header=header, pattern=pattern)),
+                                 list(iter_log_lines_in_parallel(executor, file_path, header=header, pattern=pattern,
+                                                                 jobs=2, part_size=10000)))
+
+    def test_compressed_logs(self):
+        header, pattern = generate_pattern_from_log_format('<date> <time> <process> <level> <component>: <message>')
+        hdfs_file = os.path.join('dataset', 'sample', 'HDFS', 'HDFS_2k.log')
+        apache_file = os.path.join('dataset', 'sample', 'Apache', 'Apache-sample.csv')
+        expected = list(read_log_lines(hdfs_file, header=header, pattern=pattern))
+        with tempfile.TemporaryDirectory() as log_dir:
+            for ext, opener in COMPRESSION_OPENERS.items():
+                with open(hdfs_file, 'rb') as f, opener(os.path.join(log_dir, f'HDFS_2k.log{ext}'), 'wb') as g:
+                    g.write(f.read())
+            with open(apache_file, 'rb') as f, gzip.open(os.path.join(log_dir, 'Apache-sample.csv.gz'), 'wb') as g:
+                g.write(f.read())
+
+            log_files = get_log_files_under_dir(log_dir=log_dir)
+            self.assertEqual(['HDFS_2k.log.bz2', 'HDFS_2k.log.gz', 'HDFS_2k.log.xz'], [file for _, file in log_files])
+            with ProcessPoolExecutor(max_workers=2) as executor:
+                for path, file in log_files:
+                    file_path = os.path.join(path, file)
+                    self.assertEqual(expected, list(read_log_lines(file_path, header=header, pattern=pattern,
+                                                                   engine='mmap')))
+                    self.assertEqual(expected, list(iter_log_lines_in_parallel(
+                        executor, file_path, header=header, pattern=pattern, jobs=2, part_size=10000)))
+            for log_df in read_log_files_in_parallel(log_files, file_ext='.log', header=header, pattern=pattern,
+                                                     jobs=2):
+                self.assertEqual(expected, log_df.values.tolist())
+
+            apache_files = get_log_files_under_dir(log_dir=log_dir, file_ext='.csv')
+            pd.testing.assert_frame_equal(pd.read_csv(apache_file),
+                                          read_log_file(os.path.join(*apache_files[0]), file_ext='.csv',
+                                                        header=header, pattern=pattern))
+            chunks = iter_logs_from_files(log_format='<message>', log_files=apache_files, file_ext='.csv',
+                                          chunk_size=100)
+            pd.testing.assert_frame_equal(
+                load_logs_into_df(log_format='<message>', log_files=[os.path.split(apache_file)], file_ext='.csv'),
+                pd.concat(chunks, ignore_index=True))
+
+    def test_pipeline(self):
+        log_format = '<date> <time> <process> <level> <component>: <message>'
+        hdfs_file = os.path.join('dataset', 'sample', 'HDFS', 'HDFS_2k.log')
+        apache_file = os.path.join('dataset', 'sample', 'Apache', 'Apache-sample.csv')
+        with tempfile.TemporaryDirectory() as log_dir:
+            for i, (ext, opener) in enumerate([('', open)] + list(COMPRESSION_OPENERS.items())):
+                with open(hdfs_file, 'rb') as f, opener(os.path.join(log_dir, f'HDFS_{i}.log{ext}'), 'wb') as g:
+                    g.write(f.read()[:100000 * (i + 1)])  # the last line of some files without a new line
+                with open(apache_file, 'rb') as f, opener(os.path.join(log_dir, f'Apache_{i}.csv{ext}'), 'wb') as g:
+                    g.write(f.read())
+
+            for file_ext, log_format in [('.log', log_format), ('.csv', '<message>')]:
+                log_files = get_log_files_under_dir(log_dir=log_dir, file_ext=file_ext)
+                expected = load_logs_into_df(log_format=log_format, log_files=log_files, file_ext=file_ext)
+                pd.testing.assert_frame_equal(expected, load_logs_into_df(
+                    log_format=log_format, log_files=log_files, file_ext=file_ext, pipeline=True))
+                chunks = iter_logs_from_files(log_format=log_format, log_files=log_files, file_ext=file_ext,
+                                              chunk_size=300, pipeline=True)
+                pd.testing.assert_frame_equal(expected, pd.concat(chunks, ignore_index=True), check_dtype=False)
+
+            # the next files are not waited for when a file is not read to its end
+            with FilePrefetcher([os.path.join(path, file) for path, file in log_files], block_size=100) as prefetcher:
+                with prefetcher.open_next('rb') as f:
+                    f.read(10)
+                pd.testing.assert_frame_equal(pd.read_csv(apache_file), pd.read_csv(prefetcher.open_next('rb')))
+
+    def test_read_log_lines_from_buffer(self):
+        with tempfile.TemporaryDirectory() as log_dir:
+            log_file = os.path.join(log_dir, 'test.log')
+            with open(log_file, 'w', newline='') as f:
+                f.write('  a1 :  message 1  \r\nno match\n\na2 : message  2\ra3 : \x0cmessage 3\x0c')
+            os.chmod(log_file, 0o444)  # read-only
+
+            header, pattern = generate_pattern_from_log_format('<component> : <message>')
+            expected = [['a1', 'message 1'], ['a2', 'message  2'], ['a3', 'message 3']]
+            self.assertEqual(expected, list(read_log_lines(log_file, header=header, pattern=pattern)))
+            self.assertEqual(expected, list(read_log_lines(log_file, header=header, pattern=pattern, engine='mmap')))
+            self.assertEqual(4, get_num_lines(log_file))  # counts '\n' only
+
     # TODO: add more tests
@@ -0,0 +1,100 @@
+import os
+import json
+import time
+import tempfile
+import threading
+import unittest
+from src.metrics import StageMetrics, reset_peak_rss
+
+
+class TestMetrics(unittest.TestCase):
+    def test_stage_metrics(self):
+        metrics = StageMetrics()
+        with metrics.stage('parsing') as counts:
+            counts['lines'] = 1  # not measured before start()
+
+        with tempfile.TemporaryDirectory() as log_dir:
+            report_file = os.path.join(log_dir, 'run_metrics.jsonl')
+            metrics.start(report_file, profile_dir=os.path.join(log_dir, 'profile'))
+            for system in ['A', 'B']:
+                metrics.start_system(system)
+                with metrics.stage('split_log') as counts:
+                    with metrics.stage('discovery') as discovery_counts:
+                        time.sleep(0.05)
+                        discovery_counts['files'] = 2
+                    counts['lines'] = 10
+                for chunk in metrics.iter_stage('parsing', [[1, 2], [3]]):
+                    metrics.count('parsing', bytes=100)
+            metrics.finish(args={'system': None})
+
+            with open(report_file) as f:
+                records = [json.loads(line) for line in f]
+            self.assertEqual(['split_log', 'discovery', 'parsing', 'total'] * 2, [r['stage'] for r in records])
+            self.assertEqual(['A'] * 4 + ['B'] * 4, [r['system'] for r in records])
+            split, discovery, parsing, total = records[:4]
+            self.assertEqual(10, split['lines'])
+            self.assertLess(split['wall_sec'], 0.05)  # exclusive of the nested discovery
+            self.assertGreaterEqual(discovery['wall_sec'], 0.05)
+            self.assertEqual(2, discovery['files'])
+            self.assertEqual((3, 3, 200), (parsing['calls'], parsing['lines'], parsing['bytes']))
+            self.assertGreaterEqual(total['wall_sec'], discovery['wall_sec'])
+            self.assertGreater(total['peak_rss_mb'], 0)
+
+            with open(os.path.join(log_dir, 'run_metrics.json')) as f:
+                report = json.load(f)
+            self.assertEqual({'system': None}, report['args'])
+            self.assertEqual(records[4:], list(report['systems']['B'].values()))
+            self.assertEqual(['A_discovery.prof', 'A_parsing.prof', 'A_split_log.prof',
+                              'B_discovery.prof', 'B_parsing.prof', 'B_split_log.prof'],
+                             sorted(os.listdir(os.path.join(log_dir, 'profile'))))
+
+    def test_stages_in_threads(self):
+        metrics = StageMetrics()
+        with tempfile.TemporaryDirectory() as log_dir:
+            metrics.start(os.path.join(log_dir, 'run_metrics.jsonl'))
+            metrics.start_system('A')
+
+            def write():
+                for _ in range(100):
+                    with metrics.stage('writing') as counts:
+                        counts['lines'] = 1
+
+            with metrics.stage('parsing') as counts:
+                # the writer thread does not pause or nest into `parsing`
+                threads = [threading.Thread(target=write) for _ in range(4)]
+                for thread in threads:
+                    thread.start()
+                time.sleep(0.05)
+                for thread in threads:
+                    thread.join()
+                counts['lines'] = 10
+            metrics.finish()
+
+            with open(os.path.join(log_dir, 'run_metrics.json')) as f:
+                records = json.load(f)['systems']['A']
+            self.assertEqual((400, 400), (records['writing']['calls'], records['writing']['lines']))
+            self.assertEqual((1, 10), (records['parsing']['calls'], records['parsing']['lines']))
+            self.assertGreaterEqual(records['parsing']['wall_sec'], 0.05)
+
+    @unittest.skipUnless(reset_peak_rss(), 'the peak RSS cannot be reset (not Linux)')
+    def test_stage_memory(self):
+        metrics = StageMetrics()
+        with tempfile.TemporaryDirectory() as log_dir:
+            metrics.start(os.path.join(log_dir, 'run_metrics.jsonl'))
+            metrics.start_system('A')
+            with metrics.stage('parsing'):
+                data = bytearray(200 * 1024 * 1024)
+                data[::4096] = b'x' * len(data[::4096])  # touch every page
+            with metrics.stage('mining'):
+                del data
+            with metrics.stage('writing'):
+                pass
+            metrics.finish()
+
+            with open(os.path.join(log_dir, 'run_metrics.json')) as f:
+                records = json.load(f)['systems']['A']
+            self.assertGreater(records['parsing']['rss_delta_mb'], 150)
+            self.assertLess(records['mining']['rss_delta_mb'], -150)
+            # the peak is of the stage, not of the run so far
+            self.assertGreater(records['parsing']['peak_rss_mb'] - records['writing']['peak_rss_mb'], 150)
+            self.assertGreaterEqual(records['total']['peak_rss_mb'], records['parsing']['peak_rss_mb'])
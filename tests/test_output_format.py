@@ -0,0 +1,74 @@
+import os
+import tempfile
+import unittest
+import importlib.util
+import pandas as pd
+from src.output_format import *
+
+
+def get_chunks():
+    return [
+        pd.DataFrame({'logID': [1, 1], 'lineID': [1, 2], 'tid': ['E1', 'E2'], 'template': ['a <*>', 'b'],
+                      'message': ['a 1', 'b'], 'values': [['1'], []]}),
+        pd.DataFrame({'logID': [2, 2], 'lineID': [1, 2], 'tid': ['E3', 'E1'], 'template': ['c', 'a <*>'],
+                      'message': ['c', 'a 2'], 'values': ['[]', "['2']"]}),
+    ]
+
+
+class TestOutputFormat(unittest.TestCase):
+    def test_compact_df(self):
+        df = compact_df(get_chunks()[1])
+        self.assertEqual('uint32', df['logID'].dtype)
+        self.assertEqual('uint32', df['lineID'].dtype)
+        self.assertIsInstance(df['tid'].dtype, pd.CategoricalDtype)
+        self.assertIsInstance(df['template'].dtype, pd.CategoricalDtype)
+        self.assertEqual(object, df['message'].dtype)
+        self.assertEqual([[], ['2']], list(df['values']))
+
+    def test_write_csv(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            output_file = get_output_file(output_dir, 'test_system', 'csv')
+            with DataFrameWriter(output_file) as writer:
+                for df in get_chunks():
+                    writer.write(df)
+            with DataFrameWriter(output_file, append=True) as writer:
+                writer.write(get_chunks()[0])
+            self.assertEqual(2, writer.num_rows)
+            self.assertEqual(['logID', 'lineID', 'tid', 'template', 'message', 'values'],
+                             list(pd.read_csv(output_file).columns))
+            self.assertEqual(6, len(pd.read_csv(output_file)))
+
+    def test_write_in_background(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            output_file = get_output_file(output_dir, 'test_system', 'csv')
+            with DataFrameWriter(output_file, background=True) as writer:
+                for _ in range(10):
+                    for df in get_chunks():
+                        writer.write(df)
+            self.assertEqual(40, writer.num_rows)
+            expected = pd.concat(get_chunks() * 10, ignore_index=True)
+            pd.testing.assert_frame_equal(expected.astype(str), pd.read_csv(output_file, dtype=str))
+
+            # an error of the writer thread is raised in the caller
+            with self.assertRaises(OSError):
+                with DataFrameWriter(os.path.join(output_dir, 'missing', 'test.csv'), background=True) as writer:
+                    for df in get_chunks() * 10:
+                        writer.write(df)
+
+    @unittest.skipUnless(importlib.util.find_spec('pyarrow'), 'pyarrow is not installed')
+    def test_write_columnar(self):
+        expected = pd.concat([compact_df(df) for df in get_chunks()], ignore_index=True)
+        for output_format, read in [('parquet', pd.read_parquet), ('feather', pd.read_feather)]:
+            with tempfile.TemporaryDirectory() as output_dir:
+                output_file = get_output_file(output_dir, 'test_system', output_format)
+                with DataFrameWriter(output_file, output_format) as writer:
+                    for df in get_chunks():
+                        writer.write(df)
+                actual = read(output_file)
+                self.assertEqual('uint32', actual['lineID'].dtype)
+                self.assertEqual(['E1', 'E2', 'E3', 'E1'], list(actual['tid'].astype(str)))
+                self.assertEqual(list(expected['template'].astype(str)), list(actual['template'].astype(str)))
+                self.assertEqual(list(expected['values']), [list(values) for values in actual['values']])
+
+        with self.assertRaises(ValueError):
+            DataFrameWriter('test.parquet', 'parquet', append=True)
@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+import unittest
+from src.parse_cache import *
+from src.log_preprocess import load_logs_into_df, get_logs_df, get_log_files_under_dir
+
+
+class TestParseCache(unittest.TestCase):
+    def test_load_logs_into_df(self):
+        log_format = '<date> <time> <process> <level> <component>: <message>'
+        with tempfile.TemporaryDirectory() as work_dir:
+            log_dir = os.path.join(work_dir, 'logs')
+            os.makedirs(log_dir)
+            for i in range(3):
+                shutil.copy(os.path.join('dataset', 'sample', 'HDFS', 'HDFS_2k.log'),
+                            os.path.join(log_dir, f'HDFS_{i}.log'))
+            log_files = get_log_files_under_dir(log_dir=log_dir)
+            expected = load_logs_into_df(log_format=log_format, log_files=log_files, file_ext='.log')
+
+            cache = ParsedLogCache(os.path.join(work_dir, 'cache'))
+            for jobs in [1, 2]:
+                logs_df = load_logs_into_df(log_format=log_format, log_files=log_files, file_ext='.log', jobs=jobs,
+                                            parse_cache=cache)
+                pd.testing.assert_frame_equal(expected, logs_df)
+            self.assertEqual((3, 3), (cache.hits, cache.misses))
+
+            # only the modified file is parsed again
+            with open(os.path.join(log_dir, 'HDFS_1.log'), 'a') as f:
+                f.write('081111 000000 1 INFO dfs.DataNode: appended\n')
+            logs_df = load_logs_into_df(log_format=log_format, log_files=log_files, file_ext='.log',
+                                        parse_cache=cache)
+            self.assertEqual((5, 4), (cache.hits, cache.misses))
+            self.assertEqual(len(expected) + 1, len(logs_df))
+            self.assertEqual('appended', logs_df[logs_df['logID'] == 2]['message'].iloc[-1])
+
+            # the split logs are cached as a whole, with the split keyword
+            split_df = get_logs_df(system='HDFS', log_dir=log_dir, file_ext='.log', log_format=log_format,
+                                   log_split_keyword='Receiving block', parse_cache=cache)
+            pd.testing.assert_frame_equal(split_df, get_logs_df(system='HDFS', log_dir=log_dir, file_ext='.log',
+                                                                log_format=log_format,
+                                                                log_split_keyword='Receiving block',
+                                                                parse_cache=cache))
+            self.assertEqual((6, 5), (cache.hits, cache.misses))
+            get_logs_df(system='HDFS', log_dir=log_dir, file_ext='.log', log_format=log_format,
+                        log_split_keyword='PacketResponder', parse_cache=cache)
+            self.assertEqual((6, 6), (cache.hits, cache.misses))
+
+    def test_evict(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            df = pd.DataFrame({'message': [f'message {i}' for i in range(1000)]})
+            cache = ParsedLogCache(cache_dir, max_size=0)
+            cache.put('a', df)
+            self.assertIsNone(cache.get('a'))
+
+            cache.max_size = PARSE_CACHE_SIZE
+            cache.put('a', df)
+            cache.max_size = os.path.getsize(os.path.join(cache_dir, 'a.pkl')) * 2
+            cache.put('b', df)
+            os.utime(os.path.join(cache_dir, 'a.pkl'), (0, 0))  # least recently used
+            cache.put('c', df)
+            self.assertIsNone(cache.get('a'))
+            pd.testing.assert_frame_equal(df, cache.get('b'))
+            pd.testing.assert_frame_equal(df, cache.get('c'))
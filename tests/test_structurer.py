@@ -0,0 +1,64 @@
+import os
+import tempfile
+import unittest
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from src.structurer import LogStructurer
+from src.log_preprocess import get_structured_logs_df
+
+SETTINGS = {
+    'log_format': '<date> <time> <process> <level> <component>: <message>',
+    'template_dir': os.path.join('dataset', 'sample', 'HDFS'),
+}
+
+
+class TestLogStructurer(unittest.TestCase):
+    def setUp(self):
+        with open(os.path.join('dataset', 'sample', 'HDFS', 'HDFS_2k.log'), 'r') as f:
+            self.lines = f.readlines()
+
+    def test_structure(self):
+        structurer = LogStructurer(SETTINGS, system='HDFS')
+        logs_df = structurer.structure(self.lines)
+        with tempfile.TemporaryDirectory() as output_dir:
+            expected, _ = get_structured_logs_df(system='HDFS', log_dir=os.path.join('dataset', 'sample', 'HDFS'),
+                                                 file_ext='.log', log_format=SETTINGS['log_format'],
+                                                 template_dir=SETTINGS['template_dir'], output_dir=output_dir)
+        self.assertEqual(expected.drop(columns=['logID']).values.tolist(), logs_df.values.tolist())
+        self.assertEqual(logs_df.iloc[:10].to_dict('records'), structurer.structure(self.lines[:10], as_records=True))
+
+        # not matching the log format (skipped) or any template (kept)
+        records = structurer.structure(['no format', '081109 203615 148 INFO dfs.DataNode:  no template '],
+                                       as_records=True)
+        self.assertEqual([(2, 'no template', '-', '__NOT_MATCHING__', '-')],
+                         [(r['lineID'], r['message'], r['tid'], r['template'], r['values']) for r in records])
+
+    def test_structure_in_threads(self):
+        structurer = LogStructurer(SETTINGS, system='HDFS', match_cache_size=100)
+        expected = LogStructurer(SETTINGS, system='HDFS').structure(self.lines)
+        batches = [self.lines[i:i + 100] for i in range(0, len(self.lines), 100)] * 4
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(structurer.structure, batches))
+        for i, logs_df in enumerate(results):
+            start = i % 20 * 100
+            self.assertEqual(expected.iloc[start:start + 100].drop(columns=['lineID']).values.tolist(),
+                             logs_df.drop(columns=['lineID']).values.tolist())
+
+    def test_structure_without_templates(self):
+        structurer = LogStructurer({'log_format': SETTINGS['log_format']}, templates_df=None)
+        logs_df = structurer.structure(self.lines[:3])
+        self.assertEqual(['lineID', 'date', 'time', 'process', 'level', 'component', 'message'], list(logs_df.columns))
+        self.assertEqual([1, 2, 3], logs_df['lineID'].tolist())
+
+        templates_df = pd.DataFrame({'template': ['PacketResponder <*> for block blk_<*> terminating']},
+                                    index=pd.Index(['E10'], name='tid'))
+        records = LogStructurer(SETTINGS, templates_df=templates_df).structure(self.lines[:1], as_records=True)
+        self.assertEqual(('E10', ['1', '38865049064139660']), (records[0]['tid'], records[0]['values']))
+
+    def test_invalid_settings(self):
+        with self.assertRaises(ValueError):
+            LogStructurer({'log_format': ''}, system='Apache')
+        with self.assertRaises(ValueError):
+            LogStructurer({'log_format': '<date> <time>'})
+        with self.assertRaises(FileNotFoundError):
+            LogStructurer(SETTINGS, system='unknown')